@@ -4,6 +4,8 @@ import json
 import re
 import time
 
+from aws_updater.deadline import DeadlineCaller, DeadlineExceededException
+
 SUCCESSFUL_STATES_COMPLETE = (
     "CREATE_COMPLETE", "UPDATE_COMPLETE", "DELETE_COMPLETE")
 
@@ -17,10 +19,10 @@ def get_event_epoch(event):
     return td.seconds + td.days * 24 * 3600
 
 
-def search_for_event(stack, younger_than, filter_fun):
+def search_for_event(stack, younger_than, filter_fun, events=None):
     if not stack:
         return None
-    for event in stack.describe_events():
+    for event in stack.describe_events() if events is None else events:
         if filter_fun(event):
             event_epoch = get_event_epoch(event)
             if event_epoch > younger_than:
@@ -28,11 +30,11 @@ def search_for_event(stack, younger_than, filter_fun):
     return None
 
 
-def dump_new_events(stack, younger_than):
+def dump_new_events(stack, younger_than, events=None):
     if not stack:
         return None
 
-    for event in stack.describe_events():
+    for event in stack.describe_events() if events is None else events:
         event_epoch = get_event_epoch(event)
         if event_epoch > younger_than:
             dump_event(event, oneline=True)
@@ -110,8 +112,14 @@ def dump_resource(d):
     dump(d, "resource", 1, ["stack_id", "connection", "stack_name"])
 
 
-def wait_for_start_event(connection, stack_name, action_timeout, lenient_look_back):
-    started = time.time()
+def describe_events(caller, stack, deadline):
+    if not stack:
+        return None
+    return caller.hedged_call("cloudformation.describe_stack_events", deadline, stack.describe_events)
+
+
+def wait_for_start_event(connection, stack_name, action_timeout, lenient_look_back, clock=time):
+    started = clock.time()
     check_until = started + action_timeout
     print "waiting for max. %i seconds for an action to start on %s" % (action_timeout, stack_name)
     # print "        now: %s" % format_epoch(started)
@@ -119,52 +127,66 @@ def wait_for_start_event(connection, stack_name, action_timeout, lenient_look_ba
     print
     younger_than = started - lenient_look_back
 
+    caller = DeadlineCaller(clock)
     stack = None
     last = started
-    while time.time() < check_until:
-        # print "checking events for start event on stack %s" % stack_name
-        last = dump_new_events(stack, last)
-        if not stack:
-            stack = describe_stack(connection, stack_name)
-        if not stack:
-            print "stack does not exist yet"
-        start_event = search_for_event(
-            stack,
-            younger_than,
-            lambda event: event.resource_type == "AWS::CloudFormation::Stack" and event.resource_status.endswith("_PROGRESS")
-        )
-        if start_event:
-            return (stack, start_event)
-        time.sleep(1)
+    try:
+        while clock.time() < check_until:
+            # print "checking events for start event on stack %s" % stack_name
+            if not stack:
+                stack = caller.hedged_call("cloudformation.describe_stacks", check_until,
+                                           describe_stack, connection, stack_name)
+            if not stack:
+                print "stack does not exist yet"
+            events = describe_events(caller, stack, check_until)
+            last = dump_new_events(stack, last, events)
+            start_event = search_for_event(
+                stack,
+                younger_than,
+                lambda event: event.resource_type == "AWS::CloudFormation::Stack" and event.resource_status.endswith("_PROGRESS"),
+                events
+            )
+            if start_event:
+                return (stack, start_event)
+            clock.sleep(1)
+    except DeadlineExceededException as e:
+        print e
     return (stack, None)
 
 
-def wait_for_end_event(connection, stack, younger_than, action_timeout):
-    started = time.time()
+def wait_for_end_event(connection, stack, younger_than, action_timeout, clock=time):
+    started = clock.time()
     check_until = started + action_timeout
     print "waiting for max. %i seconds for an event to occur on %s" % (action_timeout, stack.stack_name)
     print
 
+    caller = DeadlineCaller(clock)
     last = started
-    while time.time() < check_until:
-        new_last = dump_new_events(stack, last)
-        if new_last != last:
-            last = new_last
-            check_until = last + action_timeout
-        end_event = search_for_event(
-            stack,
-            younger_than,
-            lambda event: event.resource_type == "AWS::CloudFormation::Stack" and event.resource_status.endswith("_COMPLETE") and event.logical_resource_id == stack.stack_name
-        )
-        if end_event:
-            return (stack, end_event)
-        time.sleep(1)
+    try:
+        while clock.time() < check_until:
+            events = describe_events(caller, stack, check_until)
+            new_last = dump_new_events(stack, last, events)
+            if new_last != last:
+                last = new_last
+                check_until = last + action_timeout
+            end_event = search_for_event(
+                stack,
+                younger_than,
+                lambda event: event.resource_type == "AWS::CloudFormation::Stack" and event.resource_status.endswith("_COMPLETE") and event.logical_resource_id == stack.stack_name,
+                events
+            )
+            if end_event:
+                return (stack, end_event)
+            clock.sleep(1)
+    except DeadlineExceededException as e:
+        print e
     return (stack, None)
 
 
-def wait_for_action_to_complete(cloudformation_conn, stack_name, warmup_seconds, lenient_look_back, action_timeout):
+def wait_for_action_to_complete(cloudformation_conn, stack_name, warmup_seconds, lenient_look_back, action_timeout,
+                                clock=time):
     (stack, start_event) = wait_for_start_event(
-        cloudformation_conn, stack_name, warmup_seconds, lenient_look_back)
+        cloudformation_conn, stack_name, warmup_seconds, lenient_look_back, clock)
     if not start_event:
         print "no start event encountered"
         return 2
@@ -172,7 +194,7 @@ def wait_for_action_to_complete(cloudformation_conn, stack_name, warmup_seconds,
     print
 
     (stack, end_event) = wait_for_end_event(
-        cloudformation_conn, stack, get_event_epoch(start_event), action_timeout)
+        cloudformation_conn, stack, get_event_epoch(start_event), action_timeout, clock)
     print
     if not end_event:
         print "no end event encountered within %i seconds" % action_timeout
@@ -1,5 +1,14 @@
 from __future__ import print_function
+import logging
+import threading
 import time
+from multiprocessing.pool import ThreadPool
+
+from aws_updater import events
+from aws_updater.deadline import DeadlineCaller, DeadlineExceededException
+from aws_updater.elb import ELBHealthPoller
+from aws_updater.locking import LeaseLostException
+from aws_updater.utils import with_thread_output
 
 
 class UnhealthyInstanceFound(Exception):
@@ -14,11 +23,46 @@ class RolledBackException(Exception):
     pass
 
 
+class CancelledException(Exception):
+    pass
+
+
+class InstanceView(object):
+    """
+    Compact view of a single instance, merged from the EC2, AutoScaling and ELB APIs.
+    Only holds the fields the updater actually reads.
+    """
+    __slots__ = ("instance_id", "image_id", "launch_config_name", "elb_state", "private_ip_address", "probe_ready")
+
+    def __init__(self, instance_id, image_id=None, launch_config_name=None, elb_state=None, private_ip_address=None,
+                 probe_ready=None):
+        self.instance_id = instance_id
+        self.image_id = image_id
+        self.launch_config_name = launch_config_name
+        self.elb_state = elb_state
+        self.private_ip_address = private_ip_address
+        self.probe_ready = probe_ready
+
+    def state(self):
+        return (self.image_id, self.launch_config_name, self.elb_state, self.probe_ready)
+
+    def __repr__(self):
+        return "InstanceView({0}, {1}, {2}, {3}, {4})".format(self.instance_id, *self.state())
+
+
 class ASGUpdater(object):
     RUNNING_LIFECYCLE_STATES = ("Pending", "InService", "Rebooting")
-    SCALE_OUT_COMPLETED = "SCALE_OUT_COMPLETED"
-
-    def __init__(self, asg, as_conn, ec2_conn, elb_conn, observer_callback=None, timeout_in_seconds=None):
+    STANDBY = "Standby"
+    SCALE_OUT_COMPLETED = events.SCALE_OUT_COMPLETED
+    IN_SERVICE = "InService"
+    SUMMARY_EVERY_N_TICKS = 30
+    MAX_CONCURRENT_REQUESTS = 10
+
+    def __init__(self, asg, as_conn, ec2_conn, elb_conn, observer_callback=None, timeout_in_seconds=None,
+                 strict_update_check=False, elb_health_poller=None, event_bus=None, clock=None,
+                 readiness_prober=None, require_elb_in_service=False, prewarm_standby=False, cancelled=None,
+                 lease_lost=None):
+        self.logger = logging.getLogger(__name__)
         self.asg = asg
         self.as_conn = as_conn
         self.ec2_conn = ec2_conn
@@ -26,17 +70,66 @@ class ASGUpdater(object):
         self.original_desired_capacity = None
         self.original_min_size = None
         self.original_max_size = None
+        self.target_launch_config_name = None
         self.timeout_in_seconds = timeout_in_seconds or 600
+        self.strict_update_check = strict_update_check
+        self.clock = clock or time
+        self.readiness_prober = readiness_prober
+        self.require_elb_in_service = require_elb_in_service
+        self.prewarm_standby = prewarm_standby
+        if prewarm_standby and not readiness_prober:
+            raise ValueError("Pre-warming instances in standby needs a readiness probe, they are not in the ELB.")
+        self.elb_health_poller = elb_health_poller or ELBHealthPoller(elb_conn, clock=self.clock)
+        self.caller = DeadlineCaller(self.clock)
+        self._printed_states = {}
+        self._ticks_since_summary = 0
+        self._ready_instance_ids = set()
+        # instances already running the new launch configuration before a pre-warmed update
+        self._uptodate_instance_ids_kept = set()
+        # set by cancel() or, shared between the updaters of a stack, by StackUpdater.cancel()
+        self._cancelled = threading.Event()
+        self._stack_cancelled = cancelled
+        # set when a lease the update is made under expired, e.g. by StackUpdater.leased
+        self._lease_lost = lease_lost
+
+        self.event_bus = event_bus or events.EventBus()
+        if observer_callback:
+            self.event_bus.subscribe(observer_callback)
+
+    def _publish(self, type, **details):
+        self.event_bus.publish(type, asg_name=self.asg.name, **details)
+
+    def cancel(self):
+        """
+        Makes a running update roll back within a second, e.g. from another thread.
+        """
+        self._cancelled.set()
 
-        dummy_observer_callback = lambda event: None
-        self.observer_callback = observer_callback or dummy_observer_callback
+    def is_cancelled(self):
+        return self._cancelled.is_set() or (self._stack_cancelled is not None and self._stack_cancelled.is_set())
+
+    def _check_lease(self):
+        """
+        Raises LeaseLostException before changing the ASG once another update may hold its lease.
+        """
+        if self._lease_lost is not None and self._lease_lost.is_set():
+            raise LeaseLostException("Lost the lease for updating ASG {0}, another update may be changing it.".format(
+                self.asg.name))
 
     def update(self):
         if self.needs_update():
             try:
-                self.scale_out()
-                self.wait_for_scale_out_complete()
+                if self.prewarm_standby:
+                    self.launch_standby_instances()
+                    self.cut_over()
+                else:
+                    self.scale_out()
+                    self.wait_for_scale_out_complete()
                 self.commit_update()
+            except LeaseLostException:
+                print("Lost the lease while updating ASG {0}, leaving it to the update holding it now.".format(
+                    self.asg.name))
+                raise
             except Exception as e:
                 print("Problem while updating ASG {0} : {1}.\nRolling back now.".format(self.asg.name, e))
                 self.rollback()
@@ -52,58 +145,160 @@ class ASGUpdater(object):
         print("waiting %i seconds for %i instances to have '%s' and be 'InService'" % (self.timeout_in_seconds,
                                                                                        needed_nr_of_uptodate_instances,
                                                                                        self.asg.launch_config_name))
-        start = time.time()
+        start = self.clock.time()
         wait_until = start + self.timeout_in_seconds
-        while True:
-            self.asg = self.as_conn.get_all_groups(names=[self.asg.name])[0]    # TODO refactor
-            instances = self.get_instances_views()
-
-            nr_of_uptodate_instances = self.get_nr_of_uptodate_instances(instances)
-            self.print_instances(instances)
-            if nr_of_uptodate_instances >= needed_nr_of_uptodate_instances:
-                break
-            print("%i instances uptodate, %i needed... waiting for %i seconds" % (nr_of_uptodate_instances, needed_nr_of_uptodate_instances, wait_until - time.time()))
-            if time.time() > wait_until:
-                raise TimeoutException("Timed out waiting for instances in ASG {0} to become healthy.".format(self.asg.name))
-            time.sleep(1)
-
-    def get_instances_views(self):
+        self._printed_states = {}
+        self._ticks_since_summary = 0
+        self._ready_instance_ids = set()
+        load_balancers = list(self.asg.load_balancers or [])
+        for elb_name in load_balancers:
+            self.elb_health_poller.subscribe(elb_name, self)
+        try:
+            while True:
+                self._check_lease()
+                if self.is_cancelled():
+                    raise CancelledException("Update of ASG {0} was cancelled.".format(self.asg.name))
+                self.asg = self.caller.hedged_call("autoscaling.describe_auto_scaling_groups", wait_until,
+                                                   self.as_conn.get_all_groups, names=[self.asg.name])[0]
+                instances = self.get_instances_views(deadline=wait_until)
+
+                nr_of_uptodate_instances = self.get_nr_of_uptodate_instances(instances)
+                self.print_instances(instances)
+                self._publish_ready_instances(instances)
+                if nr_of_uptodate_instances >= needed_nr_of_uptodate_instances:
+                    break
+                now = self.clock.time()
+                print("%i instances uptodate, %i needed... waiting for %i seconds" % (nr_of_uptodate_instances, needed_nr_of_uptodate_instances, wait_until - now))
+                if now > wait_until:
+                    raise TimeoutException("Timed out waiting for instances in ASG {0} to become healthy.".format(self.asg.name))
+                self.clock.sleep(1)
+        except DeadlineExceededException as e:
+            raise TimeoutException("Timed out waiting for instances in ASG {0} to become healthy: {1}".format(
+                self.asg.name, e))
+        finally:
+            for elb_name in load_balancers:
+                self.elb_health_poller.unsubscribe(elb_name, self)
+
+    def get_instances_views(self, deadline=None):
+        """
+        With a deadline, each call has to return before it and the describe calls are hedged.
+        """
         ids = [instance.instance_id for instance in self.asg.instances]
 
         result = {}
-        for i in self.as_conn.get_all_autoscaling_instances(instance_ids=ids):
-            result.setdefault(i.instance_id, {})["asg"] = i
-        for i in self.ec2_conn.get_only_instances(instance_ids=ids):
-            result.setdefault(i.id, {})["ec2"] = i
-        for elb in self.elb_conn.get_all_load_balancers(self.asg.load_balancers):
-            for i in self.elb_conn.describe_instance_health(elb.name):
-                result.setdefault(i.instance_id, {})["elb"] = i
+
+        def view(instance_id):
+            instance_view = result.get(instance_id)
+            if instance_view is None:
+                instance_view = result[instance_id] = InstanceView(instance_id)
+            return instance_view
+
+        for i in self._describe("autoscaling.describe_auto_scaling_instances", deadline,
+                                self.as_conn.get_all_autoscaling_instances, instance_ids=ids):
+            view(i.instance_id).launch_config_name = i.launch_config_name
+        for i in self._describe("ec2.describe_instances", deadline,
+                                self.ec2_conn.get_only_instances, instance_ids=ids):
+            instance_view = view(i.id)
+            instance_view.image_id = i.image_id
+            instance_view.private_ip_address = i.private_ip_address
+        for elb_name in self.asg.load_balancers or []:
+            # not hedged here, the poller shares one fetch between all ASGs of the load balancer
+            for instance_id, state in self.caller.call("elb.get_instance_health", deadline,
+                                                       self.elb_health_poller.get_instance_health, elb_name):
+                view(instance_id).elb_state = state
+        if self.readiness_prober:
+            self._probe_new_instances(result)
 
         return result
 
+    def _describe(self, operation, deadline, function, *args, **kwargs):
+        if deadline is None:
+            return function(*args, **kwargs)
+        return self.caller.hedged_call(operation, deadline, function, *args, **kwargs)
+
+    def _probe_new_instances(self, instances):
+        new_instances = [view for view in instances.itervalues()
+                         if view.launch_config_name == self.asg.launch_config_name and view.private_ip_address]
+        ready_ips = self.readiness_prober.check(view.private_ip_address for view in new_instances)
+        for view in new_instances:
+            view.probe_ready = view.private_ip_address in ready_ips
+
     def print_instances(self, instances):
-        for id, views in instances.iteritems():
-            print("%15s, %10s, %20s, %s" % (id,
-                                            getattr(views.get("ec2", {}), "image_id", "?"),
-                                            getattr(views.get("asg", {}), "launch_config_name", "?"),
-                                            getattr(views.get("elb", {}), "state", "?")
-                                            ))
+        """
+        Prints only the instances whose state changed since the last call,
+        plus a summary by ELB state every SUMMARY_EVERY_N_TICKS calls.
+        """
+        for id, view in sorted(instances.iteritems()):
+            state = view.state()
+            if self._printed_states.get(id) != state:
+                self._printed_states[id] = state
+                print("%15s, %10s, %20s, %s%s" % (id,
+                                                  view.image_id or "?",
+                                                  view.launch_config_name or "?",
+                                                  view.elb_state or "?",
+                                                  "" if view.probe_ready is None else
+                                                  (", probe ok" if view.probe_ready else ", probe failed")))
+        for id in [id for id in self._printed_states if id not in instances]:
+            del self._printed_states[id]
+            print("%15s is gone" % id)
+
+        self._ticks_since_summary += 1
+        if self._ticks_since_summary >= self.SUMMARY_EVERY_N_TICKS:
+            self._ticks_since_summary = 0
+            self.print_summary(instances)
+
+    def print_summary(self, instances):
+        nr_by_state = {}
+        for view in instances.itervalues():
+            state = view.elb_state or "?"
+            nr_by_state[state] = nr_by_state.get(state, 0) + 1
+        print("%i instances: %s" % (len(instances),
+                                    ", ".join("%s: %i" % item for item in sorted(nr_by_state.iteritems()))))
+
+    def is_ready(self, view):
+        """
+        Without a readiness probe, instances are ready once the ELB reports them InService.
+        With a probe, a successful probe is enough, unless ELB InService is required as well.
+        """
+        elb_in_service = view.elb_state == self.IN_SERVICE
+        if not self.readiness_prober:
+            return elb_in_service
+        return bool(view.probe_ready) and (elb_in_service or not self.require_elb_in_service)
+
+    def get_uptodate_instance_ids(self, instances):
+        return [view.instance_id for view in instances.itervalues()
+                if view.launch_config_name == self.asg.launch_config_name and self.is_ready(view)]
 
     def get_nr_of_uptodate_instances(self, instances=None):
         if not instances:
             instances = self.get_instances_views()
-        nr_of_uptodate_instances = 0
-        for id, views in instances.iteritems():
-            if getattr(views.get("asg", {}), "launch_config_name", None) == self.asg.launch_config_name:
-                if getattr(views.get("elb", {}), "state", None) == "InService":  # TODO use constant here
-                    nr_of_uptodate_instances += 1
+        nr_of_uptodate_instances = len(self.get_uptodate_instance_ids(instances))
         print()
 
         return nr_of_uptodate_instances
 
+    def _publish_ready_instances(self, instances):
+        for instance_id in self.get_uptodate_instance_ids(instances):
+            if instance_id not in self._ready_instance_ids:
+                self._ready_instance_ids.add(instance_id)
+                self._publish(events.INSTANCE_READY, instance_id=instance_id)
+
     def needs_update(self):
+        """
+        Only queries the instance views of EC2, AutoScaling and ELB when the launch configs of the
+        ASG's instances differ from the current one, or when a strict update check is requested.
+        """
+        if not self.strict_update_check and not self.has_outdated_instances():
+            return False
         return self.get_nr_of_uptodate_instances() < self.count_running_instances()
 
+    def has_outdated_instances(self):
+        for instance in self.asg.instances:
+            if instance.lifecycle_state in self.RUNNING_LIFECYCLE_STATES and \
+                    instance.launch_config_name != self.asg.launch_config_name:
+                return True
+        return False
+
     def count_running_instances(self):
         count = 0
         for instance in self.asg.instances:
@@ -112,14 +307,14 @@ class ASGUpdater(object):
         return count
 
     def scale_out(self):
+        self._check_lease()
+        self._publish(events.ASG_UPDATE_STARTED, launch_config_name=self.asg.launch_config_name)
         asg_processes_to_keep = ['Launch', 'Terminate', 'HealthCheck', 'AddToLoadBalancer']
         self.asg.suspend_processes()
         self.asg.resume_processes(asg_processes_to_keep)
         print("Disabled autoscaling processes on {0} (except for {1})".format(self.asg.name, asg_processes_to_keep))
 
-        self.original_desired_capacity = self.asg.desired_capacity
-        self.original_min_size = self.asg.min_size
-        self.original_max_size = self.asg.max_size
+        self._save_original_asg_size()
 
         nr_running_instances = self.count_running_instances()
         self.asg.max_size = self.original_max_size + nr_running_instances
@@ -132,7 +327,108 @@ class ASGUpdater(object):
             self.original_desired_capacity, self.asg.desired_capacity))
 
         self.asg.update()
-        self.observer_callback(self.SCALE_OUT_COMPLETED)
+        self._publish(events.SCALE_OUT_COMPLETED, desired_capacity=self.asg.desired_capacity)
+
+    def _save_original_asg_size(self):
+        self.target_launch_config_name = self.asg.launch_config_name
+        self.original_desired_capacity = self.asg.desired_capacity
+        self.original_min_size = self.asg.min_size
+        self.original_max_size = self.asg.max_size
+
+    def _refresh_asg(self):
+        self.asg = self.as_conn.get_all_groups(names=[self.asg.name])[0]
+
+    def _standby_action(self, action, instance_ids, **params):
+        params["AutoScalingGroupName"] = self.asg.name
+        for index, instance_id in enumerate(instance_ids, 1):
+            params["InstanceIds.member.{0}".format(index)] = instance_id
+        self.as_conn.get_status(action, params)
+
+    def launch_standby_instances(self):
+        """
+        Phase one of a pre-warmed update, with only the Launch, Terminate and HealthCheck processes of
+        the ASG running: launches one instance with the new launch configuration per running instance
+        with an old one, moves each into Standby as soon as it is InService and waits for all of them
+        to pass the readiness probe. Instances that were running before stay in service. The ASG has
+        its original size again afterwards.
+        """
+        self._check_lease()
+        self._publish(events.ASG_UPDATE_STARTED, launch_config_name=self.asg.launch_config_name)
+        asg_processes_to_keep = ["Launch", "Terminate", "HealthCheck"]
+        self.asg.suspend_processes()
+        self.asg.resume_processes(asg_processes_to_keep)
+        print("Disabled autoscaling processes on {0} (except for {1})".format(self.asg.name, asg_processes_to_keep))
+        self._save_original_asg_size()
+
+        running_instances = [instance for instance in self.asg.instances
+                             if instance.lifecycle_state in self.RUNNING_LIFECYCLE_STATES]
+        previous_instance_ids = set(instance.instance_id for instance in self.asg.instances)
+        self._uptodate_instance_ids_kept = set(instance.instance_id for instance in running_instances
+                                               if instance.launch_config_name == self.target_launch_config_name)
+        nr_outdated_instances = len(running_instances) - len(self._uptodate_instance_ids_kept)
+        self.asg.max_size = self.original_max_size + nr_outdated_instances
+        self.asg.desired_capacity = self.original_desired_capacity + nr_outdated_instances
+        self.asg.update()
+        print("Launching {0} instances with '{1}' into standby".format(nr_outdated_instances,
+                                                                       self.target_launch_config_name))
+
+        wait_until = self.clock.time() + self.timeout_in_seconds
+        self._printed_states = {}
+        self._ticks_since_summary = 0
+        while True:
+            self._check_lease()
+            if self.is_cancelled():
+                raise CancelledException("Update of ASG {0} was cancelled.".format(self.asg.name))
+            self._refresh_asg()
+            new_instances = [instance for instance in self.asg.instances
+                             if instance.launch_config_name == self.target_launch_config_name and
+                             instance.instance_id not in previous_instance_ids]
+            in_service_ids = [instance.instance_id for instance in new_instances
+                              if instance.lifecycle_state == self.IN_SERVICE]
+            if in_service_ids:
+                self._standby_action("EnterStandby", in_service_ids, ShouldDecrementDesiredCapacity="true")
+                print("Moved instances {0} into standby".format(" ".join(in_service_ids)))
+
+            standby_ids = set(instance.instance_id for instance in new_instances
+                              if instance.lifecycle_state == self.STANDBY)
+            instances = self.get_instances_views()
+            self.print_instances(instances)
+            nr_of_ready_instances = len([view for view in instances.itervalues()
+                                         if view.instance_id in standby_ids and view.probe_ready])
+            if nr_of_ready_instances >= nr_outdated_instances:
+                break
+            if self.clock.time() > wait_until:
+                raise TimeoutException("Timed out waiting for standby instances in ASG {0} to become ready.".format(
+                    self.asg.name))
+            self.clock.sleep(1)
+
+        self._refresh_asg()
+        self.asg.max_size = self.original_max_size
+        self.asg.update()
+        self._publish(events.STANDBY_INSTANCES_READY, instance_ids=sorted(standby_ids))
+
+    def cut_over(self):
+        """
+        Phase two of a pre-warmed update: moves the standby instances InService, which registers them
+        with the ELB, and waits until the ELB reports them InService.
+        """
+        self._check_lease()
+        self._refresh_asg()
+        standby_ids = [instance.instance_id for instance in self.asg.instances
+                       if instance.launch_config_name == self.target_launch_config_name and
+                       instance.lifecycle_state == self.STANDBY and
+                       instance.instance_id not in self._uptodate_instance_ids_kept]
+        self.asg.suspend_processes()
+        self.asg.resume_processes(["Launch", "Terminate", "HealthCheck", "AddToLoadBalancer"])
+        print("Disabled autoscaling processes on {0} for the cutover".format(self.asg.name))
+
+        self.asg.max_size = self.original_max_size + len(standby_ids)
+        self.asg.update()
+        self._standby_action("ExitStandby", standby_ids)
+        self._publish(events.SCALE_OUT_COMPLETED, desired_capacity=self.original_desired_capacity + len(standby_ids))
+
+        self.require_elb_in_service = self.require_elb_in_service or bool(self.asg.load_balancers)
+        self.wait_for_scale_out_complete(len(standby_ids) + len(self._uptodate_instance_ids_kept))
 
     def commit_update(self):
         """
@@ -140,14 +436,17 @@ class ASGUpdater(object):
         * Restores the old ASG parameters
         * Resumes all ASG processes
         """
+        self._check_lease()
+        launch_config_name = self.target_launch_config_name or self.asg.launch_config_name
         instances_with_old_launch_config = [instance.instance_id for instance in self.asg.instances
-                                            if instance and instance.launch_config_name != self.asg.launch_config_name]
+                                            if instance and instance.launch_config_name != launch_config_name]
 
         self._terminate_instances(instances_with_old_launch_config)
         self._restore_original_asg_size()
 
         self.asg.resume_processes()
         print("Resumed all ASG processes on {0}".format(self.asg.name))
+        self._publish(events.ASG_UPDATE_COMPLETED, terminated_instance_ids=instances_with_old_launch_config)
 
     def rollback(self):
         """
@@ -155,13 +454,18 @@ class ASGUpdater(object):
         * Restores the old ASG parameters
         * Marks the ASG as degraded
         """
+        self._check_lease()
+        self._publish(events.ROLLBACK_STARTED)
+        launch_config_name = self.target_launch_config_name or self.asg.launch_config_name
         instances_with_new_launch_config = [instance.instance_id for instance in self.asg.instances
-                                            if instance and instance.launch_config_name == self.asg.launch_config_name]
+                                            if instance and instance.launch_config_name == launch_config_name]
 
         self._terminate_instances(instances_with_new_launch_config)
         self._restore_original_asg_size()
+        self._publish(events.ROLLBACK_COMPLETED, terminated_instance_ids=instances_with_new_launch_config)
 
     def _restore_original_asg_size(self):
+        self._check_lease()
         print("Resetting ASG parameters:\n\tmax_size: {1} -> {0}\n\tmin_size: {3} -> {2}\n\tdesired_capacity: {5} -> {4}".format(
             self.original_max_size, self.asg.max_size,
             self.original_min_size, self.asg.min_size,
@@ -173,10 +477,66 @@ class ASGUpdater(object):
 
         self.asg.update()
 
+    def _map_concurrently(self, function, items):
+        if len(items) <= 1:
+            return map(function, items)
+        pool = ThreadPool(min(len(items), self.MAX_CONCURRENT_REQUESTS))
+        try:
+            return pool.map(with_thread_output(function), items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _deregister_from_load_balancers(self, instances):
+        """
+        Deregisters the instances from all load balancers of the ASG concurrently and returns
+        the longest connection draining timeout among them. Failures are only logged, the
+        instances are terminated anyway.
+        """
+        def deregister(elb_name):
+            try:
+                self.elb_conn.deregister_instances(elb_name, instances)
+                attribute = self.elb_conn.get_lb_attribute(elb_name, "connectionDraining")
+            except Exception as e:
+                self.logger.warning("Unable to deregister instances from {0}: {1}".format(elb_name, e))
+                return 0
+            return attribute.timeout if attribute is not None and attribute.enabled else 0
+
+        load_balancers = list(self.asg.load_balancers or [])
+        print("Deregistering instances {0} from {1}".format(" ".join(instances), ", ".join(load_balancers)))
+        return max(self._map_concurrently(deregister, load_balancers))
+
+    def _wait_until_drained(self, instances, load_balancers, drain_timeout_in_seconds):
+        """
+        Waits until no load balancer lists the instances any more, at most for the draining timeout.
+        """
+        wait_until = self.clock.time() + drain_timeout_in_seconds
+        draining = set(instances)
+        while True:
+            draining = set(instance_id for elb_name in load_balancers
+                           for (instance_id, state) in self.elb_health_poller.get_instance_health(elb_name)
+                           if instance_id in draining)
+            if not draining:
+                return
+            if self.clock.time() >= wait_until:
+                print("Connection draining of {0} did not finish within {1} seconds".format(
+                    " ".join(sorted(draining)), drain_timeout_in_seconds))
+                return
+            self.clock.sleep(1)
+
     def _terminate_instances(self, instances):
+        """
+        Drains the instances from the ASG's load balancers first, so in-flight requests are not cut off.
+        """
         if not instances:
             print("No instances to terminate.")
             return
+        load_balancers = list(self.asg.load_balancers or [])
+        if load_balancers:
+            drain_timeout_in_seconds = self._deregister_from_load_balancers(instances)
+            self._wait_until_drained(instances, load_balancers, drain_timeout_in_seconds)
+
         print("Terminating instances {0}".format(" ".join(instances)))
-        for instance in instances:
-            self.as_conn.terminate_instance(instance, decrement_capacity=False)
+        self._map_concurrently(lambda instance: self.as_conn.terminate_instance(instance, decrement_capacity=False),
+                               instances)
+        self._publish(events.INSTANCES_TERMINATED, instance_ids=instances)
@@ -0,0 +1,149 @@
+"""
+Stack updates through CloudFormation change sets, which tell in advance which launch
+configurations and ASGs an update is going to change.
+
+boto 2 has no change set API, the requests go through the JSON interface its
+CloudFormationConnection uses for all other stack operations.
+"""
+import logging
+import re
+import time
+
+ASG_RESOURCE_TYPE = "AWS::AutoScaling::AutoScalingGroup"
+LAUNCH_CONFIG_RESOURCE_TYPE = "AWS::AutoScaling::LaunchConfiguration"
+# changes to these ASG properties replace the launch configuration of its instances
+ROLLING_ASG_PROPERTIES = ("LaunchConfigurationName",)
+PENDING_STATES = ("CREATE_PENDING", "CREATE_IN_PROGRESS")
+NO_CHANGES_REASONS = ("didn't contain changes", "No updates are to be performed")
+
+
+class ChangeSetFailedException(Exception):
+    pass
+
+
+def needs_rolling_update(resource_change):
+    """
+    An ASG needs a rolling update when it is modified in place and the change touches its launch
+    configuration. Changes without details are treated as touching it.
+    """
+    if resource_change.get("ResourceType") != ASG_RESOURCE_TYPE or resource_change.get("Action") != "Modify":
+        return False
+    if resource_change.get("Replacement") == "True":
+        return False
+    details = resource_change.get("Details")
+    if not details:
+        return True
+    return any(detail.get("Target", {}).get("Name") in ROLLING_ASG_PROPERTIES for detail in details)
+
+
+def format_resource_change(resource_change):
+    replacement = resource_change.get("Replacement")
+    return "%10s  %-30s %-30s %s" % (resource_change.get("Action"),
+                                     resource_change.get("LogicalResourceId"),
+                                     re.sub(".*::", "", resource_change.get("ResourceType", "")),
+                                     "replacement: %s" % replacement if replacement else "")
+
+
+class ChangeSetUpdate(object):
+
+    def __init__(self, cfn_conn, stack_name, preview_only=False, timeout_in_seconds=300, clock=time):
+        self.logger = logging.getLogger(__name__)
+        self.cfn_conn = cfn_conn
+        self.stack_name = stack_name
+        self.preview_only = preview_only
+        self.timeout_in_seconds = timeout_in_seconds
+        self.clock = clock
+        self.change_set_id = None
+        self.resource_changes = []
+
+    def _request(self, action, **params):
+        params["ContentType"] = "JSON"
+        response = self.cfn_conn._do_request(action, params, "/", "POST")
+        return response["{0}Response".format(action)].get("{0}Result".format(action)) or {}
+
+    def create(self, template, stack_parameters, template_url=None):
+        params = {"StackName": self.stack_name,
+                  "ChangeSetName": "aws-ha-updater-{0}".format(int(self.clock.time())),
+                  "Capabilities.member.1": "CAPABILITY_IAM"}
+        if template_url:
+            params["TemplateURL"] = template_url
+        else:
+            params["TemplateBody"] = template
+        for index, (key, value) in enumerate(sorted(stack_parameters.iteritems()), 1):
+            params["Parameters.member.{0}.ParameterKey".format(index)] = key
+            params["Parameters.member.{0}.ParameterValue".format(index)] = value
+        self.change_set_id = self._request("CreateChangeSet", **params)["Id"]
+        self.logger.info("Created change set {0}.".format(self.change_set_id))
+
+    def wait_for_changes(self):
+        """
+        Returns False when the change set contains no changes, raises ChangeSetFailedException
+        when CloudFormation could not create it.
+        """
+        wait_until = self.clock.time() + self.timeout_in_seconds
+        while True:
+            description = self._request("DescribeChangeSet", ChangeSetName=self.change_set_id)
+            status = description.get("Status")
+            if status not in PENDING_STATES:
+                break
+            if self.clock.time() > wait_until:
+                raise ChangeSetFailedException("Timed out waiting for change set {0}.".format(self.change_set_id))
+            self.clock.sleep(1)
+
+        if status != "CREATE_COMPLETE":
+            reason = description.get("StatusReason") or ""
+            if any(no_changes_reason in reason for no_changes_reason in NO_CHANGES_REASONS):
+                return False
+            raise ChangeSetFailedException("Change set {0} is {1}: {2}".format(self.change_set_id, status, reason))
+
+        self.resource_changes = []
+        while True:
+            self.resource_changes.extend(change["ResourceChange"] for change in description.get("Changes") or []
+                                         if change.get("Type") == "Resource")
+            if not description.get("NextToken"):
+                return True
+            description = self._request("DescribeChangeSet", ChangeSetName=self.change_set_id,
+                                        NextToken=description["NextToken"])
+
+    def get_changed_launch_config_ids(self):
+        return [change["LogicalResourceId"] for change in self.resource_changes
+                if change.get("ResourceType") == LAUNCH_CONFIG_RESOURCE_TYPE]
+
+    def get_asg_names_to_update(self):
+        return [change["PhysicalResourceId"] for change in self.resource_changes if needs_rolling_update(change)]
+
+    def print_preview(self):
+        print "change set for stack %s:" % self.stack_name
+        for change in self.resource_changes:
+            print format_resource_change(change)
+        print "launch configurations changing: %s" % (", ".join(self.get_changed_launch_config_ids()) or "none")
+        print "ASGs to update: %s" % (", ".join(self.get_asg_names_to_update()) or "none")
+        print
+
+    def execute(self):
+        self._request("ExecuteChangeSet", ChangeSetName=self.change_set_id)
+
+    def delete(self):
+        self._request("DeleteChangeSet", ChangeSetName=self.change_set_id)
+
+    def run(self, template, stack_parameters, template_url=None):
+        """
+        Creates the change set, prints its preview and executes it. Returns False when there was
+        nothing to update or only a preview was requested, the change set is deleted then.
+        """
+        self.create(template, stack_parameters, template_url)
+        try:
+            has_changes = self.wait_for_changes()
+        except Exception:
+            self.delete()
+            raise
+        if not has_changes:
+            self.logger.info("Nothing to do: change set {0} contains no changes.".format(self.change_set_id))
+            self.delete()
+            return False
+        self.print_preview()
+        if self.preview_only:
+            self.delete()
+            return False
+        self.execute()
+        return True
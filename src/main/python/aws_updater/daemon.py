@@ -0,0 +1,273 @@
+"""
+Long-running daemon keeping AWS connections and caches warm between jobs.
+
+Jobs are requested over a local unix socket as one JSON line, e.g.
+{"job": "update-asgs", "arguments": {"stack_name": "any-stack", "region": "eu-west-1"}, "credentials": "..."},
+and the daemon streams back JSON lines: {"output": "..."} while the job runs and
+{"exit_code": 0} when it is done. Jobs run with the daemon's AWS credentials, so the daemon
+declines jobs of clients whose credential environment differs: {"declined": "..."}.
+A client closing its side of the connection cancels its job.
+
+The client part of this module does not import boto, so scripts acting as thin
+clients start fast.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+
+from aws_updater.utils import get_thread_output, set_thread_output
+
+SOCKET_ENVIRONMENT_VARIABLE = "AWS_HA_UPDATER_SOCKET"
+# the environment boto takes credentials from
+CREDENTIAL_ENVIRONMENT_VARIABLES = ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN",
+                                    "AWS_SESSION_TOKEN", "AWS_PROFILE", "AWS_CREDENTIAL_FILE", "BOTO_CONFIG")
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def get_socket_path():
+    """
+    The socket path can be overridden with $AWS_HA_UPDATER_SOCKET, setting it empty disables the daemon.
+    """
+    return os.environ.get(SOCKET_ENVIRONMENT_VARIABLE, os.path.expanduser("~/.aws-ha-updater.sock"))
+
+
+def get_credentials_fingerprint(environment=None):
+    """
+    Hash of the credential environment, so clients and daemon can compare it without exchanging secrets.
+    """
+    environment = os.environ if environment is None else environment
+    credentials = sorted((name, environment[name]) for name in CREDENTIAL_ENVIRONMENT_VARIABLES if name in environment)
+    return hashlib.sha256(json.dumps(credentials)).hexdigest()
+
+
+def run_in_daemon(job, arguments, socket_path=None, output=None):
+    """
+    Runs the job in the daemon and streams its output. Returns the job's exit code,
+    or None when no daemon is running or it declined the job, so the caller can run the job itself.
+    Interrupting the client cancels the job, its output is still streamed until the job is done.
+    """
+    socket_path = get_socket_path() if socket_path is None else socket_path
+    output = output or sys.stdout
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(socket_path)
+        except socket.error as e:
+            if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                return None
+            raise
+        client.sendall(json.dumps({"job": job, "arguments": arguments,
+                                   "credentials": get_credentials_fingerprint()}) + "\n")
+        lines = client.makefile("r")
+        cancelled = False
+        while True:
+            try:
+                line = lines.readline()
+            except KeyboardInterrupt:
+                if cancelled:
+                    raise
+                cancelled = True
+                output.write("Interrupted, cancelling job '{0}' in the daemon.\n".format(job))
+                client.shutdown(socket.SHUT_WR)
+                continue
+            if not line:
+                raise IOError("Daemon closed connection before job '{0}' finished.".format(job))
+            message = json.loads(line)
+            if "declined" in message:
+                logging.getLogger(__name__).info("Running job '{0}' here: {1}".format(job, message["declined"]))
+                return None
+            if "output" in message:
+                output.write(message["output"].encode("utf-8"))
+                output.flush()
+            if "exit_code" in message:
+                return message["exit_code"]
+    finally:
+        client.close()
+
+
+class _ThreadLocalStream(object):
+    """
+    Sends everything written by a job's thread, or by the threads the job starts through
+    aws_updater.utils.new_thread, to that job's client, everything else to the original stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def redirect(self, target):
+        set_thread_output(target)
+
+    def target(self):
+        return get_thread_output()
+
+    def write(self, text):
+        (self.target() or self._stream).write(text)
+
+    def flush(self):
+        (self.target() or self._stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _ClientStream(object):
+    """
+    Output of a client that went away is dropped, a disconnecting client must not abort a running rollout.
+    """
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+        self._connected = True
+
+    def send(self, message):
+        with self._lock:
+            if not self._connected:
+                return
+            try:
+                self._wfile.write(json.dumps(message) + "\n")
+                self._wfile.flush()
+            except (IOError, socket.error):
+                self._connected = False
+
+    def write(self, text):
+        if text:
+            self.send({"output": text})
+
+    def flush(self):
+        pass
+
+
+class _JobLogHandler(logging.Handler):
+
+    def __init__(self, stream):
+        logging.Handler.__init__(self)
+        self._stream = stream
+
+    def emit(self, record):
+        target = self._stream.target()
+        if target is not None:
+            target.write(self.format(record) + "\n")
+
+
+class Daemon(object):
+
+    def __init__(self, socket_path=None):
+        self.logger = logging.getLogger(__name__)
+        self.socket_path = socket_path or get_socket_path()
+        self.credentials_fingerprint = get_credentials_fingerprint()
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._server = None
+
+    def get_connections(self, region):
+        from aws_updater.stack import AWSConnections
+        with self._connections_lock:
+            if region not in self._connections:
+                self.logger.info("Connecting to region {0}.".format(region))
+                self._connections[region] = AWSConnections(region)
+            return self._connections[region]
+
+    def run_job(self, request, client, cancelled=None):
+        from aws_updater.jobs import JOBS
+        job = JOBS.get(request.get("job"))
+        if job is None:
+            client.write("[ERROR] Unknown job: {0}\n".format(request.get("job")))
+            return 1
+        arguments = dict((str(key), value) for key, value in request.get("arguments", {}).iteritems())
+        try:
+            return job(connections=self.get_connections(arguments["region"]), cancelled=cancelled, **arguments)
+        except Exception as e:
+            self.logger.exception("Job {0} failed.".format(request.get("job")))
+            client.write("[ERROR] {0}\n".format(e))
+            return 1
+
+    def serve_forever(self):
+        import SocketServer
+
+        daemon = self
+        original_stdout = sys.stdout
+        stdout = sys.stdout = _ThreadLocalStream(original_stdout)
+        handler = _JobLogHandler(stdout)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        logging.getLogger().addHandler(handler)
+
+        class JobRequestHandler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                request = self.rfile.readline()
+                if not request:
+                    return
+                request = json.loads(request)
+                client = _ClientStream(self.wfile)
+                if request.get("credentials") != daemon.credentials_fingerprint:
+                    client.send({"declined": "the daemon runs with other AWS credentials"})
+                    return
+                cancelled = threading.Event()
+                finished = threading.Event()
+                stdout.redirect(client)
+                try:
+                    watcher = threading.Thread(target=self.cancel_on_disconnect, args=(cancelled, finished),
+                                               name="client-watcher")
+                    watcher.daemon = True
+                    watcher.start()
+                    exit_code = daemon.run_job(request, client, cancelled)
+                    client.send({"exit_code": exit_code})
+                finally:
+                    finished.set()
+                    stdout.redirect(None)
+
+            def cancel_on_disconnect(self, cancelled, finished):
+                # clients send nothing after their request, the end of the stream means they went away
+                try:
+                    self.rfile.read(1)
+                except (IOError, socket.error, ValueError):
+                    pass
+                if not finished.is_set():
+                    daemon.logger.info("Client went away, cancelling its job.")
+                    cancelled.set()
+
+        class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+            daemon_threads = True
+
+        try:
+            if os.path.exists(self.socket_path):
+                if self._is_running():
+                    raise Exception("A daemon is already listening on {0}.".format(self.socket_path))
+                os.remove(self.socket_path)
+            old_umask = os.umask(0o077)
+            try:
+                self._server = Server(self.socket_path, JobRequestHandler)
+            finally:
+                os.umask(old_umask)
+            self.logger.info("Listening on {0}.".format(self.socket_path))
+            try:
+                self._server.serve_forever()
+            finally:
+                self._server.server_close()
+                os.remove(self.socket_path)
+        finally:
+            sys.stdout = original_stdout
+            logging.getLogger().removeHandler(handler)
+
+    def _is_running(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            return True
+        except socket.error:
+            return False
+        finally:
+            probe.close()
+
+    def shutdown(self):
+        if self._server:
+            self._server.shutdown()
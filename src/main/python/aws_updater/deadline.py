@@ -0,0 +1,181 @@
+"""
+Deadline-bounded AWS calls for the wait loops, so a single stalled request cannot outlive the
+budget of the phase it was made in.
+
+boto 2 cannot cancel a request once it is sent, so each call runs in a reused daemon thread that
+is abandoned when it does not return in time, its late result is discarded. Idempotent describe
+calls can be hedged: when the first attempt takes longer than most earlier calls of the same
+operation, a duplicate is sent and whichever answers first wins. Nothing is hedged while the
+service is throttled, the duplicate would be throttled as well.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from Queue import Queue, Empty
+from timeit import default_timer
+
+from aws_updater.throttling import get_rate_limiter
+
+HEDGE_PERCENTILE = 95
+MIN_SAMPLES_TO_HEDGE = 20
+MIN_HEDGE_DELAY_IN_SECONDS = 0.2
+# calls made at the very end of a phase still get a chance to answer
+MIN_CALL_TIMEOUT_IN_SECONDS = 5
+
+
+class DeadlineExceededException(Exception):
+    pass
+
+
+class LatencyTracker(object):
+    """
+    Thread-safe record of the latencies of the most recent successful calls per operation.
+    """
+
+    def __init__(self, window=100):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies = {}
+
+    def record(self, operation, latency_in_seconds):
+        with self._lock:
+            self._latencies.setdefault(operation, deque(maxlen=self.window)).append(latency_in_seconds)
+
+    def percentile(self, operation, percentile, min_samples=1):
+        """
+        Returns None while fewer than min_samples latencies of the operation are known.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(operation, ()))
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100.0))]
+
+
+_latency_tracker = LatencyTracker()
+
+
+class _Workers(object):
+    """
+    Daemon threads running calls, reused once idle, so a wait loop does not start a thread per
+    call. A call that stalls keeps its thread, the next call gets another one. There are never
+    more threads than calls were running at the same time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = Queue()
+        # idle workers not yet claimed by a submitted task
+        self._idle = 0
+
+    def submit(self, task):
+        with self._lock:
+            start_worker = self._idle == 0
+            if not start_worker:
+                self._idle -= 1
+        self._tasks.put(task)
+        if start_worker:
+            worker = threading.Thread(target=self._work, name="deadline-call")
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+        while True:
+            self._tasks.get()()
+            with self._lock:
+                self._idle += 1
+
+
+_workers = _Workers()
+
+
+class DeadlineCaller(object):
+    """
+    Deadlines are points in time of the clock, the remaining time is taken from it right before
+    each call, so consecutive calls share the budget instead of each getting all of it. Latencies
+    are measured in real time and shared between all callers unless a tracker is given.
+    """
+
+    def __init__(self, clock=time, hedge_percentile=HEDGE_PERCENTILE, latency_tracker=None, rate_limiter=None):
+        self.logger = logging.getLogger(__name__)
+        self.clock = clock
+        self.hedge_percentile = hedge_percentile
+        self.latency_tracker = latency_tracker or _latency_tracker
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+
+    def _timeout(self, deadline):
+        return None if deadline is None else deadline - self.clock.time()
+
+    def call(self, operation, deadline, function, *args, **kwargs):
+        """
+        Returns the result of function, raises DeadlineExceededException when it did not return
+        before the deadline, though it gets at least MIN_CALL_TIMEOUT_IN_SECONDS. Without a
+        deadline, function is called directly.
+        """
+        if deadline is None:
+            return function(*args, **kwargs)
+        return self._call(operation, self._timeout(deadline), False, function, args, kwargs)
+
+    def hedged_call(self, operation, deadline, function, *args, **kwargs):
+        """
+        Like call, but sends a duplicate request when the first one is slower than the hedge
+        percentile of earlier calls of the operation, unless requests to its service, the part of
+        the operation before the dot, are being throttled. Only for idempotent functions.
+        """
+        return self._call(operation, self._timeout(deadline), True, function, args, kwargs)
+
+    def _call(self, operation, timeout_in_seconds, hedge, function, args, kwargs):
+        results = Queue()
+
+        def attempt():
+            attempt_started = default_timer()
+            try:
+                results.put((True, function(*args, **kwargs), default_timer() - attempt_started))
+            except Exception:
+                results.put((False, sys.exc_info(), None))
+
+        def start_attempt():
+            _workers.submit(attempt)
+
+        started = default_timer()
+        give_up_at = None
+        if timeout_in_seconds is not None:
+            give_up_at = started + max(timeout_in_seconds, MIN_CALL_TIMEOUT_IN_SECONDS)
+        hedge_at = None
+        if hedge:
+            hedge_delay = self.latency_tracker.percentile(operation, self.hedge_percentile, MIN_SAMPLES_TO_HEDGE)
+            if hedge_delay is not None:
+                hedge_at = started + max(hedge_delay, MIN_HEDGE_DELAY_IN_SECONDS)
+
+        start_attempt()
+        attempts = 1
+        failures = 0
+        while True:
+            # wake up at least once a second, so the waiting thread stays interruptible
+            wake_up_at = min(at for at in (give_up_at, hedge_at, default_timer() + 1) if at is not None)
+            try:
+                succeeded, result, latency = results.get(timeout=max(0, wake_up_at - default_timer()))
+            except Empty:
+                now = default_timer()
+                if give_up_at is not None and now >= give_up_at:
+                    raise DeadlineExceededException("{0} did not return within {1:.0f} seconds.".format(
+                        operation, give_up_at - started))
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    if self.rate_limiter.is_saturated(operation.partition(".")[0]):
+                        self.logger.debug("{0} slow while throttled, not sending a hedged request.".format(operation))
+                        continue
+                    self.logger.debug("{0} slower than {1:.2f} seconds, sending a hedged request.".format(
+                        operation, now - started))
+                    attempts += 1
+                    start_attempt()
+                continue
+
+            if succeeded:
+                self.latency_tracker.record(operation, latency)
+                return result
+            failures += 1
+            if failures == attempts:
+                raise result[0], result[1], result[2]
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from aws_updater.deadline import DeadlineCaller
+
+
+class ELBHealthPoller(object):
+    """
+    Fetches the instance health of each load balancer at most once per interval and shares
+    the result between all ASGUpdaters subscribed to it. Health of load balancers without
+    subscribers is not cached, so polling an ELB stops with its last subscriber.
+    """
+
+    def __init__(self, elb_conn, interval_in_seconds=1, clock=time):
+        self.elb_conn = elb_conn
+        self.interval_in_seconds = interval_in_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._fetch_locks = {}
+        self._health = {}
+        self._caller = DeadlineCaller(clock)
+
+    def subscribe(self, elb_name, subscriber):
+        with self._lock:
+            self._subscribers.setdefault(elb_name, set()).add(subscriber)
+            self._fetch_locks.setdefault(elb_name, threading.Lock())
+
+    def unsubscribe(self, elb_name, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(elb_name, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(elb_name, None)
+                self._fetch_locks.pop(elb_name, None)
+                self._health.pop(elb_name, None)
+
+    def get_instance_health(self, elb_name):
+        """
+        Returns a list of (instance_id, state) tuples for the given load balancer.
+        """
+        with self._lock:
+            fetch_lock = self._fetch_locks.get(elb_name)
+        if fetch_lock is None:
+            return self._fetch(elb_name)
+
+        with fetch_lock:
+            fetched_at, health = self._health.get(elb_name, (None, None))
+            if fetched_at is None or self.clock.time() - fetched_at >= self.interval_in_seconds:
+                health = self._fetch(elb_name)
+                with self._lock:
+                    if elb_name in self._subscribers:
+                        self._health[elb_name] = (self.clock.time(), health)
+            return health
+
+    def _fetch(self, elb_name):
+        instance_health = self._caller.hedged_call("elb.describe_instance_health", None,
+                                                   self.elb_conn.describe_instance_health, elb_name)
+        return [(i.instance_id, i.state) for i in instance_health]
+
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from Queue import Queue, Full
+
+from aws_updater.utils import new_thread
+
+STACK_UPDATE_STARTED = "STACK_UPDATE_STARTED"
+STACK_UPDATE_FINISHED = "STACK_UPDATE_FINISHED"
+ASG_UPDATE_STARTED = "ASG_UPDATE_STARTED"
+SCALE_OUT_COMPLETED = "SCALE_OUT_COMPLETED"
+STANDBY_INSTANCES_READY = "STANDBY_INSTANCES_READY"
+INSTANCE_READY = "INSTANCE_READY"
+INSTANCES_TERMINATED = "INSTANCES_TERMINATED"
+ASG_UPDATE_COMPLETED = "ASG_UPDATE_COMPLETED"
+ROLLBACK_STARTED = "ROLLBACK_STARTED"
+ROLLBACK_COMPLETED = "ROLLBACK_COMPLETED"
+
+DROP = "drop"
+BLOCK = "block"
+
+
+class Event(str):
+    """
+    Compares equal to its type, so observers checking for e.g. SCALE_OUT_COMPLETED keep working.
+    The details of the event are available as attributes and in the details dict.
+    """
+
+    def __new__(cls, type, **details):
+        event = str.__new__(cls, type)
+        event.type = type
+        event.details = details
+        event.timestamp = time.time()
+        return event
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "details":
+            raise AttributeError(name)
+        try:
+            return self.details[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class EventBus(object):
+    """
+    Publishes events to the subscribed observers on a worker thread, so slow observers
+    do not stall the rollout. When the bounded queue is full, new events are either
+    dropped or the publisher blocks until there is room, depending on the overflow policy.
+    """
+
+    def __init__(self, max_queue_size=1000, overflow_policy=DROP):
+        self.logger = logging.getLogger(__name__)
+        self.overflow_policy = overflow_policy
+        self.nr_of_dropped_events = 0
+        self._queue = Queue(max_queue_size)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def publish(self, type, **details):
+        if not self._subscribers:
+            return
+        self._start_worker()
+        event = Event(type, **details)
+        if self.overflow_policy == BLOCK:
+            self._queue.put(event)
+            return
+        try:
+            self._queue.put_nowait(event)
+        except Full:
+            self.nr_of_dropped_events += 1
+            self.logger.warning("Event queue is full, dropped event {0}.".format(type))
+
+    def flush(self, timeout_in_seconds=None):
+        """
+        Waits until all published events have been delivered. Returns False on timeout.
+        """
+        wait_until = time.time() + timeout_in_seconds if timeout_in_seconds is not None else None
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if wait_until is None:
+                    self._queue.all_tasks_done.wait()
+                else:
+                    remaining = wait_until - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = new_thread(self._deliver_events, "event-bus")
+                self._worker.start()
+
+    def _deliver_events(self):
+        while True:
+            event = self._queue.get()
+            try:
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for callback in subscribers:
+                    try:
+                        callback(event)
+                    except Exception:
+                        self.logger.exception("Observer failed on event {0}.".format(event.type))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,96 @@
+"""
+The jobs behind the update-stack, update-asgs and dump-stack-state scripts, so they can run
+either in the script's own process or in the daemon with warm connections.
+
+Setting the event passed as cancelled, e.g. when the daemon's client went away, rolls back
+running ASG updates and skips the remaining ones.
+"""
+from aws_updater.locking import create_lease_store, get_lease_store_url
+from aws_updater.probes import parse_probe
+from aws_updater.stack import StackUpdater, AWSConnections
+from aws_updater.watch import StackWatcher
+
+
+def _create_lease_store(lease_store):
+    return create_lease_store(get_lease_store_url() if lease_store is None else lease_store)
+
+
+def update_stack(stack_name, region, parameters, template=None, template_bucket=None, warmup_seconds=25,
+                 lenient_look_back=5, action_timeout=300, healthy_timeout=600, strict_update_check=False,
+                 pipelined=False, readiness_probe=None, require_elb_in_service=False, prewarm_standby=False,
+                 change_set=False, preview=False, lease_store=None, lease_timeout=None, template_cache_dir=None,
+                 connections=None, cancelled=None):
+    updater = StackUpdater(stack_name, region, timeout_in_seconds=healthy_timeout, template_bucket=template_bucket,
+                           strict_update_check=strict_update_check, connections=connections,
+                           readiness_probe=readiness_probe and parse_probe(readiness_probe),
+                           require_elb_in_service=require_elb_in_service, prewarm_standby=prewarm_standby,
+                           lease_store=_create_lease_store(lease_store), lease_timeout_in_seconds=lease_timeout,
+                           template_cache_dir=template_cache_dir, cancelled=cancelled)
+    with updater.stack_lease():
+        if pipelined:
+            result = updater.update_stack_and_asgs_pipelined(parameters, template, lenient_look_back, action_timeout,
+                                                             warmup_seconds, change_set, preview)
+        else:
+            result = updater.update_stack(parameters, template, lenient_look_back, action_timeout, warmup_seconds,
+                                          change_set, preview)
+            if result == 0:
+                updater.update_asgs(asg_names=updater.changed_asg_names)
+    if result != 0:
+        print "[ERROR] Stack update did not complete successfully, ASGs were not updated."
+    return result
+
+
+def update_asgs(stack_name, region, strict_update_check=False, readiness_probe=None, require_elb_in_service=False,
+                prewarm_standby=False, lease_store=None, lease_timeout=None, connections=None, cancelled=None):
+    StackUpdater(stack_name, region, strict_update_check=strict_update_check, connections=connections,
+                 readiness_probe=readiness_probe and parse_probe(readiness_probe),
+                 require_elb_in_service=require_elb_in_service, prewarm_standby=prewarm_standby,
+                 lease_store=_create_lease_store(lease_store), lease_timeout_in_seconds=lease_timeout,
+                 cancelled=cancelled).update_asgs()
+    return 0
+
+
+def _status(d, key_name, key_state, key_type):
+    if not hasattr(d, "iteritems"):
+        d = vars(d)
+    name = d.get(key_name, "")
+    state = d.get(key_state, "")
+    t = d.get(key_type, key_type)
+    return "%30s %-40s [%s]" % (state, t, name)
+
+
+def dump_stack_state(stack_name, region, show_events=False, connections=None, cancelled=None):
+    connections = connections or AWSConnections(region)
+    cloudformation_conn = connections.cfn_conn
+    print "connection cloudformation: %s" % cloudformation_conn
+    print
+
+    stack = None
+    for stack in cloudformation_conn.describe_stacks(stack_name):
+        print _status(stack, "stack_name", "stack_status", "STACK")
+
+    id2events = {}
+    if show_events:
+        for event in stack.describe_events():
+            id2events.setdefault(event.logical_resource_id, []).append(event)
+
+    print "-" * 40
+    for resource in stack.describe_resources():
+        print _status(resource, "logical_resource_id", "resource_status", "resource_type")
+        if show_events:
+            for event in id2events.get(resource.logical_resource_id, []):
+                print "%28s  %s" % (event.resource_status, event.timestamp)
+    print "-" * 40
+    return 0
+
+
+def watch_stacks(stack_names, region, prefix=None, requests_per_second=1.0, connections=None):
+    connections = connections or AWSConnections(region)
+    return StackWatcher(connections.cfn_conn, stack_names, prefix, requests_per_second).watch()
+
+
+JOBS = {
+    "update-stack": update_stack,
+    "update-asgs": update_asgs,
+    "dump-stack-state": dump_stack_state,
+}
@@ -0,0 +1,286 @@
+"""
+Leases keyed by stack and ASG, so concurrent updates of the same stack queue up instead of
+scaling out the same ASG twice.
+
+A lease store only has to load the state of a key together with a version and to replace it
+when the version did not change in the meantime. Stores for shared backends, e.g. a DynamoDB
+table with conditional writes, can be plugged in with register_lease_store.
+"""
+import fcntl
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from aws_updater.utils import new_thread
+
+LEASE_STORE_ENVIRONMENT_VARIABLE = "AWS_HA_UPDATER_LEASE_STORE"
+
+
+class LeaseTimeoutException(Exception):
+    pass
+
+
+class LeaseLostException(Exception):
+    pass
+
+
+class LeaseStore(object):
+
+    def load(self, key):
+        """
+        Returns (state, version) of the key, (None, 0) when it was never stored.
+        """
+        raise NotImplementedError()
+
+    def compare_and_set(self, key, version, state):
+        """
+        Stores the state when the key still has the given version and returns whether it did.
+        """
+        raise NotImplementedError()
+
+
+class SqliteLeaseStore(LeaseStore):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            connection.execute("CREATE TABLE IF NOT EXISTS leases "
+                               "(key TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL)")
+        return connection
+
+    def load(self, key):
+        row = self._connection().execute("SELECT state, version FROM leases WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return (None, 0)
+        return (json.loads(row[0]), row[1])
+
+    def compare_and_set(self, key, version, state):
+        if version == 0:
+            cursor = self._connection().execute("INSERT OR IGNORE INTO leases (key, version, state) VALUES (?, 1, ?)",
+                                                (key, json.dumps(state)))
+        else:
+            cursor = self._connection().execute("UPDATE leases SET version = ?, state = ? WHERE key = ? AND version = ?",
+                                                (version + 1, json.dumps(state), key, version))
+        return cursor.rowcount == 1
+
+
+class FileLeaseStore(LeaseStore):
+    """
+    Keeps all leases in one JSON file, guarded by an flock on a companion lock file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def _read(self):
+        try:
+            with open(self.filename) as lease_file:
+                return json.load(lease_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _locked(self, function):
+        with open(self.filename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return function()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, key):
+        entry = self._locked(self._read).get(key)
+        if entry is None:
+            return (None, 0)
+        return (entry["state"], entry["version"])
+
+    def compare_and_set(self, key, version, state):
+        def update():
+            leases = self._read()
+            if leases.get(key, {}).get("version", 0) != version:
+                return False
+            leases[key] = {"version": version + 1, "state": state}
+            temporary_file_name = "{0}.{1}.tmp".format(self.filename, os.getpid())
+            with open(temporary_file_name, "w") as lease_file:
+                json.dump(leases, lease_file)
+            os.rename(temporary_file_name, self.filename)
+            return True
+        return self._locked(update)
+
+
+_lease_stores = {
+    "sqlite": SqliteLeaseStore,
+    "file": FileLeaseStore,
+}
+
+
+def register_lease_store(scheme, factory):
+    """
+    Makes lease stores of the given scheme available, the factory is called with the location
+    following 'SCHEME:'.
+    """
+    _lease_stores[scheme] = factory
+
+
+def get_lease_store_url():
+    """
+    The lease store can be set with $AWS_HA_UPDATER_LEASE_STORE, setting it empty disables leases.
+    """
+    return os.environ.get(LEASE_STORE_ENVIRONMENT_VARIABLE,
+                          "sqlite:" + os.path.expanduser("~/.aws-ha-updater-leases.sqlite"))
+
+
+def create_lease_store(url):
+    """
+    Creates the lease store for 'SCHEME:LOCATION', e.g. 'sqlite:/var/lib/aws-ha-updater/leases.sqlite'.
+    Returns None for an empty url or 'none'.
+    """
+    if not url or url == "none":
+        return None
+    scheme, _, location = url.partition(":")
+    if scheme not in _lease_stores:
+        raise ValueError("Unknown lease store '{0}', known are: {1}.".format(url, ", ".join(sorted(_lease_stores))))
+    return _lease_stores[scheme](os.path.expanduser(location))
+
+
+def new_lease_owner():
+    return "{0}:{1}:{2}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class Lease(object):
+    """
+    Lease on a key, kept alive by a heartbeat thread while held. Waiters queue up and get the lease
+    in the order they asked for it. Holders and waiters that stop renewing expire after the ttl,
+    so a crashed process blocks the others for at most that long. A holder whose lease expired,
+    because it was unable to renew it in time, has lost it and on_lost is called.
+    """
+
+    def __init__(self, store, key, owner=None, ttl_in_seconds=60, poll_interval_in_seconds=1, clock=time,
+                 on_lost=None):
+        self.logger = logging.getLogger(__name__)
+        self.store = store
+        self.key = key
+        self.owner = owner or new_lease_owner()
+        self.ttl_in_seconds = ttl_in_seconds
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        self.clock = clock
+        self.on_lost = on_lost
+        self.lost = False
+        self._heartbeat = None
+        self._stopped = threading.Event()
+
+    def _modify(self, update):
+        while True:
+            state, version = self.store.load(self.key)
+            now = self.clock.time()
+            state = state or {"holder": None, "expires_at": 0, "queue": []}
+            if state["holder"] is not None and state["expires_at"] <= now:
+                state["holder"] = None
+            state["queue"] = [waiter for waiter in state["queue"] if waiter["expires_at"] > now]
+            result = update(state, now)
+            if self.store.compare_and_set(self.key, version, state):
+                return result
+
+    def _try_acquire(self, state, now):
+        if state["holder"] == self.owner:
+            state["expires_at"] = now + self.ttl_in_seconds
+            return (True, state)
+        waiters = [waiter for waiter in state["queue"] if waiter["owner"] == self.owner]
+        if waiters:
+            waiters[0]["expires_at"] = now + self.ttl_in_seconds
+        else:
+            state["queue"].append({"owner": self.owner, "expires_at": now + self.ttl_in_seconds})
+        if state["holder"] is None and state["queue"][0]["owner"] == self.owner:
+            state["queue"].pop(0)
+            state["holder"] = self.owner
+            state["expires_at"] = now + self.ttl_in_seconds
+            return (True, state)
+        return (False, state)
+
+    def _leave_queue(self, state, now):
+        state["queue"] = [waiter for waiter in state["queue"] if waiter["owner"] != self.owner]
+        if state["holder"] == self.owner:
+            state["holder"] = None
+
+    def acquire(self, timeout_in_seconds=None):
+        """
+        Waits for the lease in turn, raises LeaseTimeoutException when it did not get it in time.
+        """
+        wait_until = None if timeout_in_seconds is None else self.clock.time() + timeout_in_seconds
+        reported_holder = None
+        while True:
+            acquired, state = self._modify(self._try_acquire)
+            if acquired:
+                break
+            if state["holder"] != reported_holder:
+                reported_holder = state["holder"]
+                print "waiting for %s, held by %s, %i waiting" % (self.key, reported_holder, len(state["queue"]))
+            if wait_until is not None and self.clock.time() >= wait_until:
+                self._modify(self._leave_queue)
+                raise LeaseTimeoutException("Timed out waiting {0} seconds for {1} held by {2}.".format(
+                    timeout_in_seconds, self.key, state["holder"]))
+            self.clock.sleep(self.poll_interval_in_seconds)
+
+        self.lost = False
+        self._stopped.clear()
+        self._heartbeat = new_thread(self._keep_alive, "lease-" + self.key,
+                                     args=(self.clock.time() + self.ttl_in_seconds,))
+        self._heartbeat.start()
+
+    def renew(self):
+        """
+        Returns False when the lease was lost, e.g. because it expired.
+        """
+        def renew(state, now):
+            if state["holder"] != self.owner:
+                return False
+            state["expires_at"] = now + self.ttl_in_seconds
+            return True
+        return self._modify(renew)
+
+    def _keep_alive(self, expires_at):
+        while True:
+            # Event.wait returns None before python 2.7, so check the flag itself
+            self._stopped.wait(self.ttl_in_seconds / 3.0)
+            if self._stopped.is_set():
+                return
+            renewing_at = self.clock.time()
+            try:
+                if self.renew():
+                    expires_at = renewing_at + self.ttl_in_seconds
+                    continue
+            except Exception as e:
+                self.logger.warning("Unable to renew lease on {0}: {1}".format(self.key, e))
+                if self.clock.time() < expires_at:
+                    continue
+            self._lose()
+            return
+
+    def _lose(self):
+        self.lost = True
+        self.logger.error("Lost lease on {0}, another update may run concurrently.".format(self.key))
+        if self.on_lost is not None:
+            self.on_lost()
+
+    def release(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        self._modify(self._leave_queue)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
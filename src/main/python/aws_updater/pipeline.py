@@ -0,0 +1,128 @@
+import logging
+import threading
+
+from aws_updater import (SUCCESSFUL_STATES_COMPLETE, describe_events, dump_event, get_event_epoch,
+                         wait_for_start_event)
+from aws_updater.deadline import DeadlineCaller, DeadlineExceededException
+from aws_updater.utils import new_thread
+
+ASG_RESOURCE_TYPE = "AWS::AutoScaling::AutoScalingGroup"
+STACK_RESOURCE_TYPE = "AWS::CloudFormation::Stack"
+
+
+class PipelinedRollout(object):
+    """
+    Watches the events of a stack update and starts the rollout of each ASG as soon as the ASG
+    reached UPDATE_COMPLETE. An ASG depends on its launch configuration, so the new launch
+    configuration is complete by then as well. Rollouts run in parallel to the rest of the stack
+    update and are cancelled, i.e. rolled back, when the stack update rolls back.
+    """
+
+    def __init__(self, stack_updater):
+        self.logger = logging.getLogger(__name__)
+        self.stack_updater = stack_updater
+        self.clock = stack_updater.clock
+        self._rollouts = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def run(self, warmup_seconds, lenient_look_back, action_timeout):
+        """
+        Returns the same codes as wait_for_action_to_complete. Raises the exception of the first
+        failed rollout when the stack update itself was successful.
+        """
+        (stack, start_event) = wait_for_start_event(self.stack_updater.cfn_conn, self.stack_updater.stack_name,
+                                                    warmup_seconds, lenient_look_back, self.clock)
+        if not start_event:
+            print "no start event encountered"
+            return 2
+        dump_event(start_event, message="ACTION STARTED")
+        print
+
+        try:
+            end_event = self._watch_events(stack, get_event_epoch(start_event), action_timeout)
+            if not end_event or end_event.resource_status not in SUCCESSFUL_STATES_COMPLETE:
+                self._cancel_rollouts()
+        except BaseException:
+            # rollout threads are daemons, leaving them running could exit with an ASG half updated
+            self._cancel_rollouts()
+            self._join_rollouts()
+            raise
+        self._join_rollouts()
+
+        print
+        if not end_event:
+            print "no end event encountered within %i seconds" % action_timeout
+            return 3
+        dump_event(end_event, message="ACTION FINISHED")
+        status = end_event.resource_status
+        print status
+        if status not in SUCCESSFUL_STATES_COMPLETE:
+            return 1
+
+        if self._failures:
+            raise self._failures[sorted(self._failures)[0]]
+        self.stack_updater.update_asgs(asg_names_to_skip=self._rollouts.keys(),
+                                       asg_names=self.stack_updater.changed_asg_names)
+        return 0
+
+    def _watch_events(self, stack, younger_than, action_timeout):
+        caller = DeadlineCaller(self.clock)
+        check_until = self.clock.time() + action_timeout
+        seen_event_ids = set()
+        while self.clock.time() < check_until:
+            try:
+                events = describe_events(caller, stack, check_until)
+            except DeadlineExceededException as e:
+                print e
+                return None
+            new_events = [event for event in events
+                          if event.event_id not in seen_event_ids and get_event_epoch(event) >= younger_than]
+            for event in reversed(new_events):
+                seen_event_ids.add(event.event_id)
+                dump_event(event, oneline=True)
+                check_until = self.clock.time() + action_timeout
+
+                status = event.resource_status
+                if event.resource_type == STACK_RESOURCE_TYPE and event.logical_resource_id == stack.stack_name:
+                    if "ROLLBACK" in status:
+                        self._cancel_rollouts()
+                    if status.endswith("_COMPLETE"):
+                        return event
+                elif event.resource_type == ASG_RESOURCE_TYPE and status == "UPDATE_COMPLETE":
+                    self._start_rollout(event.physical_resource_id)
+            self.clock.sleep(1)
+        return None
+
+    def _start_rollout(self, asg_name):
+        with self._lock:
+            if self._cancelled or asg_name in self._rollouts:
+                return
+            asg = self.stack_updater.as_conn.get_all_groups(names=[asg_name])[0]
+            updater = self.stack_updater.create_asg_updater(asg)
+            thread = new_thread(self._roll_out, "rollout-" + asg_name, args=(asg_name, updater))
+            self._rollouts[asg_name] = (updater, thread)
+        self.logger.info("Starting rollout of ASG '{0}' while the stack update continues.".format(asg_name))
+        thread.start()
+
+    def _roll_out(self, asg_name, updater):
+        try:
+            with self.stack_updater.asg_lease(asg_name):
+                updater.update()
+        except BaseException as e:
+            self.logger.error("Rollout of ASG '{0}' failed: {1}".format(asg_name, e))
+            with self._lock:
+                self._failures[asg_name] = e
+
+    def _cancel_rollouts(self):
+        with self._lock:
+            if not self._cancelled:
+                self._cancelled = True
+                for asg_name, (updater, thread) in self._rollouts.items():
+                    self.logger.info("Cancelling rollout of ASG '{0}'.".format(asg_name))
+                    updater.cancel()
+
+    def _join_rollouts(self):
+        for (updater, thread) in self._rollouts.values():
+            thread.join()
@@ -0,0 +1,118 @@
+"""
+Preprocessing of templates before they are validated and sent to CloudFormation.
+
+An object {"Fn::Include": "LOCATION"} anywhere in a template is replaced by the JSON document at
+LOCATION, which is either an s3:// url or a path relative to the including template. The result
+is minified into a canonical form with sorted keys and without whitespace.
+"""
+import json
+import logging
+import os
+import posixpath
+
+from aws_updater.template import (TemplateValidationException, template_hash, load_json_template,
+                                  dump_canonical_template)
+
+INCLUDE_KEY = "Fn::Include"
+CACHE_DIR_ENVIRONMENT_VARIABLE = "AWS_HA_UPDATER_TEMPLATE_CACHE"
+
+
+def get_template_cache_dir():
+    """
+    The cache directory can be overridden with $AWS_HA_UPDATER_TEMPLATE_CACHE, setting it empty disables the cache.
+    """
+    return os.environ.get(CACHE_DIR_ENVIRONMENT_VARIABLE, os.path.expanduser("~/.cache/aws-ha-updater/templates"))
+
+
+def resolve_location(location, including_location):
+    if location.startswith("s3://") or os.path.isabs(location):
+        return location
+    if including_location.startswith("s3://"):
+        path = posixpath.join(posixpath.dirname(including_location[len("s3://"):]), location)
+        return "s3://" + posixpath.normpath(path)
+    return os.path.normpath(os.path.join(os.path.dirname(including_location), location))
+
+
+class TemplatePreprocessor(object):
+    """
+    Processed templates are cached on disk by location and hash of the template, together with the
+    hashes of all included documents. A cached result is used as long as none of them changed, so
+    unchanged templates are never parsed again.
+    """
+
+    def __init__(self, load, cache_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.load = load
+        self.cache_dir = get_template_cache_dir() if cache_dir is None else cache_dir
+
+    def process(self, location):
+        if not location.startswith("s3://"):
+            location = os.path.abspath(location)
+        template = self.load(location)
+        cache_key = template_hash("{0}\n{1}".format(location, template_hash(template)))
+
+        cached = self._read_cache(cache_key)
+        if cached is not None and self._includes_unchanged(cached["includes"]):
+            return cached["template"].encode("utf-8")
+
+        includes = []
+        processed = dump_canonical_template(
+            self._resolve(load_json_template(template, location), location, [location], includes))
+        self._write_cache(cache_key, {"includes": includes, "template": processed.decode("utf-8")})
+        return processed
+
+    def _includes_unchanged(self, includes):
+        try:
+            return all(template_hash(self.load(location)) == include_hash for (location, include_hash) in includes)
+        except (IOError, TemplateValidationException):
+            return False
+
+    def _include(self, node, location, including, includes):
+        if len(node) != 1 or not isinstance(node[INCLUDE_KEY], basestring):
+            raise TemplateValidationException(
+                "'{0}' in {1} must be the only key of its object and name a location.".format(INCLUDE_KEY, location))
+        included_location = resolve_location(node[INCLUDE_KEY], location)
+        if included_location in including:
+            raise TemplateValidationException("Include cycle: {0}.".format(" -> ".join(including + [included_location])))
+        try:
+            included = self.load(included_location)
+        except IOError as e:
+            raise TemplateValidationException("Unable to include {0} in {1}: {2}".format(included_location, location, e))
+        includes.append((included_location, template_hash(included)))
+        return self._resolve(load_json_template(included, included_location), included_location,
+                             including + [included_location], includes)
+
+    def _resolve(self, node, location, including, includes):
+        if isinstance(node, dict):
+            if INCLUDE_KEY in node:
+                return self._include(node, location, including, includes)
+            return dict((key, self._resolve(value, location, including, includes)) for key, value in node.iteritems())
+        if isinstance(node, list):
+            return [self._resolve(value, location, including, includes) for value in node]
+        return node
+
+    def _cache_file(self, cache_key):
+        return os.path.join(self.cache_dir, cache_key + ".json")
+
+    def _read_cache(self, cache_key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_file(cache_key)) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write_cache(self, cache_key, entry):
+        if not self.cache_dir:
+            return
+        cache_file_name = self._cache_file(cache_key)
+        temporary_file_name = "{0}.{1}.tmp".format(cache_file_name, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temporary_file_name, "w") as cache_file:
+                json.dump(entry, cache_file)
+            os.rename(temporary_file_name, cache_file_name)
+        except (IOError, OSError) as e:
+            self.logger.debug("Unable to cache processed template in {0}: {1}".format(self.cache_dir, e))
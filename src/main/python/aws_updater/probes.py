@@ -0,0 +1,125 @@
+import httplib
+import logging
+import socket
+import threading
+from multiprocessing.pool import ThreadPool
+
+from aws_updater.utils import with_thread_output
+
+
+class HttpProbe(object):
+    """
+    Ready when GET of the path answers with a status below 400. Connections are kept
+    open and reused for the next probe of the same instance.
+    """
+
+    def __init__(self, port=80, path="/", timeout_in_seconds=2):
+        self.port = port
+        self.path = path
+        self.timeout_in_seconds = timeout_in_seconds
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, ip):
+        with self._lock:
+            connection = self._idle_connections.pop(ip, None)
+        if connection is None:
+            connection = httplib.HTTPConnection(ip, self.port, timeout=self.timeout_in_seconds)
+        try:
+            connection.request("GET", self.path)
+            response = connection.getresponse()
+            response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            return False
+        with self._lock:
+            self._idle_connections[ip] = connection
+        return response.status < 400
+
+    def close(self):
+        with self._lock:
+            connections, self._idle_connections = self._idle_connections.values(), {}
+        for connection in connections:
+            connection.close()
+
+    def __repr__(self):
+        return "http:{0}{1}".format(self.port, self.path)
+
+
+class TcpProbe(object):
+    """
+    Ready when the port accepts connections.
+    """
+
+    def __init__(self, port, timeout_in_seconds=2):
+        self.port = port
+        self.timeout_in_seconds = timeout_in_seconds
+
+    def __call__(self, ip):
+        try:
+            socket.create_connection((ip, self.port), self.timeout_in_seconds).close()
+            return True
+        except socket.error:
+            return False
+
+    def __repr__(self):
+        return "tcp:{0}".format(self.port)
+
+
+def parse_probe(spec):
+    """
+    Parses 'http:PORT/PATH' or 'tcp:PORT' into a probe.
+    """
+    kind, _, target = spec.partition(":")
+    if kind == "http":
+        port, slash, path = target.partition("/")
+        return HttpProbe(int(port or 80), slash + path or "/")
+    if kind == "tcp":
+        return TcpProbe(int(target))
+    raise ValueError("Unknown readiness probe '{0}', expected 'http:PORT/PATH' or 'tcp:PORT'.".format(spec))
+
+
+class ReadinessProber(object):
+    """
+    Runs a probe, i.e. any callable taking an ip and returning whether the instance is ready,
+    concurrently against many instances on a bounded pool of threads.
+    """
+
+    def __init__(self, probe, max_concurrent_probes=10):
+        self.logger = logging.getLogger(__name__)
+        self.probe = probe
+        self.max_concurrent_probes = max_concurrent_probes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _safe_probe(self, ip):
+        try:
+            return bool(self.probe(ip))
+        except Exception as e:
+            self.logger.debug("Readiness probe {0} of {1} failed: {2}".format(self.probe, ip, e))
+            return False
+
+    def check(self, ips):
+        """
+        Returns the set of ips whose probe succeeded.
+        """
+        ips = list(ips)
+        if not ips:
+            return set()
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_concurrent_probes)
+        results = self._pool.map(with_thread_output(self._safe_probe), ips)
+        return set(ip for ip, ready in zip(ips, results) if ready)
+
+    def close(self):
+        """
+        Stops the probe threads and closes connections the probe kept open, checking again reopens them.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+        if hasattr(self.probe, "close"):
+            self.probe.close()
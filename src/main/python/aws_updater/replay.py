@@ -0,0 +1,176 @@
+"""
+Records the AWS responses of a real run and replays them with a virtual clock,
+so rollouts taking many minutes in production replay in well under a second.
+
+Recording:
+
+    updater = StackUpdater(stack_name, region)
+    recorder = Recorder()
+    recorder.attach_to(updater)
+    updater.update_asgs()
+    recorder.save("rollout.json")
+
+Replaying:
+
+    replayer = Replayer.load("rollout.json")
+    replayer.create_stack_updater(stack_name, region).update_asgs()
+"""
+import json
+import threading
+import time
+
+from aws_updater.stack import StackUpdater
+
+RECORDED_CONNECTIONS = (("cfn_conn", "cloudformation"), ("as_conn", "autoscaling"),
+                        ("ec2_conn", "ec2"), ("elb_conn", "elb"))
+
+
+class ReplayMismatchException(Exception):
+    pass
+
+
+class VirtualClock(object):
+    """
+    Drop-in replacement for the time module in the wait loops; sleeping only advances the clock.
+    """
+
+    def __init__(self, now=0):
+        self._now = now
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += seconds
+
+
+def _get_action_and_params(args, kwargs):
+    action = kwargs.get("action", args[0] if args else None)
+    params = kwargs.get("params", args[1] if len(args) > 1 else None) or {}
+    return action, params
+
+
+def _request_key(service, action, params):
+    return json.dumps([service, action, sorted(params.items())])
+
+
+class RecordedResponse(object):
+    """
+    Stands in for the boto HTTPResponse of a recorded request.
+    """
+
+    def __init__(self, status, reason, body):
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+    def read(self, amt=None):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return default
+
+
+class Recorder(object):
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.started_at = clock.time()
+        self.responses = []
+        self._lock = threading.Lock()
+
+    def attach(self, conn, service):
+        make_request = conn.make_request
+
+        def recording_make_request(*args, **kwargs):
+            response = make_request(*args, **kwargs)
+            action, params = _get_action_and_params(args, kwargs)
+            body = response.read()
+            with self._lock:
+                self.responses.append({"service": service,
+                                       "action": action,
+                                       "params": params,
+                                       "at": self.clock.time() - self.started_at,
+                                       "status": response.status,
+                                       "reason": response.reason,
+                                       "body": body.decode("utf-8")})
+            return response
+
+        conn.make_request = recording_make_request
+        return conn
+
+    def attach_to(self, stack_updater):
+        for (attribute, service) in RECORDED_CONNECTIONS:
+            self.attach(getattr(stack_updater, attribute), service)
+
+    def save(self, filename):
+        with open(filename, "w") as recording_file:
+            json.dump({"started_at": self.started_at, "responses": self.responses}, recording_file, indent=1)
+
+
+class Replayer(object):
+    """
+    Answers each request with the latest response recorded for the same request at or before
+    the current virtual time, falling back to the same action with other parameters, so the
+    replayed world evolves with the clock and not with the number of requests made.
+    """
+
+    def __init__(self, recording, clock=None):
+        self.started_at = recording["started_at"]
+        self.clock = clock or VirtualClock(self.started_at)
+        self._timelines = {}
+        for response in sorted(recording["responses"], key=lambda r: r["at"]):
+            entry = (response["at"], RecordedResponse(response["status"], response["reason"],
+                                                      response["body"].encode("utf-8")))
+            self._timelines.setdefault(_request_key(response["service"], response["action"], response["params"]),
+                                       []).append(entry)
+            self._timelines.setdefault(_request_key(response["service"], response["action"], {}), []).append(entry)
+
+    @classmethod
+    def load(cls, filename, clock=None):
+        with open(filename) as recording_file:
+            return cls(json.load(recording_file), clock)
+
+    def respond(self, service, action, params):
+        timeline = self._timelines.get(_request_key(service, action, params)) or \
+            self._timelines.get(_request_key(service, action, {}))
+        if not timeline:
+            raise ReplayMismatchException("No response recorded for {0} {1} {2}.".format(service, action, params))
+        offset = self.clock.time() - self.started_at
+        response = timeline[0][1]
+        for (at, recorded_response) in timeline:
+            if at > offset:
+                break
+            response = recorded_response
+        return response
+
+    def attach(self, conn, service):
+        def replaying_make_request(*args, **kwargs):
+            action, params = _get_action_and_params(args, kwargs)
+            return self.respond(service, action, params)
+
+        conn.make_request = replaying_make_request
+        return conn
+
+    def attach_to(self, stack_updater):
+        for (attribute, service) in RECORDED_CONNECTIONS:
+            self.attach(getattr(stack_updater, attribute), service)
+
+    def create_stack_updater(self, stack_name, region, **kwargs):
+        """
+        Creates a StackUpdater running on the virtual clock and the recorded responses, without AWS credentials.
+        """
+        stack_updater = StackUpdater(stack_name, region, sts_credentials=_ReplayCredentials(), clock=self.clock,
+                                     **kwargs)
+        self.attach_to(stack_updater)
+        return stack_updater
+
+
+class _ReplayCredentials(object):
+    access_key = "replay"
+    secret_key = "replay"
+    session_token = None
+    expiration = "never"
@@ -1,5 +1,8 @@
 import json
 import logging
+import threading
+import time
+from contextlib import contextmanager
 
 import boto.cloudformation
 import boto.ec2
@@ -8,17 +11,34 @@ import boto.ec2.elb
 import boto.ec2.autoscale
 import boto.s3.connection
 from aws_updater.utils import timed
-from aws_updater.asg import ASGUpdater
+from aws_updater import events
+from aws_updater.asg import ASGUpdater, CancelledException
+from aws_updater.elb import ELBHealthPoller
+from aws_updater.throttling import throttle
+from aws_updater.pipeline import PipelinedRollout
+from aws_updater.changeset import ChangeSetUpdate
+from aws_updater.locking import Lease, new_lease_owner
+from aws_updater.probes import ReadinessProber
+from aws_updater.preprocessing import TemplatePreprocessor
+from aws_updater.template import (TemplateValidationException, template_hash, validate_stack_parameters,
+                                  is_too_large_for_template_body, s3_url_to_https_url, canonical_template_hash)
 from aws_updater import describe_stack, get_all_autoscaling_groups, wait_for_action_to_complete
 
+# a hung observer must neither block a rollout nor hide its exception
+EVENT_FLUSH_TIMEOUT_IN_SECONDS = 5
+
 
 class BucketNotAccessibleException(Exception):
     pass
 
 
-class StackUpdater(object):
+class AWSConnections(object):
+    """
+    Throttled connections to all AWS services used for one region. Can be shared between
+    StackUpdaters, e.g. by the daemon, to keep connections and caches warm.
+    """
 
-    def __init__(self, stack_name, region, observer_callback=None, timeout_in_seconds=None, sts_credentials=None):
+    def __init__(self, region, sts_credentials=None, rate_limiter=None):
         self.logger = logging.getLogger(__name__)
 
         access_key = None
@@ -31,7 +51,7 @@ class StackUpdater(object):
             self.logger.info("Using STS credentials (access_key: {0}, expiration: {1})"
                              .format(access_key, sts_credentials.expiration))
 
-        self.stack_name = stack_name
+        self.region = region
         self.cfn_conn = boto.cloudformation.connect_to_region(region, aws_access_key_id=access_key,
                                                               aws_secret_access_key=secret_key,
                                                               security_token=session_token)
@@ -47,10 +67,130 @@ class StackUpdater(object):
         self.s3_conn = boto.s3.connection.S3Connection(aws_access_key_id=access_key,
                                                        aws_secret_access_key=secret_key,
                                                        security_token=session_token)
+        for (conn, service) in ((self.cfn_conn, "cloudformation"), (self.as_conn, "autoscaling"),
+                                (self.ec2_conn, "ec2"), (self.elb_conn, "elb"), (self.s3_conn, "s3")):
+            throttle(conn, service, region, rate_limiter)
+
+        self.remotely_validated_templates = set()
+        # shared by the ASGUpdaters of all StackUpdaters using these connections
+        self.elb_health_poller = ELBHealthPoller(self.elb_conn)
+
+
+class _HeldLease(object):
+    """
+    A lease of a StackUpdater with the number of blocks using it, settled once acquiring it succeeded or failed.
+    """
+
+    def __init__(self, lease):
+        self.lease = lease
+        self.users = 0
+        self.settled = threading.Event()
+        self.acquired = False
+        self.error = None
+
+
+class StackUpdater(object):
+
+    def __init__(self, stack_name, region, observer_callback=None, timeout_in_seconds=None, sts_credentials=None,
+                 template_bucket=None, strict_update_check=False, rate_limiter=None, clock=None, connections=None,
+                 readiness_probe=None, require_elb_in_service=False, template_cache_dir=None, prewarm_standby=False,
+                 lease_store=None, lease_timeout_in_seconds=None, cancelled=None):
+        self.logger = logging.getLogger(__name__)
+
+        connections = connections or AWSConnections(region, sts_credentials, rate_limiter)
+        self.stack_name = stack_name
+        self.region = region
+        self.cfn_conn = connections.cfn_conn
+        self.as_conn = connections.as_conn
+        self.ec2_conn = connections.ec2_conn
+        self.elb_conn = connections.elb_conn
+        self.s3_conn = connections.s3_conn
+
         self.timeout_in_seconds = timeout_in_seconds
+        self.template_bucket = template_bucket
+        self.strict_update_check = strict_update_check
+        self.clock = clock or time
+        if self.clock is time:
+            self.elb_health_poller = connections.elb_health_poller
+        else:
+            self.elb_health_poller = ELBHealthPoller(self.elb_conn, clock=self.clock)
+        self.readiness_prober = ReadinessProber(readiness_probe) if readiness_probe else None
+        self.require_elb_in_service = require_elb_in_service
+        self.prewarm_standby = prewarm_standby
+        # names of the ASGs the last change set update changed, None when not known
+        self.changed_asg_names = None
+        self.lease_store = lease_store
+        self.lease_timeout_in_seconds = lease_timeout_in_seconds
+        self._lease_owner = new_lease_owner()
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+        # set when a lease of this update expired, its ASG updates stop before changing anything else
+        self.lease_lost = threading.Event()
+        self.template_preprocessor = TemplatePreprocessor(self._get_template, template_cache_dir)
+        self.cancelled = cancelled or threading.Event()
+
+        self.event_bus = events.EventBus()
+        if observer_callback:
+            self.event_bus.subscribe(observer_callback)
+        self._remotely_validated_templates = connections.remotely_validated_templates
+
+    @contextmanager
+    def leased(self, key):
+        """
+        Holds the lease on the key within the block. Reentrant, so a stack update holding the
+        stack's lease can go on updating its ASGs, and threads of the same update entering while
+        the lease is being acquired wait for it. Without a lease store nothing is locked.
+        """
+        if self.lease_store is None:
+            yield
+            return
+        with self._leases_lock:
+            held = self._leases.get(key)
+            first = held is None
+            if first:
+                held = self._leases[key] = _HeldLease(Lease(self.lease_store, key, self._lease_owner, clock=self.clock,
+                                                            on_lost=self.lease_lost.set))
+            held.users += 1
+        try:
+            if first:
+                try:
+                    held.lease.acquire(self.lease_timeout_in_seconds)
+                    held.acquired = True
+                except BaseException as e:
+                    held.error = e
+                    with self._leases_lock:
+                        # later blocks try again, those already waiting fail alike
+                        del self._leases[key]
+                    raise
+                finally:
+                    held.settled.set()
+            else:
+                while not held.settled.is_set():
+                    # waits in steps, so the waiting thread stays interruptible
+                    held.settled.wait(1)
+                if not held.acquired:
+                    raise held.error
+            yield
+        finally:
+            with self._leases_lock:
+                held.users -= 1
+                last = held.users == 0
+                if last and self._leases.get(key) is held:
+                    del self._leases[key]
+            if last and held.acquired:
+                held.lease.release()
+
+    def cancel(self):
+        """
+        Makes running ASG updates roll back and skips the remaining ASGs, e.g. from another thread.
+        """
+        self.cancelled.set()
 
-        dummy_observer_callback = lambda event: None
-        self.observer_callback = observer_callback or dummy_observer_callback
+    def stack_lease(self):
+        return self.leased("stack/{0}/{1}".format(self.region, self.stack_name))
+
+    def asg_lease(self, asg_name):
+        return self.leased("asg/{0}/{1}".format(self.region, asg_name))
 
     def get_all_asgs_from_stack(self):
         stack = describe_stack(self.cfn_conn, self.stack_name)
@@ -59,16 +199,57 @@ class StackUpdater(object):
 
         return get_all_autoscaling_groups(self.as_conn, stack)
 
+    def create_asg_updater(self, asg):
+        return ASGUpdater(asg,
+                          self.as_conn,
+                          self.ec2_conn,
+                          self.elb_conn,
+                          timeout_in_seconds=self.timeout_in_seconds,
+                          strict_update_check=self.strict_update_check,
+                          event_bus=self.event_bus,
+                          clock=self.clock,
+                          elb_health_poller=self.elb_health_poller,
+                          readiness_prober=self.readiness_prober,
+                          require_elb_in_service=self.require_elb_in_service,
+                          prewarm_standby=self.prewarm_standby,
+                          cancelled=self.cancelled,
+                          lease_lost=self.lease_lost)
+
+    def get_asgs(self, asg_names=None):
+        """
+        Returns the given ASGs without describing the stack, all ASGs of the stack when no names are given.
+        """
+        if asg_names is None:
+            return self.get_all_asgs_from_stack()
+        if not asg_names:
+            return []
+        return self.as_conn.get_all_groups(names=list(asg_names))
+
     @timed
-    def update_asgs(self):
-        for asg in self.get_all_asgs_from_stack():
-            self.logger.info("Updating ASG '{0}'.".format(asg.name))
-            ASGUpdater(asg,
-                       self.as_conn,
-                       self.ec2_conn,
-                       self.elb_conn,
-                       self.observer_callback,
-                       timeout_in_seconds=self.timeout_in_seconds).update()
+    def update_asgs(self, asg_names_to_skip=(), asg_names=None):
+        try:
+            with self.stack_lease():
+                for asg in self.get_asgs(asg_names):
+                    if asg.name in asg_names_to_skip:
+                        continue
+                    if self.cancelled.is_set():
+                        raise CancelledException("Update of stack {0} was cancelled.".format(self.stack_name))
+                    self.logger.info("Updating ASG '{0}'.".format(asg.name))
+                    with self.asg_lease(asg.name):
+                        self.create_asg_updater(asg).update()
+        finally:
+            self._close_readiness_prober()
+            self._flush_events()
+
+    def _flush_events(self):
+        if not self.event_bus.flush(EVENT_FLUSH_TIMEOUT_IN_SECONDS):
+            self.logger.warning("Observers did not take all events within {0} seconds, not waiting for them.".format(
+                EVENT_FLUSH_TIMEOUT_IN_SECONDS))
+
+    def _close_readiness_prober(self):
+        # probed instances are gone after a rollout, connections to them must not pile up in the daemon
+        if self.readiness_prober:
+            self.readiness_prober.close()
 
     def _get_filecontent_from_bucket(self, bucketname, filename):
         bucket = self.s3_conn.get_bucket(bucketname)
@@ -94,24 +275,55 @@ class StackUpdater(object):
 
         return template
 
-    def _do_update_or_create(self, action, template, stack_parameters):
+    def _stage_template(self, template):
+        """
+        Uploads the template to the staging bucket under a content-hash key and returns its https url.
+        Uploading is skipped when the key already exists.
+        """
+        if not self.template_bucket:
+            raise TemplateValidationException(
+                "Template is too large to be passed inline, a template bucket for staging is needed.")
+        key_name = "aws-ha-updater/{0}.json".format(template_hash(template))
+        try:
+            bucket = self.s3_conn.get_bucket(self.template_bucket)
+            if bucket.get_key(key_name) is None:
+                self.logger.info("Staging template as s3://{0}/{1}.".format(self.template_bucket, key_name))
+                bucket.new_key(key_name).set_contents_from_string(template)
+        except boto.exception.BotoServerError, e:
+            raise BucketNotAccessibleException(
+                "Unable to stage template in bucket: '{0}'. Caused by: {1}.".format(self.template_bucket, e))
+        return s3_url_to_https_url("s3://{0}/{1}".format(self.template_bucket, key_name), self.region)
+
+    @staticmethod
+    def _template_arguments(template, template_url):
+        if template_url:
+            return {"template_url": template_url}
+        return {"template_body": template}
+
+    def _do_update_or_create(self, action, template, stack_parameters, template_url=None):
+        """
+        Returns False when there was nothing to update.
+        """
         self.logger.info("Using stack parameters: {0}".format(stack_parameters))
 
         try:
-            action(self.stack_name, template_body=template,
+            action(self.stack_name,
                    parameters=stack_parameters.items(),
-                   capabilities=['CAPABILITY_IAM'])
+                   capabilities=['CAPABILITY_IAM'],
+                   **self._template_arguments(template, template_url))
         except boto.exception.BotoServerError, e:
             error = json.loads(e.body).get("Error", "{}")
             error_message = error.get("Message")
             if error_message == "No updates are to be performed.":
                 self.logger.info("Nothing to do: {0}.".format(error_message))
+                return False
             else:
                 error_code = error.get("Code")
                 self.logger.error("Stack '{0}' does not exist.".format(self.stack_name))
                 raise Exception("{0}: {1}.".format(error_code, error_message))
         except BaseException, e:
             raise Exception("Something went horribly wrong: {0}.".format(e.message))
+        return True
 
     def _get_template_of_running_stack(self, stack):
         return "".join(
@@ -129,25 +341,144 @@ class StackUpdater(object):
 
         return merged_stack_parameters
 
-    def update_stack(self, stack_parameters, template_filename=None, lenient_lookback=5, action_timeout=300,
-                     warmup_seconds=25):
+    def _preprocess_template(self, template_filename):
+        return self.template_preprocessor.process(template_filename)
+
+    def _get_template_or_url(self, template_filename):
+        """
+        Templates in s3 are passed to CloudFormation by url instead of downloading them first,
+        local templates are preprocessed.
+        """
+        if template_filename.startswith("s3"):
+            return (None, s3_url_to_https_url(template_filename, self.region))
+        return (self._preprocess_template(template_filename), None)
+
+    def _is_unchanged(self, stack, template, stack_parameters):
+        """
+        Compares canonical template hashes, so reformatting a template does not trigger an update.
+        """
+        running_parameters = dict((parameter.key, unicode(parameter.value)) for parameter in stack.parameters)
+        if running_parameters != dict((key, unicode(value)) for key, value in stack_parameters.iteritems()):
+            return False
+        try:
+            return canonical_template_hash(template) == \
+                canonical_template_hash(self._get_template_of_running_stack(stack))
+        except TemplateValidationException:
+            return False
+
+    def _validate_and_stage(self, template, stack_parameters, template_url):
+        """
+        Validates template and parameters locally first, so bad input fails without a round trip.
+        Only templates passing the local checks are staged when too large and sent to ValidateTemplate.
+        Templates only known by url cannot be checked locally.
+        Returns the url to pass to CloudFormation instead of the template body, if any.
+        """
+        if template is not None:
+            validate_stack_parameters(template, stack_parameters)
+            if template_url is None and is_too_large_for_template_body(template):
+                template_url = self._stage_template(template)
+        self._validate_remotely(template, template_url)
+        return template_url
+
+    def _validate_remotely(self, template, template_url):
+        key = template_hash(template) if template is not None else template_url
+        if key in self._remotely_validated_templates:
+            return
+        try:
+            self.cfn_conn.validate_template(**self._template_arguments(template, template_url))
+        except boto.exception.BotoServerError, e:
+            raise TemplateValidationException("Template rejected by CloudFormation: {0}.".format(e.message or e.body))
+        self._remotely_validated_templates.add(key)
+
+    def _start_update_or_create(self, stack_parameters, template_filename, change_set_update=None):
+        """
+        Returns False when CloudFormation has nothing to update. With a change set update,
+        changed_asg_names is set to the ASGs the update is going to change.
+        """
         stack = describe_stack(self.cfn_conn, self.stack_name)
+        if change_set_update is not None:
+            self.changed_asg_names = []
+            if change_set_update.preview_only and not stack:
+                print "stack %s does not exist yet and would be created" % self.stack_name
+                return False
+        self.event_bus.publish(events.STACK_UPDATE_STARTED, stack_name=self.stack_name, created=not stack)
 
         if stack:
             self.logger.info("Start updating running stack.")
 
             if template_filename is None:
                 template = self._get_template_of_running_stack(stack)
+                template_url = None
             else:
-                template = self._get_template(template_filename)
+                (template, template_url) = self._get_template_or_url(template_filename)
 
             updated_stack_parameters = self._merge_stack_parameters(stack, stack_parameters)
+            if template_filename is not None and template is not None and \
+                    self._is_unchanged(stack, template, updated_stack_parameters):
+                self.logger.info("Template and parameters are unchanged, nothing to update.")
+                return False
+            template_url = self._validate_and_stage(template, updated_stack_parameters, template_url)
 
-            self._do_update_or_create(self.cfn_conn.update_stack, template, updated_stack_parameters)
+            if change_set_update is not None:
+                if not change_set_update.run(template, updated_stack_parameters, template_url):
+                    return False
+                self.changed_asg_names = change_set_update.get_asg_names_to_update()
+                return True
+            return self._do_update_or_create(self.cfn_conn.update_stack, template, updated_stack_parameters,
+                                             template_url)
         else:
             self.logger.info("Start creating stack.")
+            self.changed_asg_names = None
 
-            template = self._get_template(template_filename)
-            self._do_update_or_create(self.cfn_conn.create_stack, template, stack_parameters)
+            (template, template_url) = self._get_template_or_url(template_filename)
+            template_url = self._validate_and_stage(template, stack_parameters, template_url)
+            return self._do_update_or_create(self.cfn_conn.create_stack, template, stack_parameters, template_url)
 
-        wait_for_action_to_complete(self.cfn_conn, self.stack_name, warmup_seconds, lenient_lookback, action_timeout)
+    def _create_change_set_update(self, use_change_set, preview_only, action_timeout):
+        if not use_change_set and not preview_only:
+            return None
+        return ChangeSetUpdate(self.cfn_conn, self.stack_name, preview_only, action_timeout, self.clock)
+
+    def update_stack(self, stack_parameters, template_filename=None, lenient_lookback=5, action_timeout=300,
+                     warmup_seconds=25, use_change_set=False, preview_only=False):
+        """
+        Returns 0 when the stack was updated successfully or there was nothing to update,
+        the result of wait_for_action_to_complete otherwise.
+        With a change set, the changes are previewed first and only previewed with preview_only.
+        STACK_UPDATE_FINISHED is published in any case, with result None when the update raised.
+        """
+        result = None
+        try:
+            change_set_update = self._create_change_set_update(use_change_set, preview_only, action_timeout)
+            with self.stack_lease():
+                if self._start_update_or_create(stack_parameters, template_filename, change_set_update):
+                    result = wait_for_action_to_complete(self.cfn_conn, self.stack_name, warmup_seconds,
+                                                         lenient_lookback, action_timeout, self.clock)
+                else:
+                    result = 0
+            return result
+        finally:
+            self.event_bus.publish(events.STACK_UPDATE_FINISHED, stack_name=self.stack_name, result=result)
+            self._flush_events()
+
+    def update_stack_and_asgs_pipelined(self, stack_parameters, template_filename=None, lenient_lookback=5,
+                                        action_timeout=300, warmup_seconds=25, use_change_set=False,
+                                        preview_only=False):
+        """
+        Like update_stack followed by update_asgs, but starts the rollout of each ASG as soon as
+        CloudFormation finished updating it, while the rest of the stack is still being updated.
+        """
+        result = None
+        try:
+            change_set_update = self._create_change_set_update(use_change_set, preview_only, action_timeout)
+            with self.stack_lease():
+                if self._start_update_or_create(stack_parameters, template_filename, change_set_update):
+                    result = PipelinedRollout(self).run(warmup_seconds, lenient_lookback, action_timeout)
+                else:
+                    result = 0
+                    self.update_asgs(asg_names=self.changed_asg_names)
+            return result
+        finally:
+            self._close_readiness_prober()
+            self.event_bus.publish(events.STACK_UPDATE_FINISHED, stack_name=self.stack_name, result=result)
+            self._flush_events()
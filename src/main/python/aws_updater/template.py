@@ -0,0 +1,143 @@
+import hashlib
+import json
+import re
+
+
+# CloudFormation rejects larger templates passed inline as template_body
+MAX_TEMPLATE_BODY_SIZE = 51200
+
+
+class TemplateValidationException(Exception):
+    pass
+
+
+_parameter_declarations_by_hash = {}
+
+
+def template_hash(template):
+    if isinstance(template, unicode):
+        template = template.encode("utf-8")
+    return hashlib.sha1(template).hexdigest()
+
+
+def is_too_large_for_template_body(template):
+    if isinstance(template, unicode):
+        template = template.encode("utf-8")
+    return len(template) > MAX_TEMPLATE_BODY_SIZE
+
+
+def load_json_template(template, location="Template"):
+    try:
+        return json.loads(template)
+    except ValueError as e:
+        raise TemplateValidationException("{0} is not valid JSON: {1}".format(location, e))
+
+
+def dump_canonical_template(parsed_template):
+    """
+    Dumps the template with sorted keys and without whitespace, utf-8 encoded.
+    """
+    template = json.dumps(parsed_template, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    if isinstance(template, unicode):
+        template = template.encode("utf-8")
+    return template
+
+
+def minify_template(template):
+    return dump_canonical_template(load_json_template(template))
+
+
+def canonical_template_hash(template):
+    """
+    Equal for templates differing only in formatting and key order.
+    """
+    return template_hash(minify_template(template))
+
+
+def s3_url_to_https_url(s3_url, region):
+    """
+    Uses the regional endpoint, the global one is not served in opt-in regions. Buckets with dots
+    in their name are addressed by path, as they do not match the wildcard TLS certificate.
+    """
+    urlparts = s3_url.split('/')
+    bucketname = urlparts[2]
+    filename = '/'.join(urlparts[3:])
+    domain = "amazonaws.com.cn" if region.startswith("cn-") else "amazonaws.com"
+    if "." in bucketname:
+        return "https://s3.{0}.{1}/{2}/{3}".format(region, domain, bucketname, filename)
+    return "https://{0}.s3.{1}.{2}/{3}".format(bucketname, region, domain, filename)
+
+
+def get_parameter_declarations(template):
+    """
+    Parses the template and returns its 'Parameters' section.
+    Results are cached by template hash, so each template is parsed only once.
+    """
+    key = template_hash(template)
+    if key not in _parameter_declarations_by_hash:
+        _parameter_declarations_by_hash[key] = _parse_parameter_declarations(template)
+    return _parameter_declarations_by_hash[key]
+
+
+def _parse_parameter_declarations(template):
+    parsed_template = load_json_template(template)
+    if not isinstance(parsed_template, dict):
+        raise TemplateValidationException("Template must be a JSON object.")
+    resources = parsed_template.get("Resources")
+    if not isinstance(resources, dict) or not resources:
+        raise TemplateValidationException("Template must declare at least one resource in 'Resources'.")
+
+    declarations = parsed_template.get("Parameters", {})
+    if not isinstance(declarations, dict):
+        raise TemplateValidationException("Template section 'Parameters' must be a JSON object.")
+    for name, declaration in declarations.iteritems():
+        if not isinstance(declaration, dict) or "Type" not in declaration:
+            raise TemplateValidationException("Parameter '{0}' must declare a 'Type'.".format(name))
+    return declarations
+
+
+def validate_stack_parameters(template, stack_parameters):
+    """
+    Checks the stack parameters against the parameter declarations of the template
+    without talking to AWS. Raises TemplateValidationException listing all problems found.
+    """
+    declarations = get_parameter_declarations(template)
+    stack_parameters = dict(stack_parameters)
+    problems = []
+
+    for name in sorted(stack_parameters):
+        if name not in declarations:
+            problems.append("Parameter '{0}' is not declared in the template.".format(name))
+
+    for name, declaration in sorted(declarations.iteritems()):
+        if name not in stack_parameters:
+            if "Default" not in declaration:
+                problems.append("Parameter '{0}' is required but not given.".format(name))
+            continue
+        if str(declaration.get("NoEcho", "false")).lower() == "true":
+            # values of running stacks come back masked as '****'
+            continue
+        problems.extend(_check_parameter_value(name, declaration, unicode(stack_parameters[name])))
+
+    if problems:
+        raise TemplateValidationException(" ".join(problems))
+
+
+def _check_parameter_value(name, declaration, value):
+    problems = []
+    allowed_values = declaration.get("AllowedValues")
+    if allowed_values is not None and value not in [unicode(v) for v in allowed_values]:
+        problems.append("Parameter '{0}' has value '{1}', allowed values are: {2}.".format(
+            name, value, ", ".join(unicode(v) for v in allowed_values)))
+
+    allowed_pattern = declaration.get("AllowedPattern")
+    if allowed_pattern is not None and not re.match(r"(?:{0})\Z".format(allowed_pattern), value):
+        problems.append("Parameter '{0}' has value '{1}' which does not match pattern '{2}'.".format(
+            name, value, allowed_pattern))
+
+    if declaration["Type"] == "Number":
+        try:
+            float(value)
+        except ValueError:
+            problems.append("Parameter '{0}' has value '{1}' which is not a number.".format(name, value))
+    return problems
@@ -0,0 +1,154 @@
+import logging
+import random
+import threading
+import time
+
+THROTTLING_ERROR_CODES = ("Throttling", "RequestLimitExceeded", "SlowDown")
+
+# requests per second and burst size per service
+DEFAULT_BUDGETS = {
+    "cloudformation": (2.0, 5),
+    "autoscaling": (5.0, 10),
+    "ec2": (10.0, 20),
+    "elb": (5.0, 10),
+    "s3": (20.0, 50),
+}
+FALLBACK_BUDGET = (5.0, 10)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket. Waiting callers are served in the order they arrived,
+    because each caller reserves the next free slot before sleeping.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next_slot = 0
+
+    def reserve(self):
+        """
+        Reserves a token and returns the number of seconds to wait before using it.
+        """
+        interval = 1 / self.rate
+        with self._lock:
+            now = time.time()
+            slot = max(self._next_slot, now - (self.burst - 1) * interval)
+            self._next_slot = slot + interval
+        return max(0, slot - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def is_empty(self):
+        """
+        True while a new caller has to wait for a token.
+        """
+        with self._lock:
+            return self._next_slot > time.time()
+
+
+class RateLimiter(object):
+
+    def __init__(self, budgets=None):
+        self._lock = threading.Lock()
+        self._budgets = dict(DEFAULT_BUDGETS)
+        self._budgets.update(budgets or {})
+        self._buckets = {}
+        self._retries_in_progress = {}
+
+    def set_budget(self, service, rate, burst, region=None):
+        """
+        Sets the budget for a service, either for all regions or for a single one.
+        """
+        key = (service, region) if region else service
+        with self._lock:
+            self._budgets[key] = (rate, burst)
+            for bucket_key in list(self._buckets):
+                if bucket_key[0] == service and region in (None, bucket_key[1]):
+                    del self._buckets[bucket_key]
+
+    def bucket(self, service, region):
+        with self._lock:
+            bucket = self._buckets.get((service, region))
+            if bucket is None:
+                budget = self._budgets.get((service, region)) or self._budgets.get(service) or FALLBACK_BUDGET
+                bucket = self._buckets[(service, region)] = TokenBucket(*budget)
+            return bucket
+
+    def acquire(self, service, region):
+        self.bucket(service, region).acquire()
+
+    def retry_started(self, service, region):
+        with self._lock:
+            self._retries_in_progress[(service, region)] = self._retries_in_progress.get((service, region), 0) + 1
+
+    def retry_finished(self, service, region):
+        with self._lock:
+            self._retries_in_progress[(service, region)] -= 1
+
+    def is_saturated(self, service, region=None):
+        """
+        True while requests to the service, in the region or any region, wait for a token or
+        are retried after being throttled. More requests would only be throttled as well.
+        """
+        with self._lock:
+            if any(count > 0 for (key, count) in self._retries_in_progress.items()
+                   if key[0] == service and region in (None, key[1])):
+                return True
+            buckets = [bucket for (key, bucket) in self._buckets.items()
+                       if key[0] == service and region in (None, key[1])]
+        return any(bucket.is_empty() for bucket in buckets)
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide rate limiter.
+    """
+    return _rate_limiter
+
+
+def is_throttled(response):
+    if response.status not in (400, 503):
+        return False
+    body = response.read()
+    return any(code in body for code in THROTTLING_ERROR_CODES)
+
+
+def throttle(conn, service, region, rate_limiter=None, max_retries=5, base_delay_in_seconds=0.5):
+    """
+    Routes every request made through the boto connection through the rate limiter, including
+    requests made by objects that were returned from it, and transparently retries throttled requests.
+    """
+    logger = logging.getLogger(__name__)
+    rate_limiter = rate_limiter or get_rate_limiter()
+    make_request = conn.make_request
+
+    def throttled_make_request(*args, **kwargs):
+        attempt = 0
+        try:
+            while True:
+                rate_limiter.acquire(service, region)
+                response = make_request(*args, **kwargs)
+                if attempt >= max_retries or not is_throttled(response):
+                    return response
+                delay = base_delay_in_seconds * (2 ** attempt) * random.uniform(0.5, 1)
+                if attempt == 0:
+                    rate_limiter.retry_started(service, region)
+                attempt += 1
+                logger.info("Request to {0} in {1} was throttled, retry {2} in {3:.1f} s.".format(
+                    service, region, attempt, delay))
+                time.sleep(delay)
+        finally:
+            if attempt > 0:
+                rate_limiter.retry_finished(service, region)
+
+    conn.make_request = throttled_make_request
+    return conn
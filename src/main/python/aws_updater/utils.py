@@ -1,6 +1,9 @@
+import threading
 from functools import wraps
 from time import time
 
+_thread_output = threading.local()
+
 
 def timed(function):
 
@@ -13,3 +16,42 @@ def timed(function):
         return result
 
     return wrapper
+
+
+def get_thread_output():
+    """
+    Returns the stream the output of the current thread is redirected to, e.g. by the daemon to the
+    client of a job, None when it is not redirected.
+    """
+    return getattr(_thread_output, "target", None)
+
+
+def set_thread_output(target):
+    _thread_output.target = target
+
+
+def with_thread_output(function):
+    """
+    Makes the function write its output where the calling thread writes it, also when it is run by
+    another thread, e.g. of a pool.
+    """
+    target = get_thread_output()
+
+    def wrapper(*args, **kwargs):
+        previous = get_thread_output()
+        set_thread_output(target)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            set_thread_output(previous)
+
+    return wrapper
+
+
+def new_thread(target, name, args=()):
+    """
+    Returns a daemon thread writing its output where the creating thread writes it.
+    """
+    thread = threading.Thread(target=with_thread_output(target), args=args, name=name)
+    thread.daemon = True
+    return thread
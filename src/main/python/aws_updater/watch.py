@@ -0,0 +1,155 @@
+import logging
+import re
+import time
+
+from aws_updater import SUCCESSFUL_STATES_COMPLETE, get_event_epoch
+
+STACK_RESOURCE_TYPE = "AWS::CloudFormation::Stack"
+
+
+def is_in_progress(status):
+    return status.endswith("_IN_PROGRESS")
+
+
+def format_event(event):
+    reason = event.resource_status_reason or ""
+    resource_type = re.sub(".*::", "", event.resource_type)
+    return "%s %-30s %40s  %-10s %-20s  %s" % (event.timestamp.strftime("%H:%M:%S"), event.stack_name,
+                                               event.resource_status, event.logical_resource_id, resource_type,
+                                               reason)
+
+
+class _WatchedStack(object):
+    __slots__ = ("name", "active", "next_poll_at", "younger_than", "seen_event_ids")
+
+    def __init__(self, name, active, next_poll_at, younger_than):
+        self.name = name
+        self.active = active
+        self.next_poll_at = next_poll_at
+        self.younger_than = younger_than
+        self.seen_event_ids = set()
+
+
+class StackWatcher(object):
+    """
+    Polls the events of many stacks through one cloudformation connection, never making more than
+    requests_per_second requests. Stacks with an action in progress are polled every active interval,
+    idle stacks every idle interval, and a stack is no longer tracked once an action on it finished.
+    With a prefix, the stacks are discovered again every idle interval, so stacks created or updated
+    later are picked up as well.
+    """
+
+    def __init__(self, cfn_conn, stack_names=(), prefix=None, requests_per_second=1.0, active_interval_in_seconds=2,
+                 idle_interval_in_seconds=30, lenient_look_back=5, clock=time):
+        self.logger = logging.getLogger(__name__)
+        self.cfn_conn = cfn_conn
+        self.prefix = prefix
+        self.min_request_interval = 1.0 / requests_per_second
+        self.active_interval_in_seconds = active_interval_in_seconds
+        self.idle_interval_in_seconds = idle_interval_in_seconds
+        self.clock = clock
+        self.started = clock.time() - lenient_look_back
+        self.finished = {}
+        self._stacks = {}
+        self._next_request_at = clock.time()
+        self._next_discovery_at = clock.time()
+        for stack_name in stack_names:
+            self._track(stack_name, active=False)
+
+    def _track(self, stack_name, active):
+        self.finished.pop(stack_name, None)
+        self._stacks[stack_name] = _WatchedStack(stack_name, active, self.clock.time(), self.started)
+
+    def _finish(self, stack, status):
+        self.logger.info("Stack {0} finished with {1}, no longer watching it.".format(stack.name, status))
+        del self._stacks[stack.name]
+        self.finished[stack.name] = status
+
+    def _request(self, function, *args):
+        now = self.clock.time()
+        if now < self._next_request_at:
+            self.clock.sleep(self._next_request_at - now)
+        self._next_request_at = max(now, self._next_request_at) + self.min_request_interval
+        return function(*args)
+
+    def _discover(self):
+        next_token = None
+        while True:
+            stacks = self._request(self.cfn_conn.describe_stacks, None, next_token)
+            for stack in stacks:
+                if not stack.stack_name.startswith(self.prefix) or stack.stack_status == "DELETE_COMPLETE":
+                    continue
+                active = is_in_progress(stack.stack_status)
+                if stack.stack_name not in self._stacks and (stack.stack_name not in self.finished or active):
+                    self._track(stack.stack_name, active)
+            next_token = getattr(stacks, "next_token", None)
+            if not next_token:
+                return
+
+    def _poll(self, stack):
+        try:
+            events = self._request(self.cfn_conn.describe_stack_events, stack.name)
+        except Exception as e:
+            if "does not exist" not in str(e):
+                raise
+            self._finish(stack, "DELETE_COMPLETE")
+            return []
+
+        new_events = [event for event in events
+                      if get_event_epoch(event) >= stack.younger_than and event.event_id not in stack.seen_event_ids]
+        if new_events:
+            stack.younger_than = max(get_event_epoch(event) for event in new_events)
+            stack.seen_event_ids = set(event.event_id for event in events
+                                       if get_event_epoch(event) >= stack.younger_than)
+
+        stack_events = [event for event in new_events
+                        if event.resource_type == STACK_RESOURCE_TYPE and event.logical_resource_id == stack.name]
+        if stack_events and not is_in_progress(stack_events[0].resource_status):
+            self._finish(stack, stack_events[0].resource_status)
+        else:
+            # stacks only have events during an action, an update begun before the watcher
+            # started shows only resource events
+            stack.active = stack.active or bool(new_events)
+            interval = self.active_interval_in_seconds if stack.active else self.idle_interval_in_seconds
+            stack.next_poll_at = self.clock.time() + interval
+        return list(reversed(new_events))
+
+    def poll(self):
+        """
+        Polls all stacks that are due and returns their new events, oldest first.
+        """
+        if self.prefix is not None and self.clock.time() >= self._next_discovery_at:
+            self._discover()
+            self._next_discovery_at = self.clock.time() + self.idle_interval_in_seconds
+
+        now = self.clock.time()
+        due_stacks = sorted((stack for stack in self._stacks.values() if stack.next_poll_at <= now),
+                            key=lambda stack: stack.next_poll_at)
+        new_events = []
+        for stack in due_stacks:
+            new_events.extend(self._poll(stack))
+        return sorted(new_events, key=get_event_epoch)
+
+    def is_done(self):
+        return self.prefix is None and not self._stacks
+
+    def _sleep_until_next_poll(self):
+        next_poll_at = [stack.next_poll_at for stack in self._stacks.values()]
+        if self.prefix is not None:
+            next_poll_at.append(self._next_discovery_at)
+        delay = min(next_poll_at) - self.clock.time()
+        if delay > 0:
+            self.clock.sleep(delay)
+
+    def watch(self):
+        """
+        Prints the new events of all stacks until no stack is left to watch. Returns 0 when
+        all actions completed successfully, 1 otherwise.
+        """
+        while not self.is_done():
+            for event in self.poll():
+                print format_event(event)
+            if not self.is_done():
+                self._sleep_until_next_poll()
+        failed = [name for name, status in self.finished.iteritems() if status not in SUCCESSFUL_STATES_COMPLETE]
+        return 1 if failed else 0
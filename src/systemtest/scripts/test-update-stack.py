@@ -85,9 +85,10 @@ def count_running_instances(asg):
     return count
 
 def test_no_update():
+    observed_events = []
+
     def callback(event):
-        if event == ASGUpdater.SCALE_OUT_COMPLETED:
-            raise Exception("No update --> no scaleout!")
+        observed_events.append(event)
 
     # action plan
     asg_before = get_asg()
@@ -102,6 +103,8 @@ def test_no_update():
 
     StackUpdater(stack_name, region, observer_callback=callback).update_asgs()
 
+    assert ASGUpdater.SCALE_OUT_COMPLETED not in observed_events, "No update --> no scaleout!"
+
     asg_after = get_asg()
     running_instances_after = count_running_instances(asg_after)
     logger.info("ASG sizing after update: " + sizing_info(asg_after))
@@ -116,16 +119,14 @@ def test_no_update():
 
 
 def test_update():
+    # observers run on the event bus worker thread, so assertions are made after the update
+    asgs_after_scale_out = []
+
     def callback(event):
         if event == ASGUpdater.SCALE_OUT_COMPLETED:
             asg = get_asg()
             print "ASG sizing after scale_out: " + sizing_info(asg)
-
-            #TODO: test more precisely
-            assert asg.min_size > asg_before.min_size, "ASG min_size should be bigger than before scale_out"
-            assert asg.max_size > asg_before.max_size, "ASG max_size should be bigger than before scale_out"
-            assert asg.desired_capacity > asg_before.desired_capacity, \
-                "ASG desired_capacity should be bigger than before scale_out"
+            asgs_after_scale_out.append(asg)
 
     # action plan
     asg_before = get_asg()
@@ -144,6 +145,14 @@ def test_update():
 
     StackUpdater(stack_name, region, observer_callback=callback).update_asgs()
 
+    assert asgs_after_scale_out, "ASG should have been scaled out"
+    asg = asgs_after_scale_out[0]
+    #TODO: test more precisely
+    assert asg.min_size > asg_before.min_size, "ASG min_size should be bigger than before scale_out"
+    assert asg.max_size > asg_before.max_size, "ASG max_size should be bigger than before scale_out"
+    assert asg.desired_capacity > asg_before.desired_capacity, \
+        "ASG desired_capacity should be bigger than before scale_out"
+
     logger.info("Waiting 300s to ensure asg is in consistent state...")
     time.sleep(300)
     asg_after = get_asg()
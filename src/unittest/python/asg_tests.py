@@ -1,3 +1,4 @@
+import threading
 from unittest import TestCase
 
 from mock import Mock, patch, call
@@ -5,7 +6,10 @@ from boto.ec2.elb import ELBConnection
 from boto.ec2 import EC2Connection
 from boto.ec2.autoscale import AutoScalingGroup, AutoScaleConnection
 
-from aws_updater.asg import ASGUpdater, RolledBackException, TimeoutException
+from aws_updater.elb import ELBHealthPoller
+from aws_updater.locking import LeaseLostException
+from aws_updater.replay import VirtualClock
+from aws_updater.asg import ASGUpdater, InstanceView, RolledBackException, TimeoutException, CancelledException
 
 
 class ASGUpdaterTests(TestCase):
@@ -13,6 +17,7 @@ class ASGUpdaterTests(TestCase):
     def setUp(self):
         self.asg = Mock(AutoScalingGroup, max_size=0, min_size=0, desired_capacity=0, launch_config_name="any-lc")
         self.asg.instances = []
+        self.asg.load_balancers = []
         self.asg.name = "any-asg-name"
         self.asg_conn = Mock(AutoScaleConnection)
         self.ec2_conn = Mock(EC2Connection)
@@ -21,7 +26,8 @@ class ASGUpdaterTests(TestCase):
         self.asg_updater = ASGUpdater(self.asg,
                                       self.asg_conn,
                                       self.ec2_conn,
-                                      self.elb_conn)
+                                      self.elb_conn,
+                                      elb_health_poller=ELBHealthPoller(self.elb_conn))
 
     def tearDown(self):
         patch.stopall()
@@ -33,6 +39,51 @@ class ASGUpdaterTests(TestCase):
         self.asg_conn.terminate_instance.assert_any_call("any-machine-id", decrement_capacity=False)
         self.asg_conn.terminate_instance.assert_any_call("any-other-machine-id", decrement_capacity=False)
 
+    def _draining_updater(self):
+        self.asg.load_balancers = ["elb-1", "elb-2"]
+        self.elb_conn.get_lb_attribute.side_effect = lambda elb_name, attribute: {
+            "elb-1": Mock(enabled=True, timeout=30), "elb-2": Mock(enabled=False)}[elb_name]
+        self.clock = VirtualClock(1000)
+        return ASGUpdater(self.asg, self.asg_conn, self.ec2_conn, self.elb_conn, clock=self.clock,
+                          elb_health_poller=ELBHealthPoller(self.elb_conn, clock=self.clock))
+
+    def test_should_deregister_and_drain_instances_before_terminating(self):
+        updater = self._draining_updater()
+        health = {"elb-1": [Mock(instance_id="i-1", state="OutOfService"), Mock(instance_id="i-3", state="InService")],
+                  "elb-2": []}
+
+        def describe_instance_health(elb_name):
+            if self.clock.time() >= 1005:
+                health["elb-1"] = health["elb-1"][1:]
+            return health[elb_name]
+
+        self.elb_conn.describe_instance_health.side_effect = describe_instance_health
+        self.asg_conn.terminate_instance.side_effect = lambda *args, **kwargs: self.assertEqual(self.clock.time(), 1005)
+
+        updater._terminate_instances(["i-1", "i-2"])
+
+        self.elb_conn.deregister_instances.assert_any_call("elb-1", ["i-1", "i-2"])
+        self.elb_conn.deregister_instances.assert_any_call("elb-2", ["i-1", "i-2"])
+        self.assertEqual(self.asg_conn.terminate_instance.call_count, 2)
+
+    def test_should_terminate_after_draining_timeout(self):
+        updater = self._draining_updater()
+        self.elb_conn.describe_instance_health.return_value = [Mock(instance_id="i-1", state="OutOfService")]
+
+        updater._terminate_instances(["i-1"])
+
+        self.assertEqual(self.clock.time(), 1030)
+        self.asg_conn.terminate_instance.assert_called_once_with("i-1", decrement_capacity=False)
+
+    def test_should_terminate_when_deregistering_fails(self):
+        updater = self._draining_updater()
+        self.elb_conn.deregister_instances.side_effect = Exception("InvalidInstance")
+        self.elb_conn.describe_instance_health.return_value = []
+
+        updater._terminate_instances(["i-1"])
+
+        self.asg_conn.terminate_instance.assert_called_once_with("i-1", decrement_capacity=False)
+
     def test_should_terminate_old_instances_when_committing_update(self):
         self.asg.instances = [Mock(instance_id="1", launch_config_name="any-lc"),
                               Mock(instance_id="resource_id_of_instance_with_old_lc", launch_config_name="any-old-lc"),
@@ -98,41 +149,229 @@ class ASGUpdaterTests(TestCase):
     def test_should_get_nr_of_uptodate_instances(self, views):
         self.asg.launch_config_name = "current-lc"
         views.return_value = {
-            u'i-46cd9105': {
-                'asg': Mock(launch_config_name="current-lc"),
-                'elb': Mock(state="InService")},
+            u'i-46cd9105': InstanceView(u'i-46cd9105', launch_config_name="current-lc", elb_state="InService"),
             # Does not qualify, out of service
-            u'i-46cd9109': {
-                'asg': Mock(launch_config_name="current-lc"),
-                'elb': Mock(state="OutOfService")},
+            u'i-46cd9109': InstanceView(u'i-46cd9109', launch_config_name="current-lc", elb_state="OutOfService"),
             # Does not qualify, no elb
-            u'i-46cd9108': {
-                'asg': Mock(launch_config_name="current-lc")},
+            u'i-46cd9108': InstanceView(u'i-46cd9108', launch_config_name="current-lc"),
             # Does not qualify, other launch config and out of service
-            u'i-46cd9107': {
-                'asg': Mock(launch_config_name="other-lc"),
-                'elb': Mock(state="OutOfService")},
+            u'i-46cd9107': InstanceView(u'i-46cd9107', launch_config_name="other-lc", elb_state="OutOfService"),
             # Does not qualify, other launch config
-            u'i-46cd9145': {
-                'asg': Mock(launch_config_name="other-lc"),
-                'elb': Mock(state="InService")},
-            u'i-46cd9142': {
-                'asg': Mock(launch_config_name="current-lc"),
-                'elb': Mock(state="InService")},
+            u'i-46cd9145': InstanceView(u'i-46cd9145', launch_config_name="other-lc", elb_state="InService"),
+            u'i-46cd9142': InstanceView(u'i-46cd9142', launch_config_name="current-lc", elb_state="InService"),
         }
 
         self.assertEqual(self.asg_updater.get_nr_of_uptodate_instances(), 2)
 
+    def test_should_merge_instance_views_from_all_apis(self):
+        self.asg.instances = [Mock(instance_id="i-1"), Mock(instance_id="i-2")]
+        self.asg.load_balancers = ["any-elb"]
+        self.asg_conn.get_all_autoscaling_instances.return_value = [Mock(instance_id="i-1", launch_config_name="any-lc"),
+                                                                    Mock(instance_id="i-2", launch_config_name="old-lc")]
+        self.ec2_conn.get_only_instances.return_value = [Mock(id="i-1", image_id="ami-new", private_ip_address="10.0.0.1"),
+                                                         Mock(id="i-2", image_id="ami-old", private_ip_address="10.0.0.2")]
+        self.elb_conn.describe_instance_health.return_value = [Mock(instance_id="i-1", state="InService")]
+
+        views = self.asg_updater.get_instances_views()
+
+        self.assertEqual(views["i-1"].state(), ("ami-new", "any-lc", "InService", None))
+        self.assertEqual(views["i-2"].state(), ("ami-old", "old-lc", None, None))
+        self.assertEqual(views["i-1"].private_ip_address, "10.0.0.1")
+        self.elb_conn.describe_instance_health.assert_called_with("any-elb")
+
+    def test_should_print_only_changed_instances(self):
+        with patch("aws_updater.asg.print", create=True) as print_mock:
+            self.asg_updater.print_instances({"i-1": InstanceView("i-1", elb_state="OutOfService"),
+                                              "i-2": InstanceView("i-2", elb_state="InService")})
+            self.assertEqual(print_mock.call_count, 2)
+
+            print_mock.reset_mock()
+            self.asg_updater.print_instances({"i-1": InstanceView("i-1", elb_state="InService"),
+                                              "i-2": InstanceView("i-2", elb_state="InService")})
+            self.assertEqual(print_mock.call_count, 1)
+            self.assertTrue("i-1" in print_mock.call_args[0][0])
+
+    def test_should_print_summary_periodically(self):
+        self.asg_updater.SUMMARY_EVERY_N_TICKS = 2
+        instances = {"i-1": InstanceView("i-1", elb_state="InService")}
+
+        with patch("aws_updater.asg.ASGUpdater.print_summary") as print_summary:
+            self.asg_updater.print_instances(instances)
+            self.assertFalse(print_summary.called)
+            self.asg_updater.print_instances(instances)
+            print_summary.assert_called_with(instances)
+
+    @patch("aws_updater.asg.ASGUpdater.get_instances_views")
+    def test_should_not_need_update_without_querying_views_when_all_instances_are_uptodate(self, views):
+        self.asg.instances = [Mock(lifecycle_state="InService", launch_config_name="any-lc"),
+                              Mock(lifecycle_state="Terminating", launch_config_name="any-old-lc")]
+
+        self.assertFalse(self.asg_updater.needs_update())
+        self.assertFalse(views.called)
+
+    @patch("aws_updater.asg.ASGUpdater.get_nr_of_uptodate_instances")
+    def test_should_need_update_when_instances_have_old_launch_config(self, nr_of_uptodate_instances):
+        self.asg.instances = [Mock(lifecycle_state="InService", launch_config_name="any-lc"),
+                              Mock(lifecycle_state="InService", launch_config_name="any-old-lc")]
+        nr_of_uptodate_instances.return_value = 1
+
+        self.assertTrue(self.asg_updater.needs_update())
+
+    @patch("aws_updater.asg.ASGUpdater.get_nr_of_uptodate_instances")
+    def test_should_query_views_on_strict_update_check(self, nr_of_uptodate_instances):
+        self.asg.instances = [Mock(lifecycle_state="InService", launch_config_name="any-lc")]
+        nr_of_uptodate_instances.return_value = 0
+        self.asg_updater.strict_update_check = True
+
+        self.assertTrue(self.asg_updater.needs_update())
+
+    def test_should_publish_each_instance_ready_once(self):
+        self.asg_updater.event_bus = Mock()
+        instances = {"i-1": InstanceView("i-1", launch_config_name="any-lc", elb_state="InService"),
+                     "i-2": InstanceView("i-2", launch_config_name="any-lc", elb_state="OutOfService")}
+
+        self.asg_updater._publish_ready_instances(instances)
+        self.asg_updater._publish_ready_instances(instances)
+
+        self.asg_updater.event_bus.publish.assert_called_once_with("INSTANCE_READY", asg_name="any-asg-name",
+                                                                   instance_id="i-1")
+
+    def test_should_publish_rollback_events(self):
+        self.asg_updater.event_bus = Mock()
+
+        self.asg_updater.rollback()
+
+        published = [c[0][0] for c in self.asg_updater.event_bus.publish.call_args_list]
+        self.assertEqual(published, ["ROLLBACK_STARTED", "ROLLBACK_COMPLETED"])
+
+    def test_should_probe_only_new_instances(self):
+        self.asg_updater.readiness_prober = Mock(check=Mock(return_value=set(["10.0.0.1"])))
+        instances = {"i-1": InstanceView("i-1", launch_config_name="any-lc", private_ip_address="10.0.0.1"),
+                     "i-2": InstanceView("i-2", launch_config_name="any-lc", private_ip_address="10.0.0.2"),
+                     "i-3": InstanceView("i-3", launch_config_name="old-lc", private_ip_address="10.0.0.3")}
+
+        self.asg_updater._probe_new_instances(instances)
+
+        self.assertEqual(sorted(self.asg_updater.readiness_prober.check.call_args[0][0]), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual([instances[id].probe_ready for id in ("i-1", "i-2", "i-3")], [True, False, None])
+
+    def test_should_count_instance_ready_on_probe_success(self):
+        self.asg_updater.readiness_prober = Mock()
+        instances = {"i-1": InstanceView("i-1", launch_config_name="any-lc", elb_state="OutOfService", probe_ready=True),
+                     "i-2": InstanceView("i-2", launch_config_name="any-lc", elb_state="InService", probe_ready=False)}
+
+        self.assertEqual(self.asg_updater.get_uptodate_instance_ids(instances), ["i-1"])
+
+    def test_should_require_probe_and_elb_when_asked_for_both(self):
+        self.asg_updater.readiness_prober = Mock()
+        self.asg_updater.require_elb_in_service = True
+
+        self.assertFalse(self.asg_updater.is_ready(InstanceView("i-1", elb_state="OutOfService", probe_ready=True)))
+        self.assertTrue(self.asg_updater.is_ready(InstanceView("i-1", elb_state="InService", probe_ready=True)))
+
     def test_should_commit_after_update(self):
-        mock_updater = Mock(ASGUpdater)
+        mock_updater = Mock(ASGUpdater, prewarm_standby=False)
 
         ASGUpdater.update(mock_updater)
 
         mock_updater.commit_update.assert_called_with()
         self.assertEqual(mock_updater.rollback.called, False)
 
+    def test_should_launch_standby_instances_and_cut_over_when_prewarming(self):
+        mock_updater = Mock(ASGUpdater, prewarm_standby=True)
+
+        ASGUpdater.update(mock_updater)
+
+        self.assertEqual(mock_updater.method_calls[1:], [call.launch_standby_instances(), call.cut_over(),
+                                                         call.commit_update()])
+        self.assertFalse(mock_updater.scale_out.called)
+
+    def test_should_need_readiness_probe_to_prewarm(self):
+        self.assertRaises(ValueError, ASGUpdater, self.asg, self.asg_conn, self.ec2_conn, self.elb_conn,
+                          prewarm_standby=True)
+
+    @patch("aws_updater.asg.time.sleep")
+    def test_should_move_new_instances_into_standby_until_ready(self, sleep):
+        self.asg.instances = [Mock(instance_id="i-old", launch_config_name="old-lc", lifecycle_state="InService")]
+        prober = Mock()
+        prober.check.side_effect = [set(), set(["10.0.0.1"])]
+        updater = ASGUpdater(self.asg, self.asg_conn, self.ec2_conn, self.elb_conn, readiness_prober=prober,
+                             prewarm_standby=True, elb_health_poller=ELBHealthPoller(self.elb_conn))
+        launched = Mock(max_size=1, min_size=0, desired_capacity=1, launch_config_name="any-lc", load_balancers=[],
+                        instances=[self.asg.instances[0],
+                                   Mock(instance_id="i-new", launch_config_name="any-lc", lifecycle_state="InService")])
+        launched.name = "any-asg-name"
+        in_standby = Mock(max_size=2, min_size=0, desired_capacity=1, launch_config_name="any-lc", load_balancers=[],
+                          instances=[self.asg.instances[0],
+                                     Mock(instance_id="i-new", launch_config_name="any-lc", lifecycle_state="Standby")])
+        in_standby.name = "any-asg-name"
+        self.asg_conn.get_all_groups.side_effect = [[launched], [in_standby], [in_standby]]
+        self.asg_conn.get_all_autoscaling_instances.return_value = [Mock(instance_id="i-new", launch_config_name="any-lc")]
+        self.ec2_conn.get_only_instances.return_value = [Mock(id="i-new", image_id="ami-new",
+                                                              private_ip_address="10.0.0.1")]
+
+        updater.launch_standby_instances()
+
+        self.asg.suspend_processes.assert_called_with()
+        self.asg.resume_processes.assert_called_with(["Launch", "Terminate", "HealthCheck"])
+        self.assertEqual((self.asg.max_size, self.asg.desired_capacity), (1, 1))
+        self.asg_conn.get_status.assert_called_once_with("EnterStandby", {
+            "AutoScalingGroupName": "any-asg-name", "ShouldDecrementDesiredCapacity": "true",
+            "InstanceIds.member.1": "i-new"})
+        self.assertEqual(in_standby.max_size, 0)
+        self.assertTrue(in_standby.update.called)
+
+    @patch("aws_updater.asg.time.sleep")
+    def test_should_keep_instances_serving_before_update_in_service(self, sleep):
+        serving = Mock(instance_id="i-serving", launch_config_name="any-lc", lifecycle_state="InService")
+        self.asg.instances = [Mock(instance_id="i-old", launch_config_name="old-lc", lifecycle_state="InService"),
+                              serving]
+        prober = Mock()
+        prober.check.return_value = set(["10.0.0.1"])
+        updater = ASGUpdater(self.asg, self.asg_conn, self.ec2_conn, self.elb_conn, readiness_prober=prober,
+                             prewarm_standby=True, elb_health_poller=ELBHealthPoller(self.elb_conn))
+        launched = Mock(max_size=1, min_size=0, desired_capacity=2, launch_config_name="any-lc", load_balancers=[],
+                        instances=self.asg.instances + [Mock(instance_id="i-new", launch_config_name="any-lc",
+                                                             lifecycle_state="InService")])
+        launched.name = "any-asg-name"
+        in_standby = Mock(max_size=1, min_size=0, desired_capacity=2, launch_config_name="any-lc", load_balancers=[],
+                          instances=self.asg.instances + [Mock(instance_id="i-new", launch_config_name="any-lc",
+                                                               lifecycle_state="Standby")])
+        in_standby.name = "any-asg-name"
+        self.asg_conn.get_all_groups.side_effect = [[launched], [in_standby], [in_standby]]
+        self.asg_conn.get_all_autoscaling_instances.return_value = [Mock(instance_id="i-new", launch_config_name="any-lc")]
+        self.ec2_conn.get_only_instances.return_value = [Mock(id="i-new", image_id="ami-new",
+                                                              private_ip_address="10.0.0.1")]
+
+        updater.launch_standby_instances()
+
+        self.assertEqual(self.asg.desired_capacity, 1)
+        self.asg_conn.get_status.assert_called_once_with("EnterStandby", {
+            "AutoScalingGroupName": "any-asg-name", "ShouldDecrementDesiredCapacity": "true",
+            "InstanceIds.member.1": "i-new"})
+        self.assertEqual(updater._uptodate_instance_ids_kept, set(["i-serving"]))
+
+    @patch("aws_updater.asg.ASGUpdater.wait_for_scale_out_complete")
+    def test_should_move_standby_instances_in_service_on_cut_over(self, wait_for_scale_out_complete):
+        self.asg_updater.readiness_prober = Mock()
+        self.asg_updater.target_launch_config_name = "any-lc"
+        self.asg_updater.original_max_size = 2
+        self.asg_updater.original_desired_capacity = 1
+        self.asg.load_balancers = ["any-elb"]
+        self.asg.instances = [Mock(instance_id="i-old", launch_config_name="old-lc", lifecycle_state="InService"),
+                              Mock(instance_id="i-new", launch_config_name="any-lc", lifecycle_state="Standby")]
+        self.asg_conn.get_all_groups.return_value = [self.asg]
+
+        self.asg_updater.cut_over()
+
+        self.assertEqual(self.asg.max_size, 3)
+        self.asg_conn.get_status.assert_called_once_with("ExitStandby", {"AutoScalingGroupName": "any-asg-name",
+                                                                         "InstanceIds.member.1": "i-new"})
+        self.assertTrue(self.asg_updater.require_elb_in_service)
+        wait_for_scale_out_complete.assert_called_with(1)
+
     def test_should_rollback_after_failed_update(self):
-        mock_updater = Mock(ASGUpdater, asg=Mock(name="some-asg"))
+        mock_updater = Mock(ASGUpdater, asg=Mock(name="some-asg"), prewarm_standby=False)
         mock_updater.wait_for_scale_out_complete.side_effect = Exception("Timed out while slacking off")
 
         self.assertRaises(RolledBackException, ASGUpdater.update, mock_updater)
@@ -141,7 +380,7 @@ class ASGUpdaterTests(TestCase):
         self.assertEqual(mock_updater.commit_update.called, False)
 
     def test_should_rollback_when_ctrl_c_by_user(self):
-        mock_updater = Mock(ASGUpdater, asg=Mock(name="some-asg"))
+        mock_updater = Mock(ASGUpdater, asg=Mock(name="some-asg"), prewarm_standby=False)
         mock_updater.wait_for_scale_out_complete.side_effect = KeyboardInterrupt()
 
         self.assertRaises(KeyboardInterrupt, ASGUpdater.update, mock_updater)
@@ -157,20 +396,12 @@ class ASGUpdaterTests(TestCase):
         self.asg_conn.get_all_groups.return_value = (Mock(launch_config_name="current-lc"),)
         two_uptodate_after_two_tries = [
             {  # returned on first call of get_instances_views
-                u'i-46cd9105': {
-                    'asg': Mock(launch_config_name="current-lc"),
-                    'elb': Mock(state="InService")},
-                u'i-46cd9109': {
-                    'asg': Mock(launch_config_name="current-lc"),
-                    'elb': Mock(state="OutOfService")},
+                u'i-46cd9105': InstanceView(u'i-46cd9105', launch_config_name="current-lc", elb_state="InService"),
+                u'i-46cd9109': InstanceView(u'i-46cd9109', launch_config_name="current-lc", elb_state="OutOfService"),
             },
             {  # returned on second call
-                u'i-46cd9105': {
-                    'asg': Mock(launch_config_name="current-lc"),
-                    'elb': Mock(state="InService")},
-                u'i-46cd9109': {
-                    'asg': Mock(launch_config_name="current-lc"),
-                    'elb': Mock(state="InService")},
+                u'i-46cd9105': InstanceView(u'i-46cd9105', launch_config_name="current-lc", elb_state="InService"),
+                u'i-46cd9109': InstanceView(u'i-46cd9109', launch_config_name="current-lc", elb_state="InService"),
             }]
 
         views.side_effect = two_uptodate_after_two_tries
@@ -188,12 +419,58 @@ class ASGUpdaterTests(TestCase):
         self.asg_conn.get_all_groups.return_value = (Mock(launch_config_name="current-lc"),)
         time.side_effect = [0, 1200, 9000]
         views.return_value = {
-            u'i-46cd9105': {
-                'asg': Mock(launch_config_name="current-lc"),
-                'elb': Mock(state="OutOfService")},
-            u'i-46cd9109': {
-                'asg': Mock(launch_config_name="other-lc"),
-                'elb': Mock(state="InService")},
+            u'i-46cd9105': InstanceView(u'i-46cd9105', launch_config_name="current-lc", elb_state="OutOfService"),
+            u'i-46cd9109': InstanceView(u'i-46cd9109', launch_config_name="other-lc", elb_state="InService"),
         }
 
         self.assertRaises(TimeoutException, self.asg_updater.wait_for_scale_out_complete)
+
+    @patch("aws_updater.deadline.MIN_CALL_TIMEOUT_IN_SECONDS", 0.05)
+    @patch("aws_updater.asg.ASGUpdater.count_running_instances")
+    def test_should_time_out_when_describing_the_asg_stalls(self, running_instances):
+        running_instances.return_value = 2
+        self.asg_updater.timeout_in_seconds = 0
+        stalled = threading.Event()
+        self.addCleanup(stalled.set)
+        self.asg_conn.get_all_groups.side_effect = lambda *args, **kwargs: stalled.wait()
+
+        self.assertRaises(TimeoutException, self.asg_updater.wait_for_scale_out_complete)
+
+    @patch("aws_updater.asg.time.sleep")
+    def test_should_stop_waiting_when_cancelled(self, sleep):
+        self.asg_updater.cancel()
+
+        self.assertRaises(CancelledException, self.asg_updater.wait_for_scale_out_complete, 1)
+
+    @patch("aws_updater.asg.time.sleep")
+    def test_should_stop_waiting_when_stack_update_is_cancelled(self, sleep):
+        cancelled = threading.Event()
+        asg_updater = ASGUpdater(self.asg, self.asg_conn, self.ec2_conn, self.elb_conn, cancelled=cancelled,
+                                 elb_health_poller=ELBHealthPoller(self.elb_conn))
+        cancelled.set()
+
+        self.assertRaises(CancelledException, asg_updater.wait_for_scale_out_complete, 1)
+
+    @patch("aws_updater.asg.ASGUpdater.needs_update", return_value=True)
+    def test_should_leave_asg_alone_once_lease_is_lost(self, needs_update):
+        lease_lost = threading.Event()
+        asg_updater = ASGUpdater(self.asg, self.asg_conn, self.ec2_conn, self.elb_conn, lease_lost=lease_lost,
+                                 elb_health_poller=ELBHealthPoller(self.elb_conn))
+        self.asg.update.side_effect = lease_lost.set
+
+        self.assertRaises(LeaseLostException, asg_updater.update)
+
+        self.assertEqual(self.asg.update.call_count, 1)
+        self.assertFalse(self.asg_conn.terminate_instance.called)
+        self.assertFalse(self.asg_conn.get_all_groups.called)
+
+    def test_should_roll_back_instances_of_launch_config_scaled_out_with(self):
+        self.asg.launch_config_name = "new-lc"
+        self.asg_updater.scale_out()
+        self.asg.launch_config_name = "old-lc"
+        self.asg.instances = [Mock(instance_id="1", launch_config_name="new-lc"),
+                              Mock(instance_id="2", launch_config_name="old-lc")]
+
+        with patch("aws_updater.asg.ASGUpdater._terminate_instances") as terminate_instances:
+            self.asg_updater.rollback()
+            terminate_instances.assert_called_with(["1"])
@@ -0,0 +1,119 @@
+import sys
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from aws_updater.changeset import ChangeSetUpdate, ChangeSetFailedException, needs_rolling_update
+from aws_updater.replay import VirtualClock
+
+
+def resource_change(action, logical_id, resource_type, physical_id=None, replacement=None, changed_property=None):
+    change = {"Action": action, "LogicalResourceId": logical_id, "PhysicalResourceId": physical_id,
+              "ResourceType": resource_type}
+    if replacement:
+        change["Replacement"] = replacement
+    if changed_property:
+        change["Details"] = [{"Target": {"Attribute": "Properties", "Name": changed_property},
+                              "Evaluation": "Dynamic", "ChangeSource": "ResourceReference"}]
+    return {"Type": "Resource", "ResourceChange": change}
+
+
+LC_REPLACED = resource_change("Modify", "lc", "AWS::AutoScaling::LaunchConfiguration", "lc-1", "True", "ImageId")
+ASG_LC_CHANGED = resource_change("Modify", "asg", "AWS::AutoScaling::AutoScalingGroup", "any-asg", "False",
+                                 "LaunchConfigurationName")
+ASG_RESIZED = resource_change("Modify", "other", "AWS::AutoScaling::AutoScalingGroup", "other-asg", "False", "MaxSize")
+
+
+class ChangeSetUpdateTests(TestCase):
+
+    def setUp(self):
+        patch("sys.stdout", StringIO()).start()
+        self.cfn_conn = Mock()
+        self.descriptions = []
+        self.requests = []
+
+        def do_request(action, params, path, method):
+            self.requests.append((action, params))
+            if action == "CreateChangeSet":
+                return {"CreateChangeSetResponse": {"CreateChangeSetResult": {"Id": "any-change-set-id"}}}
+            if action == "DescribeChangeSet":
+                return {"DescribeChangeSetResponse": {"DescribeChangeSetResult": self.descriptions.pop(0)}}
+            return {"{0}Response".format(action): {}}
+
+        self.cfn_conn._do_request.side_effect = do_request
+        self.update = ChangeSetUpdate(self.cfn_conn, "any-stack", clock=VirtualClock(1000))
+
+    def tearDown(self):
+        patch.stopall()
+
+    def actions(self):
+        return [action for (action, params) in self.requests]
+
+    def test_should_create_describe_and_execute_change_set(self):
+        self.descriptions = [{"Status": "CREATE_IN_PROGRESS"},
+                             {"Status": "CREATE_COMPLETE", "Changes": [LC_REPLACED], "NextToken": "next"},
+                             {"Status": "CREATE_COMPLETE", "Changes": [ASG_LC_CHANGED, ASG_RESIZED]}]
+
+        self.assertTrue(self.update.run("{}", {"amiId": "ami-1"}))
+
+        self.assertEqual(self.actions(), ["CreateChangeSet", "DescribeChangeSet", "DescribeChangeSet",
+                                          "DescribeChangeSet", "ExecuteChangeSet"])
+        create_params = self.requests[0][1]
+        self.assertEqual(create_params["StackName"], "any-stack")
+        self.assertEqual(create_params["TemplateBody"], "{}")
+        self.assertEqual(create_params["Parameters.member.1.ParameterKey"], "amiId")
+        self.assertEqual(create_params["Parameters.member.1.ParameterValue"], "ami-1")
+        self.assertEqual(self.requests[3][1]["NextToken"], "next")
+        self.assertEqual(self.update.get_changed_launch_config_ids(), ["lc"])
+        self.assertEqual(self.update.get_asg_names_to_update(), ["any-asg"])
+
+    def test_should_delete_change_set_without_changes(self):
+        self.descriptions = [{"Status": "FAILED",
+                              "StatusReason": "The submitted information didn't contain changes."}]
+
+        self.assertFalse(self.update.run("{}", {}))
+
+        self.assertEqual(self.actions(), ["CreateChangeSet", "DescribeChangeSet", "DeleteChangeSet"])
+
+    def test_should_only_preview_when_asked_to(self):
+        self.update.preview_only = True
+        self.descriptions = [{"Status": "CREATE_COMPLETE", "Changes": [ASG_LC_CHANGED]}]
+
+        self.assertFalse(self.update.run("{}", {}))
+
+        self.assertEqual(self.actions(), ["CreateChangeSet", "DescribeChangeSet", "DeleteChangeSet"])
+
+    def test_should_preview_changed_launch_configs_and_asgs(self):
+        self.update.preview_only = True
+        self.descriptions = [{"Status": "CREATE_COMPLETE", "Changes": [LC_REPLACED, ASG_LC_CHANGED]}]
+
+        self.update.run("{}", {})
+
+        preview = sys.stdout.getvalue()
+        self.assertTrue("launch configurations changing: lc\n" in preview)
+        self.assertTrue("ASGs to update: any-asg\n" in preview)
+
+    def test_should_raise_and_delete_failed_change_set(self):
+        self.descriptions = [{"Status": "FAILED", "StatusReason": "Template error"}]
+
+        self.assertRaises(ChangeSetFailedException, self.update.run, "{}", {})
+
+        self.assertEqual(self.actions()[-1], "DeleteChangeSet")
+
+    def test_should_pass_template_url(self):
+        self.descriptions = [{"Status": "CREATE_COMPLETE", "Changes": [ASG_LC_CHANGED]}]
+
+        self.update.run(None, {}, "https://any-url")
+
+        self.assertEqual(self.requests[0][1]["TemplateURL"], "https://any-url")
+        self.assertFalse("TemplateBody" in self.requests[0][1])
+
+    def test_should_roll_only_asgs_whose_launch_config_changes_in_place(self):
+        self.assertTrue(needs_rolling_update(ASG_LC_CHANGED["ResourceChange"]))
+        self.assertFalse(needs_rolling_update(ASG_RESIZED["ResourceChange"]))
+        self.assertFalse(needs_rolling_update(LC_REPLACED["ResourceChange"]))
+        self.assertFalse(needs_rolling_update(resource_change("Add", "new", "AWS::AutoScaling::AutoScalingGroup")
+                                              ["ResourceChange"]))
+        self.assertTrue(needs_rolling_update(resource_change("Modify", "asg", "AWS::AutoScaling::AutoScalingGroup",
+                                                             "any-asg")["ResourceChange"]))
@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from unittest import TestCase
+
+from mock import patch
+
+from aws_updater.daemon import Daemon, run_in_daemon, get_credentials_fingerprint
+from aws_updater.utils import new_thread, with_thread_output
+
+
+def any_job(stack_name, region, connections=None, cancelled=None):
+    print "updating %s in %s with %s" % (stack_name, region, connections)
+    return 0
+
+
+def failing_job(stack_name, region, connections=None, cancelled=None):
+    raise Exception("bang!")
+
+
+def threaded_job(stack_name, region, connections=None, cancelled=None):
+    def roll_out():
+        print "rolling out %s" % stack_name
+    thread = new_thread(roll_out, "rollout")
+    thread.start()
+    thread.join()
+    return 0
+
+
+def pooled_job(stack_name, region, connections=None, cancelled=None):
+    def deregister(elb_name):
+        print "deregistering from %s" % elb_name
+    pool = ThreadPool(1)
+    try:
+        pool.map(with_thread_output(deregister), ["any-elb"])
+    finally:
+        pool.close()
+        pool.join()
+    redirected = []
+    foreign = threading.Thread(target=lambda: redirected.append(sys.stdout.target() is not None))
+    foreign.start()
+    foreign.join()
+    print "foreign thread redirected: %s" % redirected[0]
+    return 0
+
+
+job_cancelled = threading.Event()
+
+
+def cancellable_job(stack_name, region, connections=None, cancelled=None):
+    if cancelled.wait(5) or cancelled.is_set():
+        job_cancelled.set()
+    return 1
+
+
+class DaemonTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "daemon.sock")
+        patch("aws_updater.jobs.JOBS", {"any-job": any_job, "failing-job": failing_job, "threaded-job": threaded_job,
+                                        "pooled-job": pooled_job, "cancellable-job": cancellable_job}).start()
+        self.get_connections = patch("aws_updater.daemon.Daemon.get_connections",
+                                     return_value="warm-connections").start()
+        patch("aws_updater.daemon.logging").start()
+        self.daemon = Daemon(self.socket_path)
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join(5)
+        patch.stopall()
+        shutil.rmtree(self.directory)
+
+    def test_should_run_job_in_daemon_and_stream_output(self):
+        output = StringIO()
+
+        exit_code = run_in_daemon("any-job", {"stack_name": "any-stack", "region": "any-region"},
+                                  self.socket_path, output)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output.getvalue(), "updating any-stack in any-region with warm-connections\n")
+        self.get_connections.assert_called_with("any-region")
+
+    def test_should_report_failing_job(self):
+        output = StringIO()
+
+        exit_code = run_in_daemon("failing-job", {"stack_name": "any-stack", "region": "any-region"},
+                                  self.socket_path, output)
+
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(output.getvalue(), "[ERROR] bang!\n")
+
+    def test_should_stream_output_of_threads_started_by_job(self):
+        output = StringIO()
+
+        exit_code = run_in_daemon("threaded-job", {"stack_name": "any-stack", "region": "any-region"},
+                                  self.socket_path, output)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output.getvalue(), "rolling out any-stack\n")
+
+    def test_should_stream_output_of_pooled_calls_but_not_of_other_threads(self):
+        output = StringIO()
+
+        exit_code = run_in_daemon("pooled-job", {"stack_name": "any-stack", "region": "any-region"},
+                                  self.socket_path, output)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output.getvalue(), "deregistering from any-elb\nforeign thread redirected: False\n")
+
+    def test_should_cancel_job_when_client_goes_away(self):
+        job_cancelled.clear()
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.socket_path)
+        client.sendall(json.dumps({"job": "cancellable-job", "credentials": get_credentials_fingerprint(),
+                                   "arguments": {"stack_name": "any-stack", "region": "any-region"}}) + "\n")
+        client.close()
+
+        job_cancelled.wait(5)
+        self.assertTrue(job_cancelled.is_set())
+
+    def test_should_decline_job_of_client_with_other_credentials(self):
+        with patch.dict("os.environ", {"AWS_ACCESS_KEY_ID": "other-key"}):
+            exit_code = run_in_daemon("any-job", {"stack_name": "any-stack", "region": "any-region"},
+                                      self.socket_path, StringIO())
+
+        self.assertEqual(exit_code, None)
+        self.assertFalse(self.get_connections.called)
+
+    def test_should_refuse_to_start_second_daemon_on_same_socket(self):
+        self.assertRaises(Exception, Daemon(self.socket_path).serve_forever)
+
+
+class RunInDaemonTests(TestCase):
+
+    def test_should_not_run_job_without_daemon(self):
+        self.assertEqual(run_in_daemon("any-job", {}, "/does/not/exist.sock"), None)
+
+    def test_should_not_run_job_when_daemon_is_disabled(self):
+        self.assertEqual(run_in_daemon("any-job", {}, ""), None)
@@ -0,0 +1,149 @@
+import threading
+import time
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from aws_updater import wait_for_end_event
+from aws_updater.deadline import DeadlineCaller, DeadlineExceededException, LatencyTracker
+from aws_updater.replay import VirtualClock
+from aws_updater.throttling import RateLimiter
+
+
+class LatencyTrackerTests(TestCase):
+
+    def test_should_return_percentile_of_recent_latencies(self):
+        tracker = LatencyTracker(window=10)
+        for latency in range(100):
+            tracker.record("any-operation", latency)
+
+        self.assertEqual(tracker.percentile("any-operation", 50), 95)
+        self.assertEqual(tracker.percentile("any-operation", 100), 99)
+
+    def test_should_return_none_without_enough_samples(self):
+        tracker = LatencyTracker()
+        tracker.record("any-operation", 1)
+
+        self.assertEqual(tracker.percentile("any-operation", 95, min_samples=2), None)
+        self.assertEqual(tracker.percentile("other-operation", 95), None)
+
+
+class DeadlineCallerTests(TestCase):
+
+    def setUp(self):
+        patch("aws_updater.deadline.MIN_CALL_TIMEOUT_IN_SECONDS", 0.05).start()
+        patch("aws_updater.deadline.MIN_HEDGE_DELAY_IN_SECONDS", 0.05).start()
+        self.tracker = LatencyTracker()
+        self.clock = VirtualClock(1000)
+        self.caller = DeadlineCaller(self.clock, latency_tracker=self.tracker)
+        self.stalled = threading.Event()
+        self.addCleanup(self.stalled.set)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def stall(self, *args, **kwargs):
+        self.stalled.wait()
+        return "late"
+
+    def in_seconds(self, seconds):
+        return self.clock.time() + seconds
+
+    def test_should_call_directly_without_deadline(self):
+        result = self.caller.call("any-operation", None, lambda: threading.current_thread())
+
+        self.assertEqual(result, threading.current_thread())
+
+    def test_should_return_result_and_record_latency(self):
+        function = Mock(return_value="any-result")
+
+        self.assertEqual(self.caller.call("any-operation", self.in_seconds(1), function, "any-arg", key="any-value"), "any-result")
+        function.assert_called_with("any-arg", key="any-value")
+        self.assertNotEqual(self.tracker.percentile("any-operation", 95), None)
+
+    def test_should_raise_when_call_does_not_return_before_deadline(self):
+        self.assertRaises(DeadlineExceededException, self.caller.call, "any-operation", self.in_seconds(0.01), self.stall)
+
+    def test_should_raise_exception_of_call(self):
+        self.assertRaises(KeyError, self.caller.call, "any-operation", self.in_seconds(1), {}.__getitem__, "missing")
+
+    def test_should_hedge_call_slower_than_percentile(self):
+        for _ in range(20):
+            self.tracker.record("describe", 0.001)
+        answers = iter([self.stall, lambda: "hedged"])
+
+        self.assertEqual(self.caller.hedged_call("describe", self.in_seconds(1), lambda: next(answers)()), "hedged")
+
+    def test_should_not_hedge_while_service_is_throttled(self):
+        for _ in range(20):
+            self.tracker.record("autoscaling.describe", 0.001)
+        rate_limiter = Mock(RateLimiter)
+        rate_limiter.is_saturated.return_value = True
+        caller = DeadlineCaller(self.clock, latency_tracker=self.tracker, rate_limiter=rate_limiter)
+        function = Mock(side_effect=self.stall)
+
+        self.assertRaises(DeadlineExceededException, caller.hedged_call, "autoscaling.describe", self.in_seconds(0.2),
+                          function)
+        self.assertEqual(function.call_count, 1)
+        rate_limiter.is_saturated.assert_called_with("autoscaling")
+
+    def test_should_reuse_threads_between_calls(self):
+        threads = set()
+        for _ in range(10):
+            threads.add(self.caller.call("any-operation", self.in_seconds(1), threading.current_thread))
+
+        # a worker is idle again shortly after handing over its result
+        self.assertTrue(len(threads) < 5)
+        self.assertFalse(threading.current_thread() in threads)
+
+    def test_should_not_hedge_without_enough_latencies(self):
+        self.tracker.record("describe", 0.001)
+        function = Mock(side_effect=self.stall)
+
+        self.assertRaises(DeadlineExceededException, self.caller.hedged_call, "describe", self.in_seconds(0.2), function)
+        self.assertEqual(function.call_count, 1)
+
+    def test_should_raise_only_when_all_hedged_attempts_failed(self):
+        for _ in range(20):
+            self.tracker.record("describe", 0.001)
+        hedged_failed = threading.Event()
+
+        def first():
+            hedged_failed.wait()
+            # let the failure of the hedged attempt arrive first
+            time.sleep(0.1)
+            raise ValueError("first")
+
+        def hedged():
+            hedged_failed.set()
+            raise KeyError("hedged")
+        answers = iter([first, hedged])
+
+        self.assertRaises(ValueError, self.caller.hedged_call, "describe", self.in_seconds(1), lambda: next(answers)())
+
+
+class WaitLoopDeadlineTests(TestCase):
+
+    def setUp(self):
+        patch("sys.stdout", StringIO()).start()
+        patch("aws_updater.deadline.MIN_CALL_TIMEOUT_IN_SECONDS", 0.05).start()
+        self.stalled = threading.Event()
+        self.addCleanup(self.stalled.set)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_should_give_up_waiting_for_end_event_when_describe_stalls(self):
+        stack = Mock(stack_name="any-stack")
+        stack.describe_events.side_effect = lambda: self.stalled.wait()
+
+        self.assertEqual(wait_for_end_event(Mock(), stack, 0, 0.01, VirtualClock(1000)), (stack, None))
+
+    def test_should_share_deadline_between_consecutive_calls(self):
+        clock = VirtualClock(1000)
+        caller = DeadlineCaller(clock)
+
+        caller.call("any-operation", 1010, clock.sleep, 10)
+
+        self.assertRaises(DeadlineExceededException, caller.call, "any-operation", 1010, self.stalled.wait)
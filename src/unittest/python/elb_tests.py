@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+from boto.ec2.elb import ELBConnection
+
+from aws_updater.elb import ELBHealthPoller
+
+
+class ELBHealthPollerTests(TestCase):
+
+    def setUp(self):
+        self.elb_conn = Mock(ELBConnection)
+        self.elb_conn.describe_instance_health.return_value = [Mock(instance_id="i-1", state="InService")]
+        self.time = patch("aws_updater.elb.time.time", return_value=0).start()
+        self.poller = ELBHealthPoller(self.elb_conn, interval_in_seconds=1)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_should_fetch_health_once_per_interval_for_all_subscribers(self):
+        self.poller.subscribe("any-elb", "updater-1")
+        self.poller.subscribe("any-elb", "updater-2")
+
+        self.assertEqual(self.poller.get_instance_health("any-elb"), [("i-1", "InService")])
+        self.assertEqual(self.poller.get_instance_health("any-elb"), [("i-1", "InService")])
+        self.assertEqual(self.elb_conn.describe_instance_health.call_count, 1)
+
+        self.time.return_value = 1
+        self.poller.get_instance_health("any-elb")
+        self.assertEqual(self.elb_conn.describe_instance_health.call_count, 2)
+
+    def test_should_keep_polling_while_any_subscriber_is_left(self):
+        self.poller.subscribe("any-elb", "updater-1")
+        self.poller.subscribe("any-elb", "updater-2")
+        self.poller.get_instance_health("any-elb")
+
+        self.poller.unsubscribe("any-elb", "updater-1")
+        self.poller.get_instance_health("any-elb")
+
+        self.assertEqual(self.elb_conn.describe_instance_health.call_count, 1)
+
+    def test_should_stop_caching_health_without_subscribers(self):
+        self.poller.subscribe("any-elb", "updater-1")
+        self.poller.get_instance_health("any-elb")
+
+        self.poller.unsubscribe("any-elb", "updater-1")
+        self.poller.get_instance_health("any-elb")
+
+        self.assertEqual(self.elb_conn.describe_instance_health.call_count, 2)
+        self.assertEqual(self.poller._health, {})
@@ -0,0 +1,71 @@
+import threading
+from unittest import TestCase
+
+from aws_updater.events import Event, EventBus, BLOCK, SCALE_OUT_COMPLETED
+
+
+class EventTests(TestCase):
+
+    def test_should_compare_equal_to_its_type(self):
+        event = Event(SCALE_OUT_COMPLETED, asg_name="any-asg")
+
+        self.assertEqual(event, SCALE_OUT_COMPLETED)
+        self.assertEqual(event.type, SCALE_OUT_COMPLETED)
+        self.assertEqual(event.asg_name, "any-asg")
+        self.assertRaises(AttributeError, getattr, event, "unknown")
+
+
+class EventBusTests(TestCase):
+
+    def test_should_deliver_events_on_worker_thread(self):
+        delivered = []
+        bus = EventBus()
+        bus.subscribe(lambda event: delivered.append((event, threading.current_thread().name)))
+
+        bus.publish("ANY_EVENT", detail=1)
+        bus.publish("ANY_OTHER_EVENT")
+
+        self.assertTrue(bus.flush(timeout_in_seconds=5))
+        self.assertEqual(delivered, [("ANY_EVENT", "event-bus"), ("ANY_OTHER_EVENT", "event-bus")])
+
+    def test_should_not_block_publisher_on_slow_observer(self):
+        release = threading.Event()
+        bus = EventBus(max_queue_size=1)
+        bus.subscribe(lambda event: release.wait(5))
+
+        for _ in range(5):
+            bus.publish("ANY_EVENT")
+
+        self.assertTrue(bus.nr_of_dropped_events >= 3)
+        release.set()
+        self.assertTrue(bus.flush(timeout_in_seconds=5))
+
+    def test_should_time_out_flushing_on_slow_observer(self):
+        release = threading.Event()
+        bus = EventBus(overflow_policy=BLOCK)
+        bus.subscribe(lambda event: release.wait(5))
+
+        bus.publish("ANY_EVENT")
+
+        self.assertFalse(bus.flush(timeout_in_seconds=0.01))
+        release.set()
+        self.assertTrue(bus.flush(timeout_in_seconds=5))
+
+    def test_should_keep_delivering_after_failing_observer(self):
+        delivered = []
+        bus = EventBus()
+        bus.subscribe(lambda event: 1 / 0)
+        bus.subscribe(delivered.append)
+
+        bus.publish("ANY_EVENT")
+        bus.publish("ANY_OTHER_EVENT")
+        bus.flush(timeout_in_seconds=5)
+
+        self.assertEqual(delivered, ["ANY_EVENT", "ANY_OTHER_EVENT"])
+
+    def test_should_not_start_worker_without_subscribers(self):
+        bus = EventBus()
+
+        bus.publish("ANY_EVENT")
+
+        self.assertEqual(bus._worker, None)
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import threading
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import patch
+
+from aws_updater.locking import (Lease, LeaseTimeoutException, SqliteLeaseStore, FileLeaseStore, create_lease_store,
+                                 register_lease_store)
+from aws_updater.replay import VirtualClock
+
+
+class LeaseTests(object):
+
+    def setUp(self):
+        patch("sys.stdout", StringIO()).start()
+        self.directory = tempfile.mkdtemp()
+        self.store = self.create_store(os.path.join(self.directory, "leases"))
+        self.clock = VirtualClock(1000)
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.directory)
+
+    def lease(self, owner, key="stack/eu-west-1/any-stack"):
+        return Lease(self.store, key, owner, ttl_in_seconds=60, clock=self.clock)
+
+    def try_acquire(self, lease):
+        return lease._modify(lease._try_acquire)[0]
+
+    def test_should_acquire_and_release(self):
+        lease = self.lease("a")
+
+        with lease:
+            self.assertEqual(self.store.load(lease.key)[0]["holder"], "a")
+        self.assertEqual(self.store.load(lease.key)[0]["holder"], None)
+
+    def test_should_time_out_while_held_and_leave_queue(self):
+        with self.lease("a"):
+            self.assertRaises(LeaseTimeoutException, self.lease("b").acquire, 10)
+
+            self.assertEqual(self.clock.time(), 1010)
+            self.assertEqual(self.store.load("stack/eu-west-1/any-stack")[0]["queue"], [])
+
+    def test_should_grant_lease_in_order_of_arrival(self):
+        a, b, c = self.lease("a"), self.lease("b"), self.lease("c")
+        self.assertTrue(self.try_acquire(a))
+        self.assertFalse(self.try_acquire(b))
+        self.assertFalse(self.try_acquire(c))
+
+        a.release()
+
+        self.assertFalse(self.try_acquire(c))
+        self.assertTrue(self.try_acquire(b))
+
+    def test_should_expire_holder_and_waiters_that_stopped_renewing(self):
+        a, b, c = self.lease("a"), self.lease("b"), self.lease("c")
+        self.try_acquire(a)
+        self.try_acquire(b)
+        self.clock.sleep(30)
+        self.try_acquire(c)
+
+        self.clock.sleep(40)
+
+        self.assertTrue(self.try_acquire(c))
+
+    def test_should_renew_only_own_lease(self):
+        a, b = self.lease("a"), self.lease("b")
+        self.try_acquire(a)
+        self.clock.sleep(61)
+        self.try_acquire(b)
+
+        self.assertFalse(a.renew())
+        self.assertTrue(b.renew())
+
+    def test_should_keep_leases_per_key(self):
+        with self.lease("a", "asg/eu-west-1/any-asg"):
+            with self.lease("b", "asg/eu-west-1/other-asg"):
+                pass
+
+    def heartbeating_lease(self, owner, on_lost):
+        # renews every 10 milliseconds, the virtual clock only moves on explicitly
+        return Lease(self.store, "stack/eu-west-1/any-stack", owner, ttl_in_seconds=0.03, clock=self.clock,
+                     on_lost=on_lost)
+
+    def test_should_report_lost_lease_when_renewal_is_refused(self):
+        lost = threading.Event()
+        lease = self.heartbeating_lease("a", lost.set)
+        lease.acquire()
+        self.clock.sleep(1)
+        self.try_acquire(self.lease("b"))
+
+        lost.wait(5)
+
+        self.assertTrue(lost.is_set())
+        self.assertTrue(lease.lost)
+        lease.release()
+
+    def test_should_report_lost_lease_when_store_fails_until_it_expired(self):
+        lost = threading.Event()
+        lease = self.heartbeating_lease("a", lost.set)
+        lease.acquire()
+
+        with patch.object(self.store, "load", side_effect=IOError("store unreachable")):
+            self.clock.sleep(1)
+            lost.wait(5)
+
+        self.assertTrue(lost.is_set())
+        lease.release()
+
+    def test_should_stop_heartbeat_when_event_wait_returns_none(self):
+        original_wait = threading._Event.wait
+
+        def wait_as_before_python_2_7(event, timeout=None):
+            original_wait(event, timeout)
+
+        with patch.object(threading._Event, "wait", wait_as_before_python_2_7):
+            lease = self.lease("a")
+            lease.acquire()
+            releasing = threading.Thread(target=lease.release)
+            releasing.daemon = True
+            releasing.start()
+            releasing.join(5)
+
+        self.assertFalse(releasing.is_alive())
+
+
+class SqliteLeaseTests(LeaseTests, TestCase):
+
+    def create_store(self, filename):
+        return SqliteLeaseStore(filename)
+
+
+class FileLeaseTests(LeaseTests, TestCase):
+
+    def create_store(self, filename):
+        return FileLeaseStore(filename)
+
+
+class LeaseStoreTests(TestCase):
+
+    def test_should_create_lease_stores_from_url(self):
+        self.assertTrue(isinstance(create_lease_store("sqlite:/tmp/leases.sqlite"), SqliteLeaseStore))
+        self.assertTrue(isinstance(create_lease_store("file:/tmp/leases.json"), FileLeaseStore))
+        self.assertEqual(create_lease_store(""), None)
+        self.assertEqual(create_lease_store("none"), None)
+        self.assertRaises(ValueError, create_lease_store, "dynamodb:leases")
+
+    def test_should_create_registered_lease_store(self):
+        register_lease_store("remote", lambda location: ("remote", location))
+
+        self.assertEqual(create_lease_store("remote:any-table"), ("remote", "any-table"))
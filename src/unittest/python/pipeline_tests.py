@@ -0,0 +1,123 @@
+import threading
+from StringIO import StringIO
+from datetime import datetime
+from unittest import TestCase
+
+from mock import Mock, MagicMock, patch
+from boto.exception import BotoServerError
+
+from aws_updater.asg import RolledBackException
+from aws_updater.pipeline import PipelinedRollout
+from aws_updater.replay import VirtualClock
+
+STARTED_AT = 1000000
+
+
+def event(event_id, at, resource_type, logical_resource_id, status, physical_resource_id=None):
+    return Mock(event_id=event_id, timestamp=datetime.utcfromtimestamp(STARTED_AT + at),
+                resource_type=resource_type, logical_resource_id=logical_resource_id,
+                physical_resource_id=physical_resource_id, resource_status=status, resource_status_reason=None)
+
+
+START = event(1, 0, "AWS::CloudFormation::Stack", "any-stack", "UPDATE_IN_PROGRESS")
+ASG_COMPLETE = event(2, 10, "AWS::AutoScaling::AutoScalingGroup", "asg", "UPDATE_COMPLETE", "any-asg")
+STACK_COMPLETE = event(3, 100, "AWS::CloudFormation::Stack", "any-stack", "UPDATE_COMPLETE")
+STACK_ROLLING_BACK = event(3, 100, "AWS::CloudFormation::Stack", "any-stack", "UPDATE_ROLLBACK_IN_PROGRESS")
+STACK_ROLLED_BACK = event(4, 120, "AWS::CloudFormation::Stack", "any-stack", "UPDATE_ROLLBACK_COMPLETE")
+
+
+class PipelinedRolloutTests(TestCase):
+
+    def setUp(self):
+        patch("aws_updater.pipeline.dump_event").start()
+        patch("sys.stdout", StringIO()).start()
+        self.clock = VirtualClock(STARTED_AT)
+        self.stack_updater = MagicMock(clock=self.clock, stack_name="any-stack", changed_asg_names=None)
+        self.asg_updater = Mock()
+        self.stack_updater.create_asg_updater.return_value = self.asg_updater
+        self.stack_updater.as_conn.get_all_groups.return_value = [Mock()]
+        self.stack = Mock(stack_name="any-stack")
+        patch("aws_updater.pipeline.wait_for_start_event", return_value=(self.stack, START)).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def stack_events(self, *timeline):
+        def describe_events():
+            now = self.clock.time() - STARTED_AT
+            return [e for e in reversed(timeline) if (e.timestamp - datetime.utcfromtimestamp(STARTED_AT)).seconds <= now]
+        self.stack.describe_events.side_effect = describe_events
+
+    def test_should_start_asg_rollout_before_stack_update_completes(self):
+        self.stack_events(START, ASG_COMPLETE, STACK_COMPLETE)
+        rollout_started_at = []
+
+        def create_asg_updater(asg):
+            rollout_started_at.append(self.clock.time() - STARTED_AT)
+            return self.asg_updater
+        self.stack_updater.create_asg_updater.side_effect = create_asg_updater
+
+        result = PipelinedRollout(self.stack_updater).run(25, 5, 300)
+
+        self.assertEqual(result, 0)
+        self.assertTrue(10 <= rollout_started_at[0] < 100)
+        self.asg_updater.update.assert_called_with()
+        self.stack_updater.as_conn.get_all_groups.assert_called_with(names=["any-asg"])
+        self.stack_updater.update_asgs.assert_called_with(asg_names_to_skip=["any-asg"], asg_names=None)
+
+    def test_should_cancel_rollouts_when_stack_rolls_back(self):
+        self.stack_events(START, ASG_COMPLETE, STACK_ROLLING_BACK, STACK_ROLLED_BACK)
+        cancelled = threading.Event()
+        self.asg_updater.cancel.side_effect = cancelled.set
+
+        def update():
+            cancelled.wait(5)
+            raise RolledBackException("cancelled")
+        self.asg_updater.update.side_effect = update
+
+        result = PipelinedRollout(self.stack_updater).run(25, 5, 300)
+
+        self.assertEqual(result, 1)
+        self.assertTrue(cancelled.is_set())
+        self.assertFalse(self.stack_updater.update_asgs.called)
+
+    def test_should_cancel_and_join_rollouts_when_watching_events_fails(self):
+        describe_events_calls = []
+
+        def describe_events():
+            describe_events_calls.append(self.clock.time())
+            if len(describe_events_calls) > 20:
+                raise BotoServerError(500, "Internal Failure")
+            return [ASG_COMPLETE, START]
+        self.stack.describe_events.side_effect = describe_events
+        cancelled = threading.Event()
+        self.asg_updater.cancel.side_effect = cancelled.set
+        rolled_back = []
+
+        def update():
+            cancelled.wait(5)
+            rolled_back.append(cancelled.is_set())
+        self.asg_updater.update.side_effect = update
+
+        self.assertRaises(BotoServerError, PipelinedRollout(self.stack_updater).run, 25, 5, 300)
+
+        self.assertEqual(rolled_back, [True])
+
+    def test_should_raise_failed_rollout_after_successful_stack_update(self):
+        self.stack_events(START, ASG_COMPLETE, STACK_COMPLETE)
+        self.asg_updater.update.side_effect = RolledBackException("unhealthy")
+
+        self.assertRaises(RolledBackException, PipelinedRollout(self.stack_updater).run, 25, 5, 300)
+
+    def test_should_return_timeout_code_without_end_event(self):
+        self.stack_events(START)
+
+        self.assertEqual(PipelinedRollout(self.stack_updater).run(25, 5, 300), 3)
+
+    def test_should_return_timeout_code_when_describing_events_stalls(self):
+        patch("aws_updater.deadline.MIN_CALL_TIMEOUT_IN_SECONDS", 0.05).start()
+        stalled = threading.Event()
+        self.addCleanup(stalled.set)
+        self.stack.describe_events.side_effect = lambda: stalled.wait()
+
+        self.assertEqual(PipelinedRollout(self.stack_updater).run(25, 5, 0.01), 3)
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock
+
+from aws_updater.preprocessing import TemplatePreprocessor, resolve_location
+from aws_updater.template import TemplateValidationException
+
+
+class TemplatePreprocessorTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.load = Mock(side_effect=self._read)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _read(self, location):
+        if location.startswith("s3://"):
+            return '{"Type": "AWS::SNS::Topic"}'
+        with open(location) as template_file:
+            return template_file.read()
+
+    def _write(self, name, content):
+        file_name = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, "w") as template_file:
+            template_file.write(content)
+        return file_name
+
+    def test_should_resolve_includes_and_minify(self):
+        template = self._write("template.json", '{\n  "Resources": {"sg": {"Fn::Include": "fragments/sg.json"},\n'
+                                                '                "topic": {"Fn::Include": "s3://bucket/topic.json"}}\n}')
+        self._write("fragments/sg.json", '{"Type": "AWS::EC2::SecurityGroup", "Properties": {"Fn::Include": "props.json"}}')
+        self._write("fragments/props.json", '{"GroupDescription": "any"}')
+
+        processed = TemplatePreprocessor(self.load, self.cache_dir).process(template)
+
+        self.assertEqual(processed, '{"Resources":{"sg":{"Properties":{"GroupDescription":"any"},'
+                                    '"Type":"AWS::EC2::SecurityGroup"},"topic":{"Type":"AWS::SNS::Topic"}}}')
+
+    def test_should_use_cache_until_an_included_file_changes(self):
+        template = self._write("template.json", '{"Resources": {"sg": {"Fn::Include": "sg.json"}}}')
+        self._write("sg.json", '{"Type": "AWS::EC2::SecurityGroup"}')
+        TemplatePreprocessor(self.load, self.cache_dir).process(template)
+
+        preprocessor = TemplatePreprocessor(self.load, self.cache_dir)
+        preprocessor._resolve = Mock(side_effect=AssertionError("processed again"))
+        self.assertEqual(preprocessor.process(template), '{"Resources":{"sg":{"Type":"AWS::EC2::SecurityGroup"}}}')
+
+        self._write("sg.json", '{"Type": "AWS::SNS::Topic"}')
+        preprocessor = TemplatePreprocessor(self.load, self.cache_dir)
+        self.assertEqual(preprocessor.process(template), '{"Resources":{"sg":{"Type":"AWS::SNS::Topic"}}}')
+
+    def test_should_work_without_cache(self):
+        template = self._write("template.json", '{"Resources": {}}')
+
+        self.assertEqual(TemplatePreprocessor(self.load, "").process(template), '{"Resources":{}}')
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_should_error_on_include_cycle(self):
+        template = self._write("template.json", '{"Resources": {"Fn::Include": "a.json"}}')
+        self._write("a.json", '{"Fn::Include": "template.json"}')
+
+        self.assertRaisesRegexp(TemplateValidationException, "Include cycle",
+                                TemplatePreprocessor(self.load, self.cache_dir).process, template)
+
+    def test_should_error_on_missing_include(self):
+        template = self._write("template.json", '{"Resources": {"Fn::Include": "missing.json"}}')
+
+        self.assertRaisesRegexp(TemplateValidationException, "Unable to include",
+                                TemplatePreprocessor(self.load, self.cache_dir).process, template)
+
+    def test_should_resolve_locations_relative_to_including_template(self):
+        self.assertEqual(resolve_location("../b.json", "/dir/sub/a.json"), "/dir/b.json")
+        self.assertEqual(resolve_location("b.json", "s3://bucket/dir/a.json"), "s3://bucket/dir/b.json")
+        self.assertEqual(resolve_location("s3://other/b.json", "/dir/a.json"), "s3://other/b.json")
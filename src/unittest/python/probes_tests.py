@@ -0,0 +1,99 @@
+import socket
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+
+from aws_updater.probes import HttpProbe, TcpProbe, ReadinessProber, parse_probe
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        status = 200 if self.path == "/health" else 503
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write("ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def unused_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class ProbeTests(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.requests = []
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_http_probe_should_succeed_on_healthy_path(self):
+        self.assertTrue(HttpProbe(self.port, "/health")("127.0.0.1"))
+
+    def test_http_probe_should_fail_on_error_status(self):
+        self.assertFalse(HttpProbe(self.port, "/unhealthy")("127.0.0.1"))
+
+    def test_http_probe_should_fail_without_server(self):
+        self.assertFalse(HttpProbe(unused_port(), "/health")("127.0.0.1"))
+
+    def test_http_probe_should_reuse_connection(self):
+        probe = HttpProbe(self.port, "/health")
+
+        probe("127.0.0.1")
+        connection = probe._idle_connections["127.0.0.1"]
+        probe("127.0.0.1")
+
+        self.assertTrue(probe._idle_connections["127.0.0.1"] is connection)
+        self.assertEqual(self.server.requests, ["/health", "/health"])
+
+    def test_prober_should_close_connections_kept_by_probe(self):
+        probe = HttpProbe(self.port, "/health")
+        prober = ReadinessProber(probe)
+        prober.check(["127.0.0.1"])
+        connection = probe._idle_connections["127.0.0.1"]
+
+        prober.close()
+
+        self.assertEqual(probe._idle_connections, {})
+        self.assertEqual(connection.sock, None)
+
+    def test_tcp_probe(self):
+        self.assertTrue(TcpProbe(self.port)("127.0.0.1"))
+        self.assertFalse(TcpProbe(unused_port())("127.0.0.1"))
+
+    def test_prober_should_return_ready_ips(self):
+        prober = ReadinessProber(lambda ip: ip.endswith("1"), max_concurrent_probes=2)
+        self.addCleanup(prober.close)
+
+        self.assertEqual(prober.check(["10.0.0.1", "10.0.0.2", "10.0.0.11"]), set(["10.0.0.1", "10.0.0.11"]))
+
+    def test_prober_should_treat_failing_probe_as_not_ready(self):
+        def probe(ip):
+            raise Exception("bang!")
+
+        prober = ReadinessProber(probe)
+        self.addCleanup(prober.close)
+
+        self.assertEqual(prober.check(["10.0.0.1"]), set())
+
+    def test_should_parse_probes(self):
+        self.assertEqual(repr(parse_probe("http:8080/health")), "http:8080/health")
+        self.assertEqual(repr(parse_probe("http:8080")), "http:8080/")
+        self.assertEqual(repr(parse_probe("tcp:22")), "tcp:22")
+        self.assertRaises(ValueError, parse_probe, "udp:53")
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from mock import Mock, patch
+from boto.ec2 import EC2Connection
+from boto.ec2.autoscale import AutoScaleConnection
+from boto.ec2.elb import ELBConnection
+
+from aws_updater.asg import ASGUpdater, TimeoutException
+from aws_updater.elb import ELBHealthPoller
+from aws_updater.replay import Recorder, Replayer, VirtualClock, ReplayMismatchException
+
+GROUPS = """<DescribeAutoScalingGroupsResponse><DescribeAutoScalingGroupsResult><AutoScalingGroups><member>
+<AutoScalingGroupName>any-asg</AutoScalingGroupName><LaunchConfigurationName>new-lc</LaunchConfigurationName>
+<LoadBalancerNames><member>any-elb</member></LoadBalancerNames>
+<Instances><member><InstanceId>i-1</InstanceId><LaunchConfigurationName>new-lc</LaunchConfigurationName>
+<LifecycleState>InService</LifecycleState></member></Instances>
+</member></AutoScalingGroups></DescribeAutoScalingGroupsResult></DescribeAutoScalingGroupsResponse>"""
+
+AUTOSCALING_INSTANCES = """<DescribeAutoScalingInstancesResponse><DescribeAutoScalingInstancesResult>
+<AutoScalingInstances><member><InstanceId>i-1</InstanceId><LaunchConfigurationName>new-lc</LaunchConfigurationName>
+</member></AutoScalingInstances></DescribeAutoScalingInstancesResult></DescribeAutoScalingInstancesResponse>"""
+
+EC2_INSTANCES = """<DescribeInstancesResponse><reservationSet><item><instancesSet><item>
+<instanceId>i-1</instanceId><imageId>ami-new</imageId></item></instancesSet></item></reservationSet>
+</DescribeInstancesResponse>"""
+
+INSTANCE_HEALTH = """<DescribeInstanceHealthResponse><DescribeInstanceHealthResult><InstanceStates><member>
+<InstanceId>i-1</InstanceId><State>%s</State></member></InstanceStates></DescribeInstanceHealthResult>
+</DescribeInstanceHealthResponse>"""
+
+
+def recorded(service, action, at, body):
+    return {"service": service, "action": action, "params": {}, "at": at, "status": 200, "reason": "OK",
+            "body": body}
+
+
+RECORDING = {"started_at": 1000000, "responses": [
+    recorded("autoscaling", "DescribeAutoScalingGroups", 0, GROUPS),
+    recorded("autoscaling", "DescribeAutoScalingInstances", 0, AUTOSCALING_INSTANCES),
+    recorded("ec2", "DescribeInstances", 0, EC2_INSTANCES),
+    recorded("elb", "DescribeInstanceHealth", 0, INSTANCE_HEALTH % "OutOfService"),
+    recorded("elb", "DescribeInstanceHealth", 600, INSTANCE_HEALTH % "InService")]}
+
+
+class ReplayTests(TestCase):
+
+    def setUp(self):
+        patch("aws_updater.asg.print", create=True).start()
+        self.replayer = Replayer(RECORDING)
+        credentials = {"aws_access_key_id": "replay", "aws_secret_access_key": "replay"}
+        self.as_conn = self.replayer.attach(AutoScaleConnection(**credentials), "autoscaling")
+        self.ec2_conn = self.replayer.attach(EC2Connection(**credentials), "ec2")
+        self.elb_conn = self.replayer.attach(ELBConnection(**credentials), "elb")
+
+    def tearDown(self):
+        patch.stopall()
+
+    def updater(self, timeout_in_seconds):
+        asg = self.as_conn.get_all_groups(names=["any-asg"])[0]
+        return ASGUpdater(asg, self.as_conn, self.ec2_conn, self.elb_conn, timeout_in_seconds=timeout_in_seconds,
+                          elb_health_poller=ELBHealthPoller(self.elb_conn, clock=self.replayer.clock),
+                          clock=self.replayer.clock)
+
+    def test_should_replay_rollout_on_virtual_clock(self):
+        started = time.time()
+
+        self.updater(timeout_in_seconds=900).wait_for_scale_out_complete(needed_nr_of_uptodate_instances=1)
+
+        self.assertEqual(self.replayer.clock.time() - RECORDING["started_at"], 600)
+        self.assertTrue(time.time() - started < 5)
+
+    def test_should_replay_timeout(self):
+        self.assertRaises(TimeoutException, self.updater(timeout_in_seconds=300).wait_for_scale_out_complete, 1)
+
+    def test_should_error_on_request_not_recorded(self):
+        self.assertRaises(ReplayMismatchException, self.replayer.respond, "ec2", "TerminateInstances", {})
+
+
+class RecorderTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_replay_recorded_responses(self):
+        clock = VirtualClock(500)
+        conn = Mock(make_request=Mock(side_effect=[Mock(status=200, reason="OK", read=Mock(return_value="first")),
+                                                   Mock(status=200, reason="OK", read=Mock(return_value="second"))]))
+        recorder = Recorder(clock)
+        recorder.attach(conn, "ec2")
+        conn.make_request("DescribeInstances", {"InstanceId.1": "i-1"})
+        clock.sleep(10)
+        conn.make_request("DescribeInstances", {"InstanceId.1": "i-1"})
+        filename = os.path.join(self.directory, "recording.json")
+        recorder.save(filename)
+
+        replayer = Replayer.load(filename)
+        replay_conn = replayer.attach(Mock(), "ec2")
+
+        self.assertEqual(replay_conn.make_request("DescribeInstances", {"InstanceId.1": "i-1"}).read(), "first")
+        replayer.clock.sleep(10)
+        self.assertEqual(replay_conn.make_request("DescribeInstances", {"InstanceId.1": "i-1"}).read(), "second")
+        with open(filename) as recording_file:
+            self.assertEqual(json.load(recording_file)["started_at"], 500)
@@ -1,9 +1,18 @@
+import threading
 from unittest import TestCase
 
 from mock import patch, Mock, ANY
 from boto.exception import BotoServerError
 from boto.cloudformation.stack import Parameter
-from aws_updater.stack import StackUpdater, BucketNotAccessibleException
+from aws_updater.asg import CancelledException
+from aws_updater.locking import LeaseTimeoutException
+from aws_updater.replay import VirtualClock
+from aws_updater.stack import AWSConnections, StackUpdater, BucketNotAccessibleException
+from aws_updater.template import TemplateValidationException
+
+
+SMALL_TEMPLATE = '{"Resources": {"any": {"Type": "AWS::SNS::Topic"}}}'
+LARGE_TEMPLATE = '{"Description": "%s", "Resources": {"any": {"Type": "AWS::SNS::Topic"}}}' % ("x" * 51200)
 
 
 def resource(typ, physical_resource_id):
@@ -94,11 +103,12 @@ class StackUpdaterTests(TestCase):
 
         self.assertEqual(result, template_contents)
 
+    @patch("aws_updater.stack.StackUpdater._validate_and_stage", return_value=None)
     @patch("aws_updater.stack.StackUpdater._do_update_or_create")
-    @patch("aws_updater.stack.StackUpdater._get_template")
+    @patch("aws_updater.stack.StackUpdater._preprocess_template")
     @patch("aws_updater.stack.wait_for_action_to_complete")
     @patch("aws_updater.stack.describe_stack")
-    def test_update_with_template_and_updated_parameters(self, describe_stack, wait_for_action_to_complete, get_template, do_update_or_create):
+    def test_update_with_template_and_updated_parameters(self, describe_stack, wait_for_action_to_complete, get_template, do_update_or_create, validate):
         template = "my-template.json"
         describe_stack.return_value.parameters = [parameter("amiId", "xyz"),
                                                   parameter("vpcId", "13")]
@@ -106,17 +116,20 @@ class StackUpdaterTests(TestCase):
 
         StackUpdater("any-stack-name", "any-aws-region").update_stack({"amiId": "123"}, template_filename=template)
 
+        validate.assert_called_with("json", {"amiId": "123", "vpcId": "13"}, None)
+
         get_template.assert_called_with(template)
         do_update_or_create.assert_called_with(self.cfn_conn.return_value.update_stack, "json", {"amiId": "123",
-                                                                                                 "vpcId": "13"})
-        wait_for_action_to_complete.assert_called_with(self.cfn_conn.return_value, "any-stack-name", ANY, ANY, ANY)
+                                                                                                 "vpcId": "13"}, None)
+        wait_for_action_to_complete.assert_called_with(self.cfn_conn.return_value, "any-stack-name", ANY, ANY, ANY, ANY)
 
 
+    @patch("aws_updater.stack.StackUpdater._validate_and_stage", return_value=None)
     @patch("aws_updater.stack.StackUpdater._do_update_or_create")
     @patch("aws_updater.stack.StackUpdater._get_template_of_running_stack")
     @patch("aws_updater.stack.wait_for_action_to_complete")
     @patch("aws_updater.stack.describe_stack")
-    def test_update_without_template(self, describe_stack, wait_for_action_to_complete, get_template, do_update_or_create):
+    def test_update_without_template(self, describe_stack, wait_for_action_to_complete, get_template, do_update_or_create, validate):
         stack_name = "any-stack-name"
         describe_stack.return_value.parameters.return_value = []
         get_template.return_value = "json"
@@ -124,14 +137,15 @@ class StackUpdaterTests(TestCase):
         StackUpdater(stack_name, "any-aws-region").update_stack({})
 
         get_template.assert_called_with(describe_stack.return_value)
-        do_update_or_create.assert_called_with(self.cfn_conn.return_value.update_stack, "json", {})
-        wait_for_action_to_complete.assert_called_with(self.cfn_conn.return_value, stack_name, ANY, ANY, ANY)
+        do_update_or_create.assert_called_with(self.cfn_conn.return_value.update_stack, "json", {}, None)
+        wait_for_action_to_complete.assert_called_with(self.cfn_conn.return_value, stack_name, ANY, ANY, ANY, ANY)
 
+    @patch("aws_updater.stack.StackUpdater._validate_and_stage", return_value=None)
     @patch("aws_updater.stack.StackUpdater._do_update_or_create")
-    @patch("aws_updater.stack.StackUpdater._get_template")
+    @patch("aws_updater.stack.StackUpdater._preprocess_template")
     @patch("aws_updater.stack.wait_for_action_to_complete")
     @patch("aws_updater.stack.describe_stack")
-    def test_create_stack(self, describe_stack, wait_for_action_to_complete, get_template, do_update_or_create):
+    def test_create_stack(self, describe_stack, wait_for_action_to_complete, get_template, do_update_or_create, validate):
         template = "my-template.json"
         describe_stack.return_value = None
         get_template.return_value = "json"
@@ -140,5 +154,243 @@ class StackUpdaterTests(TestCase):
         StackUpdater(stack_name, "any-aws-region").update_stack([], template_filename=template)
 
         get_template.assert_called_with(template)
-        do_update_or_create.assert_called_with(self.cfn_conn.return_value.create_stack, "json", [])
-        wait_for_action_to_complete.assert_called_with(self.cfn_conn.return_value, stack_name, ANY, ANY, ANY)
\ No newline at end of file
+        do_update_or_create.assert_called_with(self.cfn_conn.return_value.create_stack, "json", [], None)
+        wait_for_action_to_complete.assert_called_with(self.cfn_conn.return_value, stack_name, ANY, ANY, ANY, ANY)
+
+    def test_validate_should_not_call_cloudformation_when_local_checks_fail(self):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        self.assertRaises(TemplateValidationException, stack_updater._validate_and_stage, "this is no json", {}, None)
+        self.assertFalse(self.cfn_conn.return_value.validate_template.called)
+
+    def test_validate_should_call_cloudformation_once_per_template(self):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        stack_updater._validate_and_stage(SMALL_TEMPLATE, {}, None)
+        stack_updater._validate_and_stage(SMALL_TEMPLATE, {}, None)
+
+        self.cfn_conn.return_value.validate_template.assert_called_once_with(template_body=SMALL_TEMPLATE)
+
+    def test_validate_should_error_when_cloudformation_rejects_template(self):
+        self.cfn_conn.return_value.validate_template.side_effect = BotoServerError(400, "bang!")
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        self.assertRaises(TemplateValidationException, stack_updater._validate_and_stage, SMALL_TEMPLATE, {}, None)
+
+    def test_should_stage_large_template_in_bucket(self):
+        bucket = self.s3_conn.return_value.get_bucket.return_value
+        bucket.get_key.return_value = None
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", template_bucket="any-bucket")
+
+        template_url = stack_updater._validate_and_stage(LARGE_TEMPLATE, {}, None)
+
+        self.s3_conn.return_value.get_bucket.assert_called_with("any-bucket")
+        bucket.new_key.return_value.set_contents_from_string.assert_called_with(LARGE_TEMPLATE)
+        self.assertTrue(template_url.startswith("https://any-bucket.s3.any-aws-region.amazonaws.com/aws-ha-updater/"))
+        self.cfn_conn.return_value.validate_template.assert_called_with(template_url=template_url)
+
+    def test_should_not_upload_large_template_when_already_staged(self):
+        bucket = self.s3_conn.return_value.get_bucket.return_value
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", template_bucket="any-bucket")
+
+        stack_updater._validate_and_stage(LARGE_TEMPLATE, {}, None)
+
+        self.assertFalse(bucket.new_key.called)
+
+    def test_should_error_on_large_template_without_bucket(self):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        self.assertRaises(TemplateValidationException, stack_updater._validate_and_stage, LARGE_TEMPLATE, {}, None)
+
+    def test_should_pass_s3_template_as_url_without_downloading(self):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        result = stack_updater._get_template_or_url("s3://any-bucket/any-dir/any-template.json")
+
+        self.assertEqual(result, (None, "https://any-bucket.s3.any-aws-region.amazonaws.com/any-dir/any-template.json"))
+        self.assertFalse(self.s3_conn.return_value.get_bucket.called)
+
+    def test_should_pass_template_url_to_cloudformation(self):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+        action = Mock()
+
+        stack_updater._do_update_or_create(action, None, {"amiId": "123"}, "https://any-url")
+
+        action.assert_called_with("any-stack-name", parameters=[("amiId", "123")], capabilities=ANY,
+                                  template_url="https://any-url")
+
+    @patch("aws_updater.stack.StackUpdater._start_update_or_create", return_value=False)
+    @patch("aws_updater.stack.wait_for_action_to_complete")
+    def test_should_not_wait_for_stack_update_when_nothing_to_update(self, wait_for_action_to_complete, start):
+        result = StackUpdater("any-stack-name", "any-aws-region").update_stack({})
+
+        self.assertEqual(result, 0)
+        self.assertFalse(wait_for_action_to_complete.called)
+
+    @patch("aws_updater.stack.StackUpdater._start_update_or_create", return_value=True)
+    @patch("aws_updater.stack.wait_for_action_to_complete", return_value=3)
+    def test_should_return_result_of_stack_update(self, wait_for_action_to_complete, start):
+        self.assertEqual(StackUpdater("any-stack-name", "any-aws-region").update_stack({}), 3)
+
+    @patch("aws_updater.stack.StackUpdater._start_update_or_create", side_effect=TemplateValidationException("bang!"))
+    def test_should_publish_finished_event_when_stack_update_raises(self, start):
+        observer = Mock()
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", observer_callback=observer)
+
+        self.assertRaises(TemplateValidationException, stack_updater.update_stack, {})
+
+        self.assertEqual(observer.call_args[0][0], "STACK_UPDATE_FINISHED")
+        self.assertEqual(observer.call_args[0][0].result, None)
+
+    @patch("aws_updater.stack.EVENT_FLUSH_TIMEOUT_IN_SECONDS", 0.05)
+    @patch("aws_updater.stack.StackUpdater._start_update_or_create", side_effect=TemplateValidationException("bang!"))
+    def test_should_not_wait_for_hung_observer_after_stack_update(self, start):
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", observer_callback=lambda event: hung.wait())
+
+        self.assertRaises(TemplateValidationException, stack_updater.update_stack, {})
+        self.assertTrue(self.logger_mock.getLogger.return_value.warning.called)
+
+    def test_should_report_nothing_to_update(self):
+        action = Mock(side_effect=BotoServerError(400, "Bad Request",
+                                                  '{"Error": {"Message": "No updates are to be performed."}}'))
+
+        self.assertFalse(StackUpdater("any-stack-name", "any-aws-region")._do_update_or_create(action, "{}", {}))
+
+    @patch("aws_updater.stack.StackUpdater._validate_and_stage")
+    @patch("aws_updater.stack.StackUpdater._do_update_or_create")
+    @patch("aws_updater.stack.StackUpdater._preprocess_template", return_value='{"Resources":{}}')
+    @patch("aws_updater.stack.StackUpdater._get_template_of_running_stack", return_value='{\n  "Resources": {}\n}')
+    @patch("aws_updater.stack.describe_stack")
+    def test_should_not_update_stack_when_template_and_parameters_are_unchanged(self, describe_stack, running_template,
+                                                                                preprocess_template, do_update_or_create,
+                                                                                validate):
+        describe_stack.return_value.parameters = [parameter("amiId", "123")]
+
+        result = StackUpdater("any-stack-name", "any-aws-region").update_stack({"amiId": "123"}, "my-template.json")
+
+        self.assertEqual(result, 0)
+        self.assertFalse(validate.called)
+        self.assertFalse(do_update_or_create.called)
+
+    @patch("aws_updater.stack.StackUpdater._validate_and_stage", return_value=None)
+    @patch("aws_updater.stack.StackUpdater._get_template_of_running_stack", return_value="{}")
+    @patch("aws_updater.stack.ChangeSetUpdate")
+    @patch("aws_updater.stack.wait_for_action_to_complete", return_value=0)
+    @patch("aws_updater.stack.describe_stack")
+    def test_should_target_asgs_changed_by_change_set(self, describe_stack, wait_for_action_to_complete,
+                                                     change_set_update, running_template, validate):
+        describe_stack.return_value.parameters = []
+        change_set_update.return_value.run.return_value = True
+        change_set_update.return_value.get_asg_names_to_update.return_value = ["any-asg"]
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        self.assertEqual(stack_updater.update_stack({}, use_change_set=True), 0)
+
+        change_set_update.return_value.run.assert_called_with("{}", {}, None)
+        self.assertFalse(self.cfn_conn.return_value.update_stack.called)
+        self.assertEqual(stack_updater.changed_asg_names, ["any-asg"])
+
+    @patch("aws_updater.stack.describe_stack")
+    def test_should_update_only_given_asgs(self, describe_stack):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+
+        self.assertEqual(stack_updater.get_asgs([]), [])
+        stack_updater.get_asgs(["any-asg"])
+
+        self.asg_conn.return_value.get_all_groups.assert_called_once_with(names=["any-asg"])
+        self.assertFalse(describe_stack.called)
+
+    def test_should_hold_stack_lease_reentrantly(self):
+        store = Mock()
+        store.load.return_value = (None, 0)
+        store.compare_and_set.return_value = True
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", lease_store=store)
+
+        with patch("aws_updater.stack.Lease") as lease:
+            with stack_updater.stack_lease():
+                with stack_updater.stack_lease():
+                    with stack_updater.asg_lease("any-asg"):
+                        pass
+
+        self.assertEqual([c[0][1] for c in lease.call_args_list], ["stack/any-aws-region/any-stack-name",
+                                                                   "asg/any-aws-region/any-asg"])
+        self.assertEqual(lease.return_value.acquire.call_count, 2)
+        self.assertEqual(lease.return_value.release.call_count, 2)
+        self.assertEqual(lease.call_args[1]["on_lost"], stack_updater.lease_lost.set)
+        self.assertEqual(stack_updater.create_asg_updater(Mock())._lease_lost, stack_updater.lease_lost)
+
+    def test_should_let_nested_entries_wait_for_lease_and_fail_with_it(self):
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", lease_store=Mock())
+        acquiring = threading.Event()
+        timed_out = threading.Event()
+        self.addCleanup(timed_out.set)
+        entered = []
+        failed = []
+
+        def acquire(timeout_in_seconds):
+            acquiring.set()
+            timed_out.wait(5)
+            raise LeaseTimeoutException("bang!")
+
+        def enter():
+            try:
+                with stack_updater.stack_lease():
+                    entered.append(threading.current_thread().name)
+            except LeaseTimeoutException as e:
+                failed.append(e)
+
+        with patch("aws_updater.stack.Lease") as lease:
+            lease.return_value.acquire.side_effect = acquire
+            first = threading.Thread(target=enter)
+            first.start()
+            acquiring.wait(5)
+            second = threading.Thread(target=enter)
+            second.start()
+            second.join(0.1)
+            self.assertTrue(second.is_alive())
+            timed_out.set()
+            first.join(5)
+            second.join(5)
+
+        self.assertEqual(entered, [])
+        self.assertEqual(len(failed), 2)
+        self.assertEqual(lease.return_value.acquire.call_count, 1)
+        self.assertFalse(lease.return_value.release.called)
+        self.assertEqual(stack_updater._leases, {})
+
+    @patch("aws_updater.stack.ASGUpdater")
+    def test_should_skip_remaining_asgs_when_cancelled(self, asg_updater):
+        self.asg_conn.return_value.get_all_groups.return_value = [Mock(), Mock()]
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region")
+        asg_updater.return_value.update.side_effect = stack_updater.cancel
+
+        self.assertRaises(CancelledException, stack_updater.update_asgs, asg_names=["any-asg", "other-asg"])
+
+        self.assertEqual(asg_updater.return_value.update.call_count, 1)
+        self.assertEqual(asg_updater.call_args[1]["cancelled"], stack_updater.cancelled)
+
+    @patch("aws_updater.stack.ReadinessProber")
+    def test_should_close_readiness_prober_after_updating_asgs(self, readiness_prober):
+        StackUpdater("any-stack-name", "any-aws-region", readiness_probe=Mock()).update_asgs(asg_names=[])
+
+        readiness_prober.return_value.close.assert_called_with()
+
+    def test_should_share_elb_health_poller_between_updaters_of_same_connections(self):
+        connections = AWSConnections("any-aws-region")
+        first = StackUpdater("any-stack-name", "any-aws-region", connections=connections)
+        second = StackUpdater("other-stack-name", "any-aws-region", connections=connections)
+
+        self.assertTrue(first.create_asg_updater(Mock()).elb_health_poller is connections.elb_health_poller)
+        self.assertTrue(second.create_asg_updater(Mock()).elb_health_poller is connections.elb_health_poller)
+        self.assertFalse(StackUpdater("any-stack-name", "any-aws-region").elb_health_poller
+                         is connections.elb_health_poller)
+
+    def test_should_poll_elb_health_on_own_clock(self):
+        clock = VirtualClock(1000)
+        connections = AWSConnections("any-aws-region")
+
+        stack_updater = StackUpdater("any-stack-name", "any-aws-region", connections=connections, clock=clock)
+
+        self.assertTrue(stack_updater.elb_health_poller.clock is clock)
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from aws_updater.template import (TemplateValidationException, validate_stack_parameters, minify_template,
+                                  canonical_template_hash, s3_url_to_https_url)
+
+TEMPLATE = """
+{
+    "Parameters": {
+        "amiId": {"Type": "String", "AllowedPattern": "ami-[0-9a-f]+"},
+        "size": {"Type": "String", "Default": "small", "AllowedValues": ["small", "large"]},
+        "count": {"Type": "Number", "Default": "1"},
+        "password": {"Type": "String", "NoEcho": "true", "AllowedPattern": "[a-z]+"}
+    },
+    "Resources": {
+        "topic": {"Type": "AWS::SNS::Topic"}
+    }
+}
+"""
+
+
+class ValidateStackParametersTests(TestCase):
+
+    def test_should_accept_valid_parameters(self):
+        validate_stack_parameters(TEMPLATE, {"amiId": "ami-123abc", "size": "large", "count": "3",
+                                             "password": "****"})
+
+    def test_should_error_on_malformed_template(self):
+        self.assertRaises(TemplateValidationException, validate_stack_parameters, "{no json", {})
+
+    def test_should_error_on_template_without_resources(self):
+        self.assertRaises(TemplateValidationException, validate_stack_parameters, '{"Parameters": {}}', {})
+
+    def test_should_error_on_unknown_parameter(self):
+        self.assertRaisesRegexp(TemplateValidationException, "'vpcId' is not declared",
+                                validate_stack_parameters, TEMPLATE, {"amiId": "ami-1", "password": "x", "vpcId": "1"})
+
+    def test_should_error_on_missing_required_parameter(self):
+        self.assertRaisesRegexp(TemplateValidationException, "'amiId' is required",
+                                validate_stack_parameters, TEMPLATE, {"password": "x"})
+
+    def test_should_error_on_value_not_allowed(self):
+        self.assertRaisesRegexp(TemplateValidationException, "allowed values are: small, large",
+                                validate_stack_parameters, TEMPLATE, {"amiId": "ami-1", "password": "x", "size": "huge"})
+
+    def test_should_error_on_value_not_matching_pattern(self):
+        self.assertRaisesRegexp(TemplateValidationException, "does not match pattern",
+                                validate_stack_parameters, TEMPLATE, {"amiId": "ami-1-x", "password": "x"})
+
+    def test_should_error_on_non_numeric_number(self):
+        self.assertRaisesRegexp(TemplateValidationException, "not a number",
+                                validate_stack_parameters, TEMPLATE, {"amiId": "ami-1", "password": "x", "count": "many"})
+
+    def test_should_minify_template_with_sorted_keys(self):
+        self.assertEqual(minify_template('{\n  "b": [1, 2],\n  "a": "\\u00e4"\n}'), '{"a":"\xc3\xa4","b":[1,2]}')
+
+    def test_canonical_hash_should_ignore_formatting_and_key_order(self):
+        self.assertEqual(canonical_template_hash('{"a": 1, "b": 2}'), canonical_template_hash('{"b":2,\n"a":1}'))
+        self.assertNotEqual(canonical_template_hash('{"a": 1}'), canonical_template_hash('{"a": 2}'))
+
+
+class S3UrlToHttpsUrlTests(TestCase):
+
+    def test_should_use_regional_endpoint(self):
+        self.assertEqual(s3_url_to_https_url("s3://any-bucket/any-dir/any.json", "eu-south-1"),
+                         "https://any-bucket.s3.eu-south-1.amazonaws.com/any-dir/any.json")
+
+    def test_should_address_bucket_with_dots_by_path(self):
+        self.assertEqual(s3_url_to_https_url("s3://any.dotted.bucket/any.json", "eu-west-1"),
+                         "https://s3.eu-west-1.amazonaws.com/any.dotted.bucket/any.json")
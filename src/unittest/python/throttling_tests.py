@@ -0,0 +1,97 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from aws_updater.throttling import TokenBucket, RateLimiter, throttle
+
+
+def response(status, body=""):
+    return Mock(status=status, read=Mock(return_value=body))
+
+
+class TokenBucketTests(TestCase):
+
+    @patch("aws_updater.throttling.time.time", return_value=100)
+    def test_should_allow_burst_and_then_queue_callers_in_order(self, time):
+        bucket = TokenBucket(rate=2, burst=3)
+
+        waits = [bucket.reserve() for _ in range(5)]
+
+        self.assertEqual(waits, [0, 0, 0, 0.5, 1.0])
+
+
+class RateLimiterTests(TestCase):
+
+    def test_should_use_budget_per_service_and_region(self):
+        rate_limiter = RateLimiter({"ec2": (1, 1)})
+        rate_limiter.set_budget("ec2", 7, 3, region="eu-west-1")
+
+        self.assertEqual(rate_limiter.bucket("ec2", "eu-west-1").rate, 7)
+        self.assertEqual(rate_limiter.bucket("ec2", "us-east-1").rate, 1)
+        self.assertTrue(rate_limiter.bucket("ec2", "us-east-1") is rate_limiter.bucket("ec2", "us-east-1"))
+
+    def test_should_be_saturated_while_bucket_is_empty(self):
+        rate_limiter = RateLimiter({"ec2": (0.1, 1)})
+
+        rate_limiter.acquire("ec2", "eu-west-1")
+
+        self.assertTrue(rate_limiter.is_saturated("ec2"))
+        self.assertTrue(rate_limiter.is_saturated("ec2", "eu-west-1"))
+        self.assertFalse(rate_limiter.is_saturated("ec2", "us-east-1"))
+        self.assertFalse(rate_limiter.is_saturated("elb"))
+
+    def test_should_be_saturated_while_throttled_request_is_retried(self):
+        rate_limiter = RateLimiter()
+        make_request = Mock(side_effect=[response(400, "<Code>Throttling</Code>"), response(200)])
+        conn = throttle(Mock(make_request=make_request), "autoscaling", "eu-west-1", rate_limiter)
+        saturated_while_backing_off = []
+
+        with patch("aws_updater.throttling.time.sleep",
+                   side_effect=lambda delay: saturated_while_backing_off.append(rate_limiter.is_saturated("autoscaling"))):
+            conn.make_request("DescribeAutoScalingGroups")
+
+        self.assertEqual(saturated_while_backing_off, [True])
+        self.assertFalse(rate_limiter.is_saturated("autoscaling"))
+
+
+class ThrottleTests(TestCase):
+
+    def setUp(self):
+        self.sleep = patch("aws_updater.throttling.time.sleep").start()
+        self.rate_limiter = Mock(RateLimiter)
+        self.make_request = Mock()
+        self.conn = Mock(make_request=self.make_request)
+        throttle(self.conn, "ec2", "any-region", self.rate_limiter, max_retries=2)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_should_acquire_token_for_every_request(self):
+        self.make_request.return_value = response(200)
+
+        self.conn.make_request("DescribeInstances")
+
+        self.rate_limiter.acquire.assert_called_with("ec2", "any-region")
+        self.make_request.assert_called_with("DescribeInstances")
+
+    def test_should_retry_throttled_requests(self):
+        ok = response(200)
+        self.make_request.side_effect = [response(400, "<Code>RequestLimitExceeded</Code>"), ok]
+
+        self.assertTrue(self.conn.make_request("DescribeInstances") is ok)
+        self.assertEqual(self.rate_limiter.acquire.call_count, 2)
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_should_not_retry_other_errors(self):
+        error = response(400, "<Code>ValidationError</Code>")
+        self.make_request.return_value = error
+
+        self.assertTrue(self.conn.make_request("DescribeInstances") is error)
+        self.assertEqual(self.make_request.call_count, 1)
+
+    def test_should_give_up_after_max_retries(self):
+        throttled = response(400, "<Code>Throttling</Code>")
+        self.make_request.return_value = throttled
+
+        self.assertTrue(self.conn.make_request("DescribeInstances") is throttled)
+        self.assertEqual(self.make_request.call_count, 3)
@@ -0,0 +1,118 @@
+from StringIO import StringIO
+from datetime import datetime
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from aws_updater.replay import VirtualClock
+from aws_updater.watch import StackWatcher
+
+STARTED_AT = 1000000
+
+
+def event(event_id, at, stack_name, status, logical_resource_id=None, resource_type="AWS::CloudFormation::Stack"):
+    return Mock(event_id=event_id, timestamp=datetime.utcfromtimestamp(STARTED_AT + at), stack_name=stack_name,
+                resource_type=resource_type, logical_resource_id=logical_resource_id or stack_name,
+                resource_status=status, resource_status_reason=None)
+
+
+class StackWatcherTests(TestCase):
+
+    def setUp(self):
+        patch("sys.stdout", StringIO()).start()
+        self.clock = VirtualClock(STARTED_AT)
+        self.cfn_conn = Mock()
+        self.events = {"stack-a": [], "stack-b": []}
+        self.requests = []
+
+        def describe_stack_events(stack_name):
+            self.requests.append((self.clock.time(), stack_name))
+            return [e for e in self.events[stack_name] if e.timestamp <= datetime.utcfromtimestamp(self.clock.time())]
+
+        self.cfn_conn.describe_stack_events.side_effect = describe_stack_events
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_should_interleave_new_events_oldest_first(self):
+        self.events["stack-a"] = [event("a2", 2, "stack-a", "UPDATE_IN_PROGRESS", "lc", "AWS::AutoScaling::LaunchConfiguration"),
+                                  event("a1", 0, "stack-a", "UPDATE_IN_PROGRESS")]
+        self.events["stack-b"] = [event("b1", 1, "stack-b", "UPDATE_IN_PROGRESS")]
+        self.clock.sleep(3)
+        watcher = StackWatcher(self.cfn_conn, ["stack-a", "stack-b"], clock=self.clock, lenient_look_back=5)
+
+        self.assertEqual([e.event_id for e in watcher.poll()], ["a1", "b1", "a2"])
+        self.clock.sleep(10)
+        self.assertEqual(watcher.poll(), [])
+
+    def test_should_ignore_events_before_watch_started(self):
+        self.events["stack-a"] = [event("a1", 0, "stack-a", "UPDATE_COMPLETE")]
+        self.clock.sleep(100)
+        watcher = StackWatcher(self.cfn_conn, ["stack-a"], clock=self.clock)
+
+        self.assertEqual(watcher.poll(), [])
+        self.assertFalse(watcher.is_done())
+
+    def test_should_stay_within_request_budget(self):
+        watcher = StackWatcher(self.cfn_conn, ["stack-a", "stack-b"], requests_per_second=0.5, clock=self.clock)
+
+        watcher.poll()
+
+        self.assertEqual(self.requests, [(STARTED_AT, "stack-a"), (STARTED_AT + 2, "stack-b")])
+
+    def test_should_poll_active_stacks_more_often_than_idle_ones(self):
+        self.events["stack-a"] = [event("a1", 0, "stack-a", "UPDATE_IN_PROGRESS")]
+        watcher = StackWatcher(self.cfn_conn, ["stack-a", "stack-b"], requests_per_second=10, clock=self.clock,
+                               active_interval_in_seconds=2, idle_interval_in_seconds=30)
+
+        for _ in range(10):
+            watcher.poll()
+            watcher._sleep_until_next_poll()
+
+        polled = [stack_name for (at, stack_name) in self.requests]
+        self.assertEqual(polled.count("stack-b"), 1)
+        self.assertEqual(polled.count("stack-a"), 10)
+
+    def test_should_poll_stack_as_active_on_resource_events_only(self):
+        self.events["stack-a"] = [event("a1", 0, "stack-a", "UPDATE_IN_PROGRESS", "lc", "AWS::AutoScaling::LaunchConfiguration")]
+        self.clock.sleep(10)
+        watcher = StackWatcher(self.cfn_conn, ["stack-a"], requests_per_second=10, clock=self.clock,
+                               active_interval_in_seconds=2, idle_interval_in_seconds=30, lenient_look_back=15)
+
+        for _ in range(5):
+            watcher.poll()
+            watcher._sleep_until_next_poll()
+
+        self.assertTrue(watcher._stacks["stack-a"].active)
+        self.assertEqual(len(self.requests), 5)
+        self.assertTrue(self.requests[-1][0] <= STARTED_AT + 10 + 4 * 2)
+
+    def test_should_stop_watching_finished_stacks(self):
+        self.events["stack-a"] = [event("a2", 10, "stack-a", "UPDATE_COMPLETE"),
+                                  event("a1", 0, "stack-a", "UPDATE_IN_PROGRESS")]
+        self.events["stack-b"] = [event("b2", 20, "stack-b", "UPDATE_ROLLBACK_COMPLETE"),
+                                  event("b1", 0, "stack-b", "UPDATE_ROLLBACK_IN_PROGRESS")]
+        watcher = StackWatcher(self.cfn_conn, ["stack-a", "stack-b"], clock=self.clock)
+
+        self.assertEqual(watcher.watch(), 1)
+        self.assertEqual(watcher.finished, {"stack-a": "UPDATE_COMPLETE", "stack-b": "UPDATE_ROLLBACK_COMPLETE"})
+        self.assertEqual(set(stack_name for (at, stack_name) in self.requests if at > STARTED_AT + 12), set(["stack-b"]))
+        self.assertTrue(self.requests[-1][0] < STARTED_AT + 23)
+
+    def test_should_stop_watching_deleted_stacks(self):
+        self.cfn_conn.describe_stack_events.side_effect = Exception("Stack with id stack-a does not exist")
+        watcher = StackWatcher(self.cfn_conn, ["stack-a"], clock=self.clock)
+
+        self.assertEqual(watcher.watch(), 0)
+
+    def test_should_discover_stacks_by_prefix(self):
+        self.cfn_conn.describe_stacks.return_value = [Mock(stack_name="stack-a", stack_status="UPDATE_IN_PROGRESS"),
+                                                      Mock(stack_name="stack-b", stack_status="DELETE_COMPLETE"),
+                                                      Mock(stack_name="other", stack_status="UPDATE_COMPLETE")]
+        watcher = StackWatcher(self.cfn_conn, prefix="stack-", clock=self.clock)
+
+        watcher.poll()
+
+        self.assertEqual(self.requests, [(STARTED_AT + 1, "stack-a")])
+        self.assertTrue(watcher._stacks["stack-a"].active)
+        self.assertFalse(watcher.is_done())